@@ -0,0 +1,113 @@
+"""
+Benchmark: the per-claim coding pipeline, stage by stage, on seeded synthetic
+notes of varying length, term density and dictionary size:
+  nlp             CodingEngine._placeholder_nlp
+  coding_job      CodingEngine.run_coding_job (NLP, phase decision, mock submission)
+  cdi_nudges      cdi_api.get_cdi_nudges
+  fhir_map        NphiesPayloadMixin._map_to_fhir_claim_bundle (shared by both connectors)
+  fhir_validate   NphiesPayloadMixin._validate_fhir (default Bundle schema)
+Writes a JSON report (throughput, p50/p95/p99 latency, peak traced memory
+per case) to stdout or --output, and a readable table to stderr. Pass
+--baseline with a report from another commit to print the relative change
+per case; --max-regression makes the run fail on a larger throughput drop.
+Run from the repository root:
+    python -m benchmarks.bench_coding_pipeline --output bench.json
+    python -m benchmarks.bench_coding_pipeline --quick --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+from typing import Any, Dict, List, Mapping, Optional
+from benchmarks.runner import MEMORY_INPUTS, WARMUP_INPUTS, compare, measure, print_table, report
+from benchmarks.synthetic_notes import SEED, synthetic_dictionary, synthetic_notes
+from src.backend import cdi_api
+from src.backend.coding_engine import CodingEngine
+from src.backend.nphies_connector import FHIR_BUNDLE_SCHEMA, NphiesPayloadMixin
+SUITE = "coding_pipeline"
+DICTIONARY_SIZES = [5, 500, 5_000]
+NOTE_WORDS = [100, 1_000]
+TERM_DENSITIES = [0.01, 0.05]
+CLAIM_ITEMS = [1, 10, 50]
+INPUTS_PER_CASE = 200
+QUICK_INPUTS_PER_CASE = 40
+COMPLEXITIES = ["low-complexity outpatient", "standard"]
+def engine_for(term_map: Mapping[str, Any]) -> CodingEngine:
+    """A CodingEngine whose dictionary is `term_map` (matchers are cached per dictionary)."""
+    return type("BenchCodingEngine", (CodingEngine,), {"TERM_TO_CODE_MAP": term_map})()
+def note_cases(rng: random.Random, count: int, quick: bool):
+    sizes = DICTIONARY_SIZES[::2] if quick else DICTIONARY_SIZES
+    for size, words, density in itertools.product(sizes, NOTE_WORDS, TERM_DENSITIES):
+        term_map = synthetic_dictionary(size, rng)
+        yield {"dictionary": size, "words": words, "density": density}, term_map, \
+            synthetic_notes(count, list(term_map), rng, words, density)
+def claim_payloads(engine: CodingEngine, rng: random.Random, count: int, items: int) -> List[Dict[str, Any]]:
+    codes = [{"code": f"Z{i:05d}", "desc": f"Synthetic diagnosis {i}", "confidence": 0.9} for i in range(items)]
+    return [engine._create_claim_payload({"id": f"ENC-{n}", "patient_id": f"PAT-{rng.randrange(10**6)}",
+                                          "provider_cr": "CR-BENCH"}, codes) for n in range(count)]
+class QuietConnector:
+    """Accepts AUTONOMOUS claims without MockNphiesConnector's console output, which would swamp the timings."""
+    def submit_claim(self, claim_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {"success": True, "claimId": claim_data.get("claimNumber"), "status": "SENT"}
+def run(count: int, quick: bool = False) -> List[Dict[str, Any]]:
+    rng = random.Random(SEED)
+    results = []
+    for params, term_map, notes in note_cases(rng, count, quick):
+        engine = engine_for(term_map)
+        results.append(measure("nlp", engine._placeholder_nlp, notes, params))
+        if params["dictionary"] != DICTIONARY_SIZES[0]:
+            continue  # The CDI and phase rules do not depend on the dictionary size
+        engine.nphies_connector = QuietConnector()
+        jobs = [(note, {"id": f"ENC-{i}", "visit_complexity": COMPLEXITIES[i % 2]}) for i, note in enumerate(notes)]
+        results.append(measure("coding_job", lambda job: engine.run_coding_job(*job), jobs, params))
+        # Fresh notes: the API's rule engine caches results per note text.
+        cdi_notes = synthetic_notes(count, list(term_map), rng, params["words"], params["density"])
+        results.append(measure("cdi_nudges", cdi_api.get_cdi_nudges, cdi_notes, params))
+    mapper = NphiesPayloadMixin()
+    engine = CodingEngine()
+    for items in CLAIM_ITEMS:
+        claims = claim_payloads(engine, rng, count, items)
+        bundles = [mapper._map_to_fhir_claim_bundle(claim) for claim in claims]
+        results.append(measure("fhir_map", mapper._map_to_fhir_claim_bundle, claims, {"items": items}))
+        results.append(measure("fhir_validate", lambda bundle: mapper._validate_fhir(bundle, FHIR_BUNDLE_SCHEMA),
+                               bundles, {"items": items}))
+    return results
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the coding pipeline stages.")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    parser.add_argument("--quick", action="store_true", help="Fewer inputs and dictionary sizes (for a smoke run).")
+    parser.add_argument("--inputs", type=int, help=f"Inputs per case (default: {INPUTS_PER_CASE}, {QUICK_INPUTS_PER_CASE} with --quick).")
+    parser.add_argument("--baseline", help="A previous JSON report to compare against.")
+    parser.add_argument("--max-regression", type=float,
+                        help="With --baseline, exit 1 when any case's throughput drops by more than this fraction.")
+    args = parser.parse_args(argv)
+    minimum = WARMUP_INPUTS + MEMORY_INPUTS + 1
+    if args.inputs is not None and args.inputs < minimum:
+        parser.error(f"--inputs must be at least {minimum}.")
+    return args
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    count = args.inputs or (QUICK_INPUTS_PER_CASE if args.quick else INPUTS_PER_CASE)
+    results = run(count, args.quick)
+    print_table(results)
+    current = report(SUITE, results, SEED)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(current, fh, indent=2)
+    else:
+        print(json.dumps(current, indent=2))
+    if not args.baseline:
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    regressed = False
+    print(f"\nvs {baseline.get('commit') or args.baseline}:", file=sys.stderr)
+    for row in compare(current, baseline):
+        label = row["name"] + " " + " ".join(f"{k}={v}" for k, v in row["params"].items())
+        print(f"{label[:52]:<52} throughput {row['throughput_change']:>+8.1%}  p95 {row['p95_change']:>+8.1%}", file=sys.stderr)
+        if args.max_regression is not None and row["throughput_change"] < -args.max_regression:
+            regressed = True
+    return 1 if regressed else 0
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""
+Benchmark: DRG grouping and monthly CMI rollups over large encounter batches.
+Compares DRGGrouper's column-wise grouping against a per-encounter Python
+loop over the same table lookup.
+Run from the repository root:
+    python -m benchmarks.bench_drg_grouper
+"""
+import time
+import numpy as np
+from src.backend.drg_grouper import DRGGrouper, period_keys
+BATCH_SIZES = [10_000, 100_000, 1_000_000]
+LOOP_MAX = 100_000  # The per-row loop is only timed up to this size.
+SEED = 1337
+CODES = ["J18.9", "J18.1", "I21.9", "I21.4", "K37", "N39.0", "S82.90XA", "S82.101A", "R69", "E11.9"]
+def synthetic_batch(n: int, rng: np.random.Generator):
+    days = rng.integers(0, 365, size=n)
+    return {
+        "principal_codes": rng.choice(CODES, size=n),
+        "encounter_types": rng.choice(["INPATIENT", "OUTPATIENT", "ED"], size=n),
+        "secondary_counts": rng.integers(0, 4, size=n),
+        "providers": rng.choice([f"PROV-{i:03d}" for i in range(200)], size=n),
+        "dates": np.datetime64("2024-01-01") + days.astype("timedelta64[D]"),
+    }
+def per_row(grouper: DRGGrouper, batch) -> float:
+    start = time.perf_counter()
+    totals = {}
+    for code, etype, secondary, provider, date in zip(batch["principal_codes"].tolist(), batch["encounter_types"].tolist(),
+                                                      batch["secondary_counts"].tolist(), batch["providers"].tolist(),
+                                                      batch["dates"].astype("datetime64[M]").astype(str).tolist()):
+        idx = grouper._resolve(code, etype, secondary > 0)
+        if idx:
+            entry = totals.setdefault((provider, date), [0, 0.0])
+            entry[0] += 1
+            entry[1] += grouper.weights[idx]
+    return time.perf_counter() - start
+def vectorized(grouper: DRGGrouper, batch) -> float:
+    start = time.perf_counter()
+    idx = grouper.group(batch["principal_codes"], batch["encounter_types"], batch["secondary_counts"])
+    grouper.rollup(idx, batch["providers"], period_keys(batch["dates"]))
+    return time.perf_counter() - start
+def main():
+    rng = np.random.default_rng(SEED)
+    grouper = DRGGrouper()
+    print(f"{'encounters':>11} {'loop s':>9} {'vectorized s':>13} {'encounters/s':>14} {'speedup':>8}")
+    for size in BATCH_SIZES:
+        batch = synthetic_batch(size, rng)
+        fast = vectorized(grouper, batch)
+        if size <= LOOP_MAX:
+            slow = per_row(grouper, batch)
+            print(f"{size:>11} {slow:>9.3f} {fast:>13.3f} {size / fast:>14.0f} {slow / fast:>7.1f}x")
+        else:
+            print(f"{size:>11} {'skipped':>9} {fast:>13.3f} {size / fast:>14.0f} {'':>8}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark: FHIR Bundle validation throughput for bundles of 1 to 500 claims.
+Compares per-call `jsonschema.validate` (the previous behaviour) against the
+cached validators in FhirValidatorRegistry, for the toy Bundle schema and the
+full nphies Claim profile.
+Run from the repository root:
+    python -m benchmarks.bench_fhir_validation
+"""
+import time
+import jsonschema
+from typing import Any, Dict
+from src.backend.fhir_validation import FhirValidatorRegistry, NPHIES_CLAIM_BUNDLE_SCHEMA
+from src.backend.nphies_connector import FHIR_BUNDLE_SCHEMA
+BUNDLE_SIZES = [1, 10, 50, 100, 500]
+MIN_SECONDS = 0.5
+def profile_claim_entry(i: int) -> Dict[str, Any]:
+    return {
+        "fullUrl": f"urn:uuid:BENCH-{i}",
+        "resource": {
+            "resourceType": "Claim",
+            "status": "active",
+            "type": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/claim-type", "code": "institutional"}]},
+            "use": "claim",
+            "patient": {"reference": f"Patient/PAT-{i}"},
+            "created": "2024-05-01T10:00:00+03:00",
+            "provider": {"reference": "Organization/PROVIDER-001"},
+            "priority": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/processpriority", "code": "normal"}]},
+            "insurance": [{"sequence": 1, "focal": True, "coverage": {"reference": f"Coverage/COV-{i}"}}],
+            "item": [{
+                "sequence": n + 1,
+                "productOrService": {"coding": [{"system": "http://hl7.org/fhir/sid/icd-10", "code": "J18.9"}]},
+                "net": {"value": 250.0, "currency": "SAR"},
+            } for n in range(3)],
+            "total": {"value": 750.0, "currency": "SAR"},
+        },
+        "request": {"method": "POST", "url": "Claim"},
+    }
+def bundle_of(size: int) -> Dict[str, Any]:
+    return {"resourceType": "Bundle", "type": "batch", "entry": [profile_claim_entry(i) for i in range(size)]}
+def bundles_per_second(fn) -> float:
+    calls, start = 0, time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SECONDS:
+            return calls / elapsed
+def main():
+    registry = FhirValidatorRegistry()
+    print(f"{'schema':>8} {'claims':>7} {'validate/s':>12} {'registry/s':>12} {'claims/s (registry)':>20} {'speedup':>8}")
+    for name, schema in (("toy", FHIR_BUNDLE_SCHEMA), ("nphies", NPHIES_CLAIM_BUNDLE_SCHEMA)):
+        for size in BUNDLE_SIZES:
+            bundle = bundle_of(size)
+            assert registry.is_valid(bundle, schema)
+            baseline = bundles_per_second(lambda: jsonschema.validate(instance=bundle, schema=schema))
+            cached = bundles_per_second(lambda: registry.errors(bundle, schema))
+            print(f"{name:>8} {size:>7} {baseline:>12.1f} {cached:>12.1f} {cached * size:>20.0f} {cached / baseline:>7.1f}x")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Benchmark: per-note latency of CodingEngine term matching as the dictionary grows.
+Compares the precompiled TermMatcher against the legacy per-term regex scan.
+Run from the repository root:
+    python -m benchmarks.bench_term_matcher
+"""
+import random
+import re
+import statistics
+import time
+from typing import Any, Dict, List
+from benchmarks.synthetic_notes import SEED, synthetic_dictionary, synthetic_note
+from src.backend.term_matcher import TermMatcher
+DICTIONARY_SIZES = [5, 50, 500, 5_000, 50_000]
+LEGACY_MAX_TERMS = 5_000  # The regex loop becomes too slow to bother measuring beyond this.
+NOTES_PER_RUN = 50
+def legacy_scan(term_map: Dict[str, Any], text: str) -> List[Dict[str, Any]]:
+    text_lower = text.lower()
+    return [info for term, info in term_map.items() if re.search(r'\b' + re.escape(term) + r'\b', text_lower)]
+def time_per_note(fn, notes: List[str]) -> float:
+    samples = []
+    for note in notes:
+        start = time.perf_counter()
+        fn(note)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+def main():
+    rng = random.Random(SEED)
+    print(f"{'terms':>8} {'build_ms':>10} {'matcher_us/note':>16} {'legacy_us/note':>15}")
+    for size in DICTIONARY_SIZES:
+        term_map = synthetic_dictionary(size, rng)
+        notes = [synthetic_note(list(term_map), rng) for _ in range(NOTES_PER_RUN)]
+        start = time.perf_counter()
+        matcher = TermMatcher(term_map)
+        build_ms = (time.perf_counter() - start) * 1e3
+        matcher_us = time_per_note(matcher.matched_indices, notes)
+        if size <= LEGACY_MAX_TERMS:
+            legacy_us = f"{time_per_note(lambda n: legacy_scan(term_map, n), notes):15.1f}"
+        else:
+            legacy_us = f"{'skipped':>15}"
+        print(f"{size:>8} {build_ms:>10.1f} {matcher_us:>16.1f} {legacy_us}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Load test: drives NphiesConnector over real sockets against the local mock
+nphies server (src/backend/mock_nphies_server.py) and reports sustained
+claims/sec, error rates by kind and p50/p95/p99 end-to-end latency, with the
+server's fault counters and the connector's rate limiter metrics, as JSON.
+Claims go out one per request (`--mode single`, submit_claim) or packed into
+batch Bundles (`--mode bundle`, submit_claims). The client-side claim rate
+limit is off unless --client-rate is given, so the connector's own retry,
+token refresh and AIMD concurrency logic are what is measured.
+Run from the repository root:
+    python -m benchmarks.load_nphies --claims 2000 --concurrency 8 --latency lognormal:0.02:0.5 \\
+        --throttle-rate 0.02 --error-rate 0.01 --token-lifetime 5
+    python -m benchmarks.load_nphies --url http://127.0.0.1:8089 --duration 60 --mode bundle
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from benchmarks.runner import percentile
+from src.backend.mock_nphies_server import MockNphiesServer, parse_latency
+from src.backend.nphies_connector import NphiesAPIError, NphiesAuthError, NphiesConnector
+from src.backend.rate_limiter import NphiesRateLimiter
+SEED = 1337
+def synthetic_claim(n: int, rng: random.Random) -> Dict[str, Any]:
+    return {
+        "claimNumber": f"LOAD-{n:07d}",
+        "patient": {"id": f"PAT-{rng.randrange(10**6):06d}"},
+        "items": [{"serviceCode": rng.choice(["J18.9", "I21.9", "K37", "N39.0"]), "description": "Load test item"}
+                  for _ in range(rng.randint(1, 5))],
+    }
+class LoadRun:
+    """Worker threads pull batches from a shared counter until the claim count or the deadline is reached."""
+    def __init__(self, connector: NphiesConnector, claims: Optional[int], duration: Optional[float],
+                 concurrency: int, mode: str, bundle_size: int, seed: int = SEED):
+        self.connector = connector
+        self.claims = claims
+        self.duration = duration
+        self.concurrency = concurrency
+        self.mode = mode
+        self.batch = bundle_size if mode == "bundle" else 1
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next = 0
+        self.latencies: List[float] = []
+        self.outcomes: Counter = Counter()
+    def _take(self, deadline: Optional[float]) -> List[Dict[str, Any]]:
+        with self._lock:
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+            count = self.batch if self.claims is None else min(self.batch, self.claims - self._next)
+            start, self._next = self._next, self._next + max(0, count)
+            return [synthetic_claim(n, self._rng) for n in range(start, start + count)]
+    def _submit(self, batch: List[Dict[str, Any]]) -> Counter:
+        outcomes: Counter = Counter()
+        try:
+            if self.mode == "bundle":
+                for result in self.connector.submit_claims(batch, max_bundle_entries=self.batch, bundle_type="batch"):
+                    outcomes["ok" if result["success"] else "claim_rejected"] += 1
+            else:
+                self.connector.submit_claim(batch[0])
+                outcomes["ok"] += 1
+        except NphiesAuthError:
+            outcomes["auth_error"] += len(batch)
+        except NphiesAPIError as e:
+            kind = "timeout" if "timed out" in str(e) else "api_error"
+            outcomes[kind] += len(batch)
+        return outcomes
+    def _worker(self, deadline: Optional[float]):
+        while True:
+            batch = self._take(deadline)
+            if not batch:
+                return
+            start = time.perf_counter()
+            outcomes = self._submit(batch)
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.latencies.append(elapsed)
+                self.outcomes.update(outcomes)
+    def run(self) -> Dict[str, Any]:
+        deadline = time.monotonic() + self.duration if self.duration else None
+        threads = [threading.Thread(target=self._worker, args=(deadline,), name=f"load-{i}") for i in range(self.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+        total = sum(self.outcomes.values())
+        latencies = sorted(self.latencies)
+        return {
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "bundle_size": self.batch,
+            "seconds": round(seconds, 3),
+            "claims": total,
+            "requests": len(latencies),
+            "claims_per_sec": round(self.outcomes["ok"] / seconds, 2) if seconds else None,
+            "error_rate": round(1 - self.outcomes["ok"] / total, 4) if total else None,
+            "outcomes": dict(self.outcomes),
+            "latency_ms": {
+                **{f"p{p}": round(percentile(latencies, p) * 1e3, 2) for p in (50, 95, 99)},
+                "max": round(latencies[-1] * 1e3, 2) if latencies else 0.0,
+            },
+        }
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Drive NphiesConnector against a mock nphies server.")
+    parser.add_argument("--url", help="An already running mock server; by default one is started in-process.")
+    parser.add_argument("--claims", type=int, help="Claims to submit (default: 2000, or unlimited with --duration).")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Worker threads sharing one connector.")
+    parser.add_argument("--mode", choices=["single", "bundle"], default="single")
+    parser.add_argument("--bundle-size", type=int, default=50, help="Claims per Bundle with --mode bundle.")
+    parser.add_argument("--timeout", type=float, default=5, help="Connector request timeout (seconds).")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--backoff-base", type=float, default=0.05, help="Connector retry backoff base (seconds).")
+    parser.add_argument("--client-rate", type=float, help="Client-side claim rate limit (requests/sec).")
+    server = parser.add_argument_group("in-process mock server")
+    server.add_argument("--latency", help="fixed:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA (seconds).")
+    server.add_argument("--token-lifetime", type=float, help="Seconds until issued tokens are rejected with 401.")
+    server.add_argument("--throttle-rate", type=float, default=0.0)
+    server.add_argument("--error-rate", type=float, default=0.0)
+    server.add_argument("--retry-after", type=float, default=0.1)
+    server.add_argument("--slow-body-rate", type=float, default=0.0)
+    server.add_argument("--slow-body-delay", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args(argv)
+    if args.claims is None and args.duration is None:
+        args.claims = 2000
+    return args
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    server = None
+    if args.url is None:
+        server = MockNphiesServer(
+            latency=parse_latency(args.latency, random.Random(args.seed)) if args.latency else None,
+            token_lifetime=args.token_lifetime, throttle_rate=args.throttle_rate, error_rate=args.error_rate,
+            retry_after=args.retry_after, slow_body_rate=args.slow_body_rate, slow_body_delay=args.slow_body_delay,
+            seed=args.seed,
+        ).start()
+    rate_limiter = NphiesRateLimiter({"claim": {"rate": args.client_rate, "burst": args.client_rate}})
+    connector = NphiesConnector(server.url if server else args.url, "load-test", "load-test-secret", timeout=args.timeout,
+                                rate_limiter=rate_limiter, max_retries=args.max_retries, backoff_base=args.backoff_base)
+    try:
+        result = LoadRun(connector, args.claims, args.duration, args.concurrency, args.mode, args.bundle_size, args.seed).run()
+    finally:
+        if server is not None:
+            server.stop()
+    report = {**result, "server": server.stats() if server else None, "client": rate_limiter.metrics()}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+if __name__ == "__main__":
+    sys.exit(main())
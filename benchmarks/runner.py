@@ -0,0 +1,113 @@
+"""
+Shared benchmark runner: times a callable over a list of inputs and reports
+throughput, latency percentiles and peak traced memory as JSON-ready dicts,
+plus helpers to write a report and compare it with a baseline from another
+commit.
+Each input is used exactly once (warm-up, then timing, then a separate
+tracemalloc pass), so result caches never turn a measurement into a cache hit.
+"""
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+WARMUP_INPUTS = 5
+MEMORY_INPUTS = 10
+def percentile(sorted_samples: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted samples."""
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[max(1, math.ceil(len(sorted_samples) * pct / 100)) - 1]
+def measure(name: str, fn: Callable[[Any], Any], inputs: Sequence[Any], params: Optional[Dict[str, Any]] = None,
+            items_per_call: int = 1, warmup: int = WARMUP_INPUTS, memory_inputs: int = MEMORY_INPUTS) -> Dict[str, Any]:
+    """
+    Calls `fn` on each input. The first `warmup` inputs are not measured; the
+    last `memory_inputs` are re-run under tracemalloc (which slows Python
+    down, so they are not timed) to find the largest per-call peak.
+    `items_per_call` scales throughput, e.g. claims per Bundle.
+    """
+    if len(inputs) <= warmup + memory_inputs:
+        raise ValueError(f"{name}: need more than {warmup + memory_inputs} inputs, got {len(inputs)}.")
+    timed = inputs[warmup:len(inputs) - memory_inputs]
+    for item in inputs[:warmup]:
+        fn(item)
+    samples = []
+    clock = time.perf_counter
+    for item in timed:
+        start = clock()
+        fn(item)
+        samples.append(clock() - start)
+    total = sum(samples)
+    samples.sort()
+    peak = 0
+    tracemalloc.start()
+    try:
+        for item in inputs[len(inputs) - memory_inputs:]:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            fn(item)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return {
+        "name": name,
+        "params": params or {},
+        "calls": len(samples),
+        "seconds": round(total, 6),
+        "ops_per_sec": round(len(samples) / total, 2),
+        "items_per_sec": round(len(samples) * items_per_call / total, 2),
+        "latency_us": {
+            "mean": round(total / len(samples) * 1e6, 2),
+            **{f"p{pct}": round(percentile(samples, pct) * 1e6, 2) for pct in (50, 95, 99)},
+            "max": round(samples[-1] * 1e6, 2),
+        },
+        "peak_memory_bytes": peak,
+    }
+def case_key(result: Dict[str, Any]) -> str:
+    return result["name"] + json.dumps(result["params"], sort_keys=True)
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+def report(suite: str, results: List[Dict[str, Any]], seed: int) -> Dict[str, Any]:
+    return {
+        "suite": suite,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "results": results,
+    }
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Pairs the cases of two reports; `throughput_change` and `p95_change` are
+    fractions (0.1 = 10% higher than the baseline). Cases missing from
+    either report are skipped.
+    """
+    before = {case_key(r): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        old = before.get(case_key(result))
+        if old is None or not old["latency_us"]["p95"]:
+            continue
+        rows.append({
+            "name": result["name"],
+            "params": result["params"],
+            "throughput_change": round(result["ops_per_sec"] / old["ops_per_sec"] - 1, 4),
+            "p95_change": round(result["latency_us"]["p95"] / old["latency_us"]["p95"] - 1, 4),
+        })
+    return rows
+def print_table(results: List[Dict[str, Any]], file=sys.stderr):
+    print(f"{'case':<52} {'ops/s':>11} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} {'peak KiB':>9}", file=file)
+    for r in results:
+        label = r["name"] + " " + " ".join(f"{k}={v}" for k, v in r["params"].items())
+        lat = r["latency_us"]
+        print(f"{label[:52]:<52} {r['ops_per_sec']:>11.1f} {lat['p50']:>10.1f} {lat['p95']:>10.1f} "
+              f"{lat['p99']:>10.1f} {r['peak_memory_bytes'] / 1024:>9.1f}", file=file)
@@ -0,0 +1,30 @@
+"""
+Seeded synthetic clinical notes and term dictionaries for the benchmarks.
+The same seed always produces the same dictionaries and notes, so numbers
+from different commits are measured on identical inputs.
+"""
+import random
+import string
+from typing import List
+from src.backend.coding_engine import CodingEngine
+from src.backend.term_matcher import FrozenTerms
+SEED = 1337
+FILLER_WORDS = ["patient", "presents", "with", "history", "of", "denies", "and", "the", "exam", "stable"]
+def synthetic_dictionary(size: int, rng: random.Random) -> FrozenTerms:
+    """
+    The engine's TERM_TO_CODE_MAP padded with random one- to three-word terms up
+    to `size` entries, frozen like the engine's own so matcher lookups stay O(1).
+    """
+    terms = dict(CodingEngine.TERM_TO_CODE_MAP)
+    while len(terms) < size:
+        words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))) for _ in range(rng.randint(1, 3))]
+        terms[" ".join(words)] = {"code": f"Z{len(terms):05d}", "desc": "Synthetic term", "confidence": 0.5}
+    return FrozenTerms(list(terms.items())[:size])
+def synthetic_note(terms: List[str], rng: random.Random, words: int = 400, density: float = 0.02) -> str:
+    """A note of `words` tokens where each token is a dictionary term with probability `density`."""
+    out = []
+    for _ in range(words):
+        out.append(rng.choice(terms) if rng.random() < density else rng.choice(FILLER_WORDS))
+    return " ".join(out) + "."
+def synthetic_notes(count: int, terms: List[str], rng: random.Random, words: int = 400, density: float = 0.02) -> List[str]:
+    return [synthetic_note(terms, rng, words, density) for _ in range(count)]
@@ -51,7 +51,7 @@ export interface CodingJob {
   id: string;
   encounter_id: string;
   suggested_codes: SuggestedCode[];
-  status: 'NEEDS_REVIEW' | 'AUTO_DROP' | 'SENT_TO_NPHIES' | 'REJECTED';
+  status: 'NEEDS_REVIEW' | 'AUTO_DROP' | 'QUEUED_FOR_NPHIES' | 'SENT_TO_NPHIES' | 'SUBMISSION_FAILED' | 'REJECTED';
   confidence_score: number;
   phase: 'CAC' | 'SEMI_AUTONOMOUS' | 'AUTONOMOUS';
   created_at: string; // ISO string
@@ -85,13 +85,15 @@ CREATE TABLE coding_jobs (
   source_text TEXT,
   suggested_codes JSONB,    -- e.g., [{ "code": "J18.9", "desc": "Pneumonia...", "confidence": 0.82 }]
   final_codes JSONB,        -- Codes accepted after human review or autonomous decision
-  status VARCHAR(32) DEFAULT 'NEEDS_REVIEW', -- NEEDS_REVIEW | AUTO_DROP | SENT_TO_NPHIES | REJECTED
+  status VARCHAR(32) DEFAULT 'NEEDS_REVIEW', -- NEEDS_REVIEW | AUTO_DROP | QUEUED_FOR_NPHIES | SENT_TO_NPHIES | SUBMISSION_FAILED | REJECTED
   confidence_score NUMERIC(5,2) DEFAULT 0,
   phase VARCHAR(32) DEFAULT 'CAC', -- CAC | SEMI_AUTONOMOUS | AUTONOMOUS
   created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
   updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
 );
 CREATE INDEX idx_coding_jobs_encounter_id ON coding_jobs(encounter_id);
+-- One coding result per encounter and engine version; bulk ingestion upserts on this key.
+CREATE UNIQUE INDEX uq_coding_jobs_encounter_engine ON coding_jobs(encounter_id, engine_version);
 -- 7) Payments: For reconciling payments received against submitted claims.
 CREATE TABLE payments (
   id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
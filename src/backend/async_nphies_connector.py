@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+import httpx
+from typing import Dict, Any, List, Optional, Sequence
+try:
+    from .nphies_connector import (
+        ClaimSubmissionResult, NphiesAPIError, NphiesAuthError, NphiesPayloadMixin,
+        NphiesValidationError,
+    )
+    from .rate_limiter import NphiesRateLimiter, is_retryable, jittered_backoff, parse_retry_after
+    from .token_manager import AsyncTokenManager, OAuthTokenManager, default_token_cache_path
+    from .instrumentation import registry as metrics
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from nphies_connector import (
+        ClaimSubmissionResult, NphiesAPIError, NphiesAuthError, NphiesPayloadMixin,
+        NphiesValidationError,
+    )
+    from rate_limiter import NphiesRateLimiter, is_retryable, jittered_backoff, parse_retry_after
+    from token_manager import AsyncTokenManager, OAuthTokenManager, default_token_cache_path
+    from instrumentation import registry as metrics
+logger = logging.getLogger(__name__)
+__all__ = ["AsyncNphiesConnector", "NphiesAuthError", "NphiesAPIError", "NphiesValidationError"]
+class AsyncNphiesConnector(NphiesPayloadMixin):
+    """
+    asyncio sibling of NphiesConnector with the same methods and exceptions.
+    Requests share one keep-alive connection pool (httpx.AsyncClient), a
+    semaphore caps how many nphies calls are in flight at once, and every call
+    has an overall deadline covering queueing, token refresh and retries.
+    Auth and retries follow NphiesConnector: tokens come from an
+    OAuthTokenManager (pass a sync connector's `token_manager` to share its
+    token, or `share_token_across_processes=True` for the file cache), and
+    retryable responses (see `is_retryable`) honor Retry-After or else wait a
+    jittered exponential backoff.
+    Use it as an async context manager, or call `aclose()` when done:
+        async with AsyncNphiesConnector(base_url, client_id, client_secret) as nphies:
+            results = await asyncio.gather(*(nphies.check_status(c) for c in claim_ids))
+    """
+    def __init__(
+        self,
+        base_url: str,
+        client_id: str,
+        client_secret: str,
+        timeout: float = 15,
+        verify: bool = True,
+        max_concurrency: int = 100,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        deadline: Optional[float] = None,
+        retries: int = 3,
+        backoff_base: float = 1.0,
+        backoff_cap: float = 30.0,
+        client: Optional[httpx.AsyncClient] = None,
+        bundle_schema: Optional[Dict[str, Any]] = None,
+        token_manager: Optional[OAuthTokenManager] = None,
+        share_token_across_processes: bool = False,
+        token_cache_dir: Optional[str] = None,
+    ):
+        self.base_url = base_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+        if bundle_schema is not None:
+            self.bundle_schema = bundle_schema
+        self.deadline = deadline if deadline is not None else timeout * (retries + 1)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.verify = verify
+        self._token_client: Optional[httpx.Client] = None
+        if token_manager is None:
+            cache_path = default_token_cache_path(base_url, client_id, token_cache_dir) if share_token_across_processes else None
+            token_manager = OAuthTokenManager(self._fetch_oauth_token, cache_path=cache_path)
+        self.token_manager = token_manager
+        self._tokens = AsyncTokenManager(token_manager)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = client or httpx.AsyncClient(
+            timeout=timeout,
+            verify=verify,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections),
+        )
+    async def __aenter__(self) -> "AsyncNphiesConnector":
+        return self
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    async def aclose(self):
+        await self.client.aclose()
+        if self._token_client is not None:
+            self._token_client.close()
+    async def _get_oauth_token(self) -> str:
+        return await self._tokens.get_token()
+    def _fetch_oauth_token(self) -> Dict[str, Any]:
+        """Performs the client-credentials grant; called by the token manager only, on a worker thread."""
+        now = time.time()
+        token_url = f"{self.base_url}/oauth/token"
+        payload = {
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+        }
+        if self._token_client is None:
+            self._token_client = httpx.Client(timeout=self.timeout, verify=self.verify)
+        try:
+            response = self._token_client.post(token_url, data=payload)
+            response.raise_for_status()
+            token_info = response.json()
+            return {
+                "access_token": token_info["access_token"],
+                "expires_at": now + token_info.get("expires_in", 3600),
+            }
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            logger.error("OAuth token request failed: %s", e, extra={"event": "nphies_token_error", "url": token_url})
+            metrics.inc("nphies_request_errors_total", kind="auth")
+            raise NphiesAuthError("Failed to obtain OAuth token from nphies.") from e
+    async def _get_auth_headers(self) -> Dict[str, str]:
+        with metrics.stage("auth"):
+            token = await self._get_oauth_token()
+        return {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/fhir+json",
+            "Accept": "application/fhir+json",
+        }
+    async def _send(self, method: str, url: str, extra_headers: Optional[Dict[str, str]] = None, endpoint: str = "default",
+                    **kwargs) -> httpx.Response:
+        attempt = 0
+        extra_headers = extra_headers or {}
+        while True:
+            headers = {**(await self._get_auth_headers()), **extra_headers}
+            response = await self._http(method, url, endpoint, headers, **kwargs)
+            # Handle OAuth token refresh on 401 Unauthorized
+            if response.status_code == 401 and "token" in response.text.lower():
+                logger.info("Token expired or invalid, attempting refresh...",
+                            extra={"event": "nphies_token_rejected", "url": url, "method": method})
+                metrics.inc("nphies_401_replays_total")
+                # Force token refresh; concurrent 401s for the same token trigger only one.
+                await self._tokens.invalidate(headers["Authorization"].split(" ", 1)[1])
+                headers = {**(await self._get_auth_headers()), **extra_headers}
+                response = await self._http(method, url, endpoint, headers, **kwargs)
+            # POSTs are only retried when nphies did not process them; see is_retryable.
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if not is_retryable(method, response.status_code, retry_after) or attempt >= self.retries:
+                return response
+            if retry_after is not None and retry_after > self.backoff_cap:
+                return response  # The server asked for a longer pause than we are willing to wait for.
+            metrics.inc("nphies_retries_total", endpoint=endpoint, status=response.status_code)
+            attempt += 1
+            await asyncio.sleep(retry_after if retry_after is not None
+                                else jittered_backoff(attempt - 1, self.backoff_base, self.backoff_cap))
+    async def _http(self, method: str, url: str, endpoint: str, headers: Dict[str, str], **kwargs) -> httpx.Response:
+        with metrics.stage("http"):
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+        metrics.inc("nphies_responses_total", endpoint=endpoint, status=response.status_code)
+        return response
+    async def _request(self, method: str, path: str, deadline: Optional[float] = None, headers: Optional[Dict[str, str]] = None, **kwargs) -> Any:
+        url = f"{self.base_url}{path}"
+        try:
+            async with asyncio.timeout(deadline if deadline is not None else self.deadline):
+                async with self._semaphore:
+                    response = await self._send(method, url, extra_headers=headers,
+                                                endpoint=NphiesRateLimiter.classify(method, path), **kwargs)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error("Nphies API request to %s failed with status %s: %s", url, e.response.status_code, e.response.text,
+                         extra={"event": "nphies_http_error", "url": url, "method": method, "status": e.response.status_code})
+            metrics.inc("nphies_request_errors_total", kind="http_status")
+            raise NphiesAPIError(f"API Error: {e.response.status_code} - {e.response.text}") from e
+        except (httpx.TimeoutException, TimeoutError):
+            logger.error("Nphies API request to %s timed out.", url, extra={"event": "nphies_timeout", "url": url, "method": method})
+            metrics.inc("nphies_request_errors_total", kind="timeout")
+            raise NphiesAPIError("Request to nphies timed out.")
+        except httpx.HTTPError as e:
+            logger.error("Nphies API request to %s failed: %s", url, e, extra={"event": "nphies_network_error", "url": url, "method": method})
+            metrics.inc("nphies_request_errors_total", kind="network")
+            raise NphiesAPIError(f"A network error occurred: {e}") from e
+        except ValueError as e:  # Response body is not JSON
+            logger.error("Nphies API request to %s returned an invalid response: %s", url, e,
+                         extra={"event": "nphies_invalid_response", "url": url, "method": method})
+            metrics.inc("nphies_request_errors_total", kind="invalid_response")
+            raise NphiesAPIError(f"Invalid response from nphies: {e}") from e
+    async def submit_claim(self, claim_data: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Submits a claim to the nphies /claims endpoint.
+        Maps internal data to a FHIR Bundle and validates it before sending.
+        """
+        fhir_bundle = self._map_to_fhir_claim_bundle(claim_data)
+        self._validate_fhir(fhir_bundle, self.bundle_schema)
+        return await self._request("POST", "/Claim", deadline=deadline, json=fhir_bundle)
+    async def request_pre_auth(self, auth_data: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Submits a pre-authorization request (FHIR Claim with use=preauthorization).
+        """
+        return await self._request("POST", "/Claim", deadline=deadline, json={"use": "preauthorization", **auth_data})
+    async def check_status(self, claim_id: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Checks the status of a previously submitted claim.
+        """
+        response = await self._request("GET", f"/Claim/{claim_id}", deadline=deadline)
+        return self._parse_claim_status(claim_id, response)
+    async def reconcile_payment(self, payment_data: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Sends payment reconciliation data (FHIR PaymentNotice).
+        """
+        return await self._request("POST", "/PaymentNotice", deadline=deadline, json=payment_data)
+    async def submit_claims(
+        self,
+        claims: Sequence[Dict[str, Any]],
+        max_bundle_entries: int = 100,
+        max_bundle_bytes: Optional[int] = None,
+        compress: bool = False,
+        bundle_type: str = "transaction",
+        deadline: Optional[float] = None,
+    ) -> List[ClaimSubmissionResult]:
+        """
+        Submits many claims packed into Bundles, sending the Bundles concurrently.
+        See NphiesConnector.submit_claims for packing and result semantics.
+        """
+        bundles, results = self._pack_claim_bundles(claims, max_bundle_entries, max_bundle_bytes, bundle_type)
+        async def send_bundle(bundle: Dict[str, Any], indices: List[int]):
+            body, headers = self._encode_bundle(bundle, compress)
+            batch = [claims[i] for i in indices]
+            try:
+                response = await self._request("POST", "", deadline=deadline, headers=headers, content=body)
+                parsed = self._parse_bundle_response(batch, response)
+            except NphiesAPIError as e:
+                parsed = [self._claim_result(claim_data, error=str(e)) for claim_data in batch]
+            results.update(zip(indices, parsed))
+        await asyncio.gather(*(send_bundle(bundle, indices) for bundle, indices in bundles))
+        return [results[i] for i in range(len(claims))]
@@ -1,7 +1,28 @@
-from fastapi import FastAPI
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from typing import Any, AsyncIterator, Dict, List, Optional, Literal
+try:
+    from .cdi_executor import AnalysisTimeoutError, ExecutorSaturatedError, cdi_executor_from_env, retry_after_header
+    from .cdi_rules import CDIRuleEngine, RulePackError, outside_pack_roots, rule_pack_paths_from_env
+    from .cdi_sessions import DraftSessionError, DraftSessionStore, RevisionConflictError
+    from .instrumentation import configure_logging, registry as metrics
+    from .result_cache import result_cache_from_env
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from cdi_executor import AnalysisTimeoutError, ExecutorSaturatedError, cdi_executor_from_env, retry_after_header
+    from cdi_rules import CDIRuleEngine, RulePackError, outside_pack_roots, rule_pack_paths_from_env
+    from cdi_sessions import DraftSessionError, DraftSessionStore, RevisionConflictError
+    from instrumentation import configure_logging, registry as metrics
+    from result_cache import result_cache_from_env
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    configure_logging()
+    yield
+    analysis_executor.shutdown()
 app = FastAPI(
+    lifespan=lifespan,
     title="Solventum CDI Nudge API",
     description="Provides real-time Clinical Documentation Integrity (CDI) feedback on draft notes.",
     version="1.0.0"
@@ -19,9 +40,56 @@ class AnalyzeRequest(BaseModel):
 class AnalyzeResponse(BaseModel):
     nudges: List[Nudge]
     summary: str
+    degraded: bool = Field(False, description="True when the time budget ran out and only critical nudges were evaluated.")
+class TextDelta(BaseModel):
+    start: int = Field(..., ge=0, description="Start offset of the replaced range in the current note.")
+    end: int = Field(..., ge=0, description="End offset (exclusive) of the replaced range.")
+    text: str = Field("", description="Replacement text; empty for a deletion.")
+class DraftSessionUpdateRequest(BaseModel):
+    deltas: List[TextDelta] = Field(..., description="Edits applied in order; each refers to the text left by the previous one.")
+    base_revision: Optional[int] = Field(None, description="Revision the deltas were computed against; rejected with 409 if stale.")
+class DraftSessionResponse(BaseModel):
+    session_id: str
+    revision: int
+    added: List[Nudge] = Field(default_factory=list, description="Nudges that appeared since the previous revision.")
+    resolved: List[str] = Field(default_factory=list, description="IDs of nudges resolved since the previous revision.")
+    summary: str
+class ReloadRulesRequest(BaseModel):
+    pack_paths: Optional[List[str]] = Field(None, description="Rule pack files or directories within the configured CDI_RULE_PACKS; defaults to the currently loaded ones.")
+class RuleStats(BaseModel):
+    id: str
+    evaluations: int = Field(..., description="Times the rule was checked because its keyword matched.")
+    fired: int = Field(..., description="Times the rule fired, including notes answered from the result cache.")
+    est_cost_ns: int = Field(0, description="Estimate: the rule's share of evaluation wall time, each computed note's time split evenly among the rules it checked.")
+    est_mean_cost_ns: float = Field(0.0, description="Estimate: est_cost_ns per evaluation of the rule.")
+class RulesStatusResponse(BaseModel):
+    version: str
+    rule_count: int
+    term_count: int
+    loaded_at: float
+    notes_evaluated: int = 0
+    cache_hits: int = 0
+    total_eval_ns: int = 0
+    mean_eval_ns: float = Field(0.0, description="Mean wall time per computed note (one scan plus rule checks).")
+    rules: List[RuleStats] = Field(default_factory=list)
+class CacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    memory_hits: int
+    store_hits: int
+    evictions: int
+    expired: int
+    size: int
+    hit_rate: float
 # --- CDI Rules Engine ---
 # A simple, deterministic ruleset for identifying common documentation gaps.
-# In a real system, this could be a more complex, configurable engine.
+# These built-in rules are always loaded; additional JSON/YAML rule packs can be
+# supplied via the CDI_RULE_PACKS environment variable (os.pathsep-separated
+# files or directories) and hot-reloaded through POST /rules/reload.
+# Results are cached per note content and rule set version; set RESULT_CACHE_PATH
+# to add a SQLite tier shared across restarts.
+# Analysis runs on a bounded worker pool (CDI_ANALYSIS_WORKERS, CDI_ANALYSIS_QUEUE)
+# with a per-request budget (CDI_ANALYSIS_BUDGET_MS); see cdi_executor.py.
 CDI_RULES = [
     {
         "id": "pneumonia_specificity",
@@ -54,29 +122,189 @@ CDI_RULES = [
         }
     }
 ]
+result_cache = result_cache_from_env()
+# POST /rules/reload may only pick packs from these files/directories.
+RULE_PACK_ROOTS = rule_pack_paths_from_env()
+rule_engine = CDIRuleEngine(base_rules=CDI_RULES, pack_paths=RULE_PACK_ROOTS, result_cache=result_cache)
+draft_sessions = DraftSessionStore(rule_engine)
+analysis_executor = cdi_executor_from_env()
 def get_cdi_nudges(note: str) -> List[Nudge]:
     """
-    Analyzes a clinical note against a set of deterministic CDI rules.
-    """
-    found_nudges = []
-    note_lower = note.lower()
-    for rule in CDI_RULES:
-        if rule["keyword"] in note_lower:
-            # Check if any negation keyword is present, which would satisfy the rule
-            is_satisfied = any(neg_keyword in note_lower for neg_keyword in rule["negation_keywords"])
-            if not is_satisfied:
-                found_nudges.append(Nudge(**rule["nudge"]))
-    return found_nudges
+    Analyzes a clinical note against the compiled CDI rule set.
+    A rule fires when its keyword is present and none of its negation keywords
+    are; all keywords are matched in a single pass over the note.
+    """
+    return [Nudge(**nudge) for nudge in rule_engine.evaluate(note)]
 # --- API Endpoint ---
 @app.post("/analyze_draft_note", response_model=AnalyzeResponse)
 async def analyze_draft_note(request: AnalyzeRequest):
     """
     Accepts a draft clinical note and returns a list of CDI "nudges"
     to prompt the physician for greater specificity before saving.
+    Responds 429 when the analysis queue is full and 503 when the time budget
+    ran out before any result was available; both carry a Retry-After header.
+    When over budget with critical rules evaluated, only critical nudges are
+    returned and `degraded` is set.
+    """
+    try:
+        outcome = await analysis_executor.analyze(rule_engine, request.clinical_note)
+    except ExecutorSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=retry_after_header(e.retry_after))
+    except AnalysisTimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers=retry_after_header(e.retry_after))
+    nudges = [Nudge(**nudge) for nudge in outcome.nudges]
+    return AnalyzeResponse(nudges=nudges, summary=_analysis_summary(len(nudges), outcome.degraded), degraded=outcome.degraded)
+def _analysis_summary(count: int, degraded: bool = False) -> str:
+    summary = f"Found {count} potential documentation improvement(s)."
+    if degraded:
+        summary += " Analysis exceeded its time budget; only critical findings are shown."
+    return summary
+# --- Batch Analysis ---
+# Batch results are built as plain dicts and serialized straight to NDJSON;
+# their shape matches AnalyzeResponse plus `index` (position in the request)
+# and `encounter_id`, without constructing pydantic models per note.
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+def _nudge_dict(nudge: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": nudge["id"], "severity": nudge["severity"], "prompt": nudge["prompt"],
+            "fields": nudge.get("fields", []), "suggested_text": nudge.get("suggested_text")}
+def _ndjson_line(result: Dict[str, Any]) -> bytes:
+    return json.dumps(result, separators=(",", ":")).encode() + b"\n"
+def _parse_batch_entry(entry: Any) -> Dict[str, Any]:
+    if isinstance(entry, bytes):
+        entry = json.loads(entry)
+    if not isinstance(entry, dict) or not isinstance(entry.get("clinical_note"), str):
+        raise ValueError("expected an object with a string 'clinical_note'")
+    return entry
+async def _stream_batch(entries: List[Any]) -> AsyncIterator[bytes]:
+    valid: Dict[int, Dict[str, Any]] = {}
+    for index, entry in enumerate(entries):
+        try:
+            valid[index] = _parse_batch_entry(entry)
+        except ValueError as e:
+            yield _ndjson_line({"index": index, "error": f"Invalid AnalyzeRequest: {e}"})
+    notes = ((index, entry["clinical_note"]) for index, entry in valid.items())
+    async for index, outcome in analysis_executor.analyze_many(rule_engine, notes):
+        if isinstance(outcome, AnalysisTimeoutError):
+            yield _ndjson_line({"index": index, "encounter_id": valid[index].get("encounter_id"), "error": str(outcome)})
+            continue
+        nudges = [_nudge_dict(n) for n in outcome.nudges]
+        yield _ndjson_line({"index": index, "encounter_id": valid[index].get("encounter_id"), "nudges": nudges,
+                            "summary": _analysis_summary(len(nudges), outcome.degraded), "degraded": outcome.degraded})
+@app.post("/analyze_draft_note/batch")
+async def analyze_draft_note_batch(request: Request):
+    """
+    Analyzes many draft notes in parallel. The body is either a JSON array of
+    AnalyzeRequest objects or an NDJSON upload (Content-Type
+    application/x-ndjson). Results stream back as NDJSON in completion order,
+    one AnalyzeResponse per line with the `index` of its request; malformed
+    entries and notes that ran out of time yield an `error` line instead.
+    Each note gets the same time budget and critical-first degradation as
+    /analyze_draft_note; batch notes only use idle workers, and the request
+    is refused with 429 while the analysis queue is full.
+    """
+    # The upload is read in full before the response starts streaming.
+    body = await request.body()
+    if NDJSON_MEDIA_TYPE in request.headers.get("content-type", ""):
+        entries = [line for line in body.split(b"\n") if line.strip()]
+    else:
+        try:
+            entries = json.loads(body)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Body is not valid JSON: {e}")
+        if not isinstance(entries, list):
+            raise HTTPException(status_code=422, detail="Expected a JSON array of AnalyzeRequest objects or an NDJSON body.")
+    if analysis_executor.saturated:
+        raise HTTPException(status_code=429, detail="CDI analysis queue is full.", headers=retry_after_header(analysis_executor.retry_after))
+    return StreamingResponse(_stream_batch(entries), media_type=NDJSON_MEDIA_TYPE)
+def _draft_session_response(session, added, resolved) -> DraftSessionResponse:
+    summary = f"{len(session.nudges)} open documentation improvement(s); {len(added)} added, {len(resolved)} resolved."
+    return DraftSessionResponse(
+        session_id=session.session_id,
+        revision=session.revision,
+        added=[Nudge(**n) for n in added],
+        resolved=resolved,
+        summary=summary,
+    )
+def _apply_session_deltas(session, deltas: List[Dict[str, Any]], base_revision: Optional[int]) -> DraftSessionResponse:
+    # Runs on the analysis pool; the session lock is only ever taken there, never on the event loop.
+    with session.lock:
+        added, resolved = session.apply_deltas(deltas, base_revision)
+        return _draft_session_response(session, added, resolved)
+async def _run_analysis(fn, *args):
+    try:
+        return await analysis_executor.run(fn, *args)
+    except ExecutorSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=retry_after_header(e.retry_after))
+@app.post("/draft_sessions", response_model=DraftSessionResponse, status_code=201)
+async def open_draft_session(request: AnalyzeRequest):
+    """
+    Opens an incremental analysis session for a draft note. The response lists
+    every nudge for the initial text as `added`. Analysis runs on the shared
+    analysis pool; responds 429 with Retry-After when its queue is full.
+    """
+    session = await _run_analysis(draft_sessions.create, request.clinical_note, request.encounter_id)
+    return _draft_session_response(session, session.nudges, [])
+@app.post("/draft_sessions/{session_id}/deltas", response_model=DraftSessionResponse)
+async def update_draft_session(session_id: str, request: DraftSessionUpdateRequest):
+    """
+    Applies text deltas to a draft session. Only the edited lines are
+    re-analyzed, and only nudges that were added or resolved are returned.
+    Like session creation, this runs on the analysis pool and may answer 429.
+    """
+    session = draft_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Draft session not found or expired.")
+    try:
+        return await _run_analysis(_apply_session_deltas, session, [d.model_dump() for d in request.deltas], request.base_revision)
+    except RevisionConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except DraftSessionError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+@app.delete("/draft_sessions/{session_id}", status_code=204)
+async def close_draft_session(session_id: str):
+    """
+    Closes a draft session once the note is saved or abandoned.
+    """
+    if not draft_sessions.close(session_id):
+        raise HTTPException(status_code=404, detail="Draft session not found or expired.")
+@app.get("/rules", response_model=RulesStatusResponse)
+async def get_rules_status():
+    """
+    Reports the active rule set version, per-note evaluation cost, and per-rule
+    counts with each rule's estimated share of that cost.
+    """
+    return rule_engine.stats()
+@app.post("/rules/reload", response_model=RulesStatusResponse)
+async def reload_rules(request: Optional[ReloadRulesRequest] = None):
+    """
+    Recompiles the built-in rules plus rule packs and swaps them in atomically.
+    On a validation error the previous rule set stays active. Requested pack
+    paths must lie within the rule pack locations configured at startup.
+    """
+    if request and request.pack_paths is not None:
+        outside = outside_pack_roots(request.pack_paths, RULE_PACK_ROOTS)
+        if outside:
+            raise HTTPException(status_code=403, detail=f"Rule pack paths outside the configured rule pack locations: {outside}")
+    try:
+        rule_engine.reload(request.pack_paths if request else None)
+    except RulePackError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return rule_engine.stats()
+@app.get("/cache", response_model=CacheStatsResponse)
+async def get_cache_stats():
+    """
+    Reports result cache hit/miss counters.
+    """
+    return result_cache.stats()
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus scrape endpoint: per-stage latency histograms and pipeline
+    counters recorded by this process. 404 unless METRICS_ENABLED is set.
     """
-    nudges = get_cdi_nudges(request.clinical_note)
-    summary = f"Found {len(nudges)} potential documentation improvement(s)."
-    return AnalyzeResponse(nudges=nudges, summary=summary)
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled; set METRICS_ENABLED=1.")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 # To run this API locally:
 # 1. Install fastapi and uvicorn: pip install fastapi "uvicorn[standard]"
 # 2. Run the server: uvicorn cdi_api:app --reload
\ No newline at end of file
@@ -0,0 +1,193 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+BATCH_ADMISSION_POLL = 0.005  # Seconds between admission attempts while a batch waits for a free worker
+class ExecutorSaturatedError(Exception):
+    """Raised when every worker is busy and the analysis queue is full."""
+    def __init__(self, retry_after: float):
+        super().__init__("CDI analysis queue is full.")
+        self.retry_after = retry_after
+class AnalysisTimeoutError(Exception):
+    """Raised when the time budget ran out before even the critical rules were evaluated."""
+    def __init__(self, retry_after: float):
+        super().__init__("CDI analysis did not finish within its time budget.")
+        self.retry_after = retry_after
+class AnalysisOutcome(NamedTuple):
+    nudges: List[Dict[str, Any]]
+    degraded: bool  # True when only critical-severity nudges could be evaluated within the budget
+    elapsed: float
+def _resolve_once(future: asyncio.Future, value: Any):
+    if not future.done():
+        future.set_result(value)
+def _consume_result(future: asyncio.Future):
+    # Results of abandoned (over-budget) analyses are dropped without "never retrieved" warnings.
+    if not future.cancelled():
+        future.exception()
+class _Analysis(NamedTuple):
+    future: Future
+    critical: asyncio.Future  # Resolved with the critical nudges as soon as they are known
+    abandoned: threading.Event
+    started: float
+    def abandon(self):
+        self.abandoned.set()  # A running analysis stops after its critical rules
+        self.future.cancel()  # Only succeeds while still queued, which frees the slot for fresher requests
+class CDIAnalysisExecutor:
+    """
+    Runs CPU-bound CDI analysis off the event loop on a bounded thread pool.
+    Rule evaluation is pure Python, so under the GIL the pool keeps the event
+    loop responsive but does not add throughput beyond one core; scale out
+    with more server processes (e.g. uvicorn --workers) instead of threads.
+    At most `max_workers + max_queue` analyses are admitted at once; beyond
+    that `analyze` fails fast with ExecutorSaturatedError instead of letting
+    latency grow without bound. Each analysis has a time budget: the engine
+    evaluates critical rules first (`evaluate_prioritized`), so when the full
+    evaluation overruns, the critical nudges are returned as a degraded result
+    and the abandoned analysis stops before the remaining rules, so it frees
+    its worker and admission slot early instead of finishing in the background.
+    """
+    def __init__(self, max_workers: int = 4, max_queue: int = 32, time_budget: float = 1.0, retry_after: float = 1.0):
+        if max_workers < 1 or max_queue < 0 or time_budget <= 0:
+            raise ValueError("max_workers must be >= 1, max_queue >= 0 and time_budget > 0.")
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.time_budget = time_budget
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cdi-analysis")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counts = {"completed": 0, "degraded": 0, "rejected": 0, "timed_out": 0}
+    def _count(self, key: str):
+        with self._lock:
+            self._counts[key] += 1
+    def _try_admit(self, limit: int) -> bool:
+        with self._lock:
+            if self._in_flight >= limit:
+                return False
+            self._in_flight += 1
+            return True
+    def _admit(self):
+        if not self._try_admit(self.max_workers + self.max_queue):
+            self._count("rejected")
+            raise ExecutorSaturatedError(self.retry_after)
+    def _release(self, _future: Optional[Future] = None):
+        with self._lock:
+            self._in_flight -= 1
+    @property
+    def saturated(self) -> bool:
+        return self._in_flight >= self.max_workers + self.max_queue
+    async def analyze(self, engine: Any, note: Any, time_budget: Optional[float] = None) -> AnalysisOutcome:
+        """
+        Evaluates `note` with `engine.evaluate_prioritized` within the time budget
+        (seconds; defaults to the executor's). Raises ExecutorSaturatedError or
+        AnalysisTimeoutError when the request should be retried later.
+        """
+        self._admit()
+        return await self._outcome(self._start(engine, note), self.time_budget if time_budget is None else time_budget)
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Runs `fn(*args)` on the analysis pool under the same admission limit as
+        `analyze` (ExecutorSaturatedError when full) but without a time budget,
+        for work that must finish once started, such as draft session updates.
+        """
+        self._admit()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+    def _start(self, engine: Any, note: Any) -> "_Analysis":
+        """Submits an admitted analysis; its slot is released when the pool future finishes."""
+        loop = asyncio.get_running_loop()
+        critical = loop.create_future()
+        abandoned = threading.Event()
+        def on_critical(nudges):
+            loop.call_soon_threadsafe(_resolve_once, critical, nudges)
+        try:
+            future = self._pool.submit(engine.evaluate_prioritized, note, on_critical, abandoned.is_set)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return _Analysis(future, critical, abandoned, time.perf_counter())
+    async def _outcome(self, analysis: "_Analysis", budget: float) -> AnalysisOutcome:
+        result = asyncio.wrap_future(analysis.future)
+        result.add_done_callback(_consume_result)
+        try:
+            nudges = await asyncio.wait_for(asyncio.shield(result), budget)
+        except asyncio.TimeoutError:
+            analysis.abandon()
+            if not analysis.critical.done():
+                self._count("timed_out")
+                raise AnalysisTimeoutError(self.retry_after)
+            self._count("degraded")
+            return AnalysisOutcome(analysis.critical.result(), True, time.perf_counter() - analysis.started)
+        except asyncio.CancelledError:
+            analysis.abandon()
+            raise
+        self._count("completed")
+        return AnalysisOutcome(nudges, False, time.perf_counter() - analysis.started)
+    async def _batch_outcome(self, key: Any, analysis: "_Analysis", budget: float) -> Tuple[Any, Any]:
+        try:
+            return key, await self._outcome(analysis, budget)
+        except AnalysisTimeoutError as e:
+            return key, e
+    async def analyze_many(self, engine: Any, notes: Iterable[Tuple[Any, Any]], time_budget: Optional[float] = None,
+                           max_pending: Optional[int] = None) -> AsyncIterator[Tuple[Any, Union[AnalysisOutcome, AnalysisTimeoutError]]]:
+        """
+        Analyzes `(key, note)` pairs with the same per-note time budget and
+        critical-first degradation as `analyze`, yielding `(key, outcome)` in
+        completion order; a note that timed out yields its AnalysisTimeoutError.
+        Batch notes are only admitted while a worker is free (never into the
+        queue) and at most `max_pending` (default: one per worker) at a time, so
+        queue slots stay available to interactive requests; when interactive
+        load holds every worker, the batch waits rather than failing.
+        """
+        budget = self.time_budget if time_budget is None else time_budget
+        limit = max_pending or self.max_workers
+        pending: Dict[asyncio.Future, _Analysis] = {}
+        try:
+            for key, note in notes:
+                while len(pending) >= limit or not self._try_admit(self.max_workers):
+                    if not pending:
+                        await asyncio.sleep(BATCH_ADMISSION_POLL)
+                        continue
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        del pending[task]
+                        yield task.result()
+                analysis = self._start(engine, note)
+                pending[asyncio.ensure_future(self._batch_outcome(key, analysis, budget))] = analysis
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    del pending[task]
+                    yield task.result()
+        finally:
+            # The client went away: abandon the notes still being analyzed.
+            for task, analysis in pending.items():
+                task.cancel()
+                analysis.abandon()
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counts, "in_flight": self._in_flight, "capacity": self.max_workers + self.max_queue}
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+def cdi_executor_from_env(workers_var: str = "CDI_ANALYSIS_WORKERS", queue_var: str = "CDI_ANALYSIS_QUEUE",
+                          budget_var: str = "CDI_ANALYSIS_BUDGET_MS") -> CDIAnalysisExecutor:
+    """Builds a CDIAnalysisExecutor from worker count, queue depth and per-request budget (milliseconds)."""
+    return CDIAnalysisExecutor(
+        max_workers=int(os.getenv(workers_var, "4")),
+        max_queue=int(os.getenv(queue_var, "32")),
+        time_budget=float(os.getenv(budget_var, "1000")) / 1000,
+    )
+def retry_after_header(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
@@ -0,0 +1,356 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+try:
+    import yaml
+except ImportError:  # YAML rule packs are optional; JSON packs always work.
+    yaml = None
+try:
+    from .note_preprocessing import NoteInput, PreprocessedNote, preprocess_note
+    from .result_cache import cache_key as result_cache_key
+    from .term_matcher import TermMatcher
+    from .instrumentation import registry as metrics
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from note_preprocessing import NoteInput, PreprocessedNote, preprocess_note
+    from result_cache import cache_key as result_cache_key
+    from term_matcher import TermMatcher
+    from instrumentation import registry as metrics
+RULE_PACK_EXTENSIONS = (".json", ".yaml", ".yml")
+NEGATION_SCOPES = ("note", "sentence")
+class RulePackError(ValueError):
+    """Raised when a CDI rule pack cannot be read or contains an invalid rule."""
+    pass
+# --- Rule Pack Loading ---
+def _validate_rule(rule: Any, source: str) -> Dict[str, Any]:
+    if not isinstance(rule, dict):
+        raise RulePackError(f"{source}: each rule must be an object, got {type(rule).__name__}.")
+    rule_id = rule.get("id")
+    if not rule_id:
+        raise RulePackError(f"{source}: rule is missing an 'id'.")
+    keywords = list(rule.get("keywords") or [])
+    if rule.get("keyword") and rule["keyword"] not in keywords:
+        keywords.insert(0, rule["keyword"])
+    if not keywords or not all(isinstance(k, str) and k.strip() for k in keywords):
+        raise RulePackError(f"{source}: rule '{rule_id}' needs a non-empty 'keyword' or 'keywords'.")
+    negations = rule.get("negation_keywords") or []
+    if not all(isinstance(k, str) and k.strip() for k in negations):
+        raise RulePackError(f"{source}: rule '{rule_id}' has an empty negation keyword.")
+    nudge = rule.get("nudge")
+    if not isinstance(nudge, dict) or not {"id", "severity", "prompt"} <= nudge.keys():
+        raise RulePackError(f"{source}: rule '{rule_id}' needs a 'nudge' with id, severity and prompt.")
+    if nudge["severity"] not in ("info", "warning", "critical"):
+        raise RulePackError(f"{source}: rule '{rule_id}' has unknown severity '{nudge['severity']}'.")
+    scope = rule.get("negation_scope", "note")
+    if scope not in NEGATION_SCOPES:
+        raise RulePackError(f"{source}: rule '{rule_id}' has unknown negation_scope '{scope}'.")
+    return {**rule, "keywords": keywords, "negation_keywords": list(negations), "negation_scope": scope}
+def load_rule_pack(path: str) -> List[Dict[str, Any]]:
+    """
+    Reads one rule pack file. A pack is either a list of rules shaped like
+    `cdi_api.CDI_RULES`, or an object with a `rules` list (plus optional metadata).
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            if path.endswith((".yaml", ".yml")):
+                if yaml is None:
+                    raise RulePackError(f"{path}: PyYAML is required to load YAML rule packs.")
+                data = yaml.safe_load(fh)
+            else:
+                data = json.load(fh)
+    except (OSError, ValueError) as e:
+        if isinstance(e, RulePackError):
+            raise
+        raise RulePackError(f"{path}: could not read rule pack: {e}") from e
+    rules = data.get("rules") if isinstance(data, dict) else data
+    if not isinstance(rules, list):
+        raise RulePackError(f"{path}: expected a list of rules or an object with a 'rules' list.")
+    return [_validate_rule(rule, path) for rule in rules]
+def discover_rule_packs(paths: Iterable[str]) -> List[str]:
+    """Expands directories into their rule pack files (sorted by name)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.endswith(RULE_PACK_EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+def outside_pack_roots(paths: Iterable[str], roots: Iterable[str]) -> List[str]:
+    """
+    Returns the `paths` that are neither one of the configured rule pack
+    `roots` nor inside a root directory (after resolving symlinks and `..`).
+    """
+    resolved_roots = [os.path.realpath(root) for root in roots]
+    outside = []
+    for path in paths:
+        resolved = os.path.realpath(path)
+        if not any(resolved == root or resolved.startswith(root.rstrip(os.sep) + os.sep) for root in resolved_roots):
+            outside.append(path)
+    return outside
+# --- Compiled Rule Set ---
+class CompiledRuleSet:
+    """
+    An immutable, precompiled snapshot of CDI rules.
+    Every keyword and negation keyword across all rules is compiled into one
+    shared substring matcher, so a note is scanned once no matter how many
+    rules are loaded. Only rules whose keyword actually occurs are evaluated.
+    Rules with `negation_scope: sentence` fire when some sentence mentions the
+    keyword without any of the rule's negation keywords; by default a negation
+    keyword anywhere in the note suppresses the rule.
+    """
+    def __init__(self, rules: Sequence[Dict[str, Any]]):
+        seen = set()
+        self.rules: List[Dict[str, Any]] = []
+        for rule in rules:
+            rule = _validate_rule(rule, "rules")
+            if rule["id"] in seen:
+                raise RulePackError(f"Duplicate CDI rule id '{rule['id']}'.")
+            seen.add(rule["id"])
+            self.rules.append(rule)
+        terms: Dict[str, None] = {}
+        for rule in self.rules:
+            for term in rule["keywords"] + rule["negation_keywords"]:
+                terms.setdefault(term.lower(), None)
+        self.matcher = TermMatcher(terms, whole_words=False)
+        # keyword term index -> rules triggered by it; per rule, its keyword and negation term indices
+        self._rules_by_keyword: Dict[int, List[int]] = {}
+        self._keywords: List[frozenset] = []
+        self._negations: List[frozenset] = []
+        for rule_idx, rule in enumerate(self.rules):
+            for term in rule["keywords"]:
+                bucket = self._rules_by_keyword.setdefault(self.matcher.index_of(term), [])
+                if rule_idx not in bucket:
+                    bucket.append(rule_idx)
+            self._keywords.append(frozenset(self.matcher.index_of(t) for t in rule["keywords"]))
+            self._negations.append(frozenset(self.matcher.index_of(t) for t in rule["negation_keywords"]))
+        self._sentence_scoped = frozenset(i for i, rule in enumerate(self.rules) if rule["negation_scope"] == "sentence")
+        self.critical_rules = frozenset(i for i, rule in enumerate(self.rules) if rule["nudge"]["severity"] == "critical")
+        self.version = hashlib.sha256(
+            json.dumps(self.rules, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()[:16]
+        self.loaded_at = time.time()
+        self._rule_by_nudge_id = {}
+        for rule_idx, rule in enumerate(self.rules):
+            self._rule_by_nudge_id.setdefault(rule["nudge"]["id"], rule_idx)
+        # Per rule: how often it was checked (its keyword matched) and fired, and
+        # its estimated share of evaluation time. Per rule set: notes evaluated,
+        # of which answered from the result cache, and wall time of the computed
+        # ones (scan plus rule checks).
+        self._evaluations = [0] * len(self.rules)
+        self._fired = [0] * len(self.rules)
+        self._est_cost_ns = [0.0] * len(self.rules)
+        self._notes = 0
+        self._cache_hits = 0
+        self._eval_ns = 0
+    def __len__(self) -> int:
+        return len(self.rules)
+    def candidate_rules(self, hits: Iterable[int]) -> List[int]:
+        """Returns the indices of rules whose keyword is among the matched term indices."""
+        candidates = set()
+        for term_idx in hits:
+            candidates.update(self._rules_by_keyword.get(term_idx, ()))
+        return sorted(candidates)
+    def fires(self, rule_idx: int, hits: frozenset, sentence_fired: frozenset = frozenset()) -> bool:
+        """
+        A rule fires when its keyword is present and none of its negation keywords
+        are; sentence-scoped rules fire when they are in `sentence_fired`.
+        """
+        if rule_idx in self._sentence_scoped:
+            return rule_idx in sentence_fired
+        return not (self._negations[rule_idx] & hits)
+    def scan(self, text: NoteInput) -> frozenset:
+        """Returns the indices of every keyword/negation term present in `text`."""
+        return frozenset(preprocess_note(text).matched_indices(self.matcher))
+    def scan_note(self, note: NoteInput) -> Tuple[frozenset, frozenset]:
+        """
+        Returns `(hits, sentence_fired)`: the matched term indices, and the
+        sentence-scoped rules satisfied by at least one sentence. Sentences never
+        span lines, so results for separate lines can be combined by union.
+        """
+        prepared = preprocess_note(note)
+        matches = prepared.find_all(self.matcher)
+        hits = frozenset(self.matcher.index_of(m.term) for m in matches)
+        candidates = [r for r in self.candidate_rules(hits) if r in self._sentence_scoped]
+        if not candidates:
+            return hits, frozenset()
+        by_sentence: Dict[int, set] = {}
+        for m in matches:
+            by_sentence.setdefault(prepared.sentence_of(m.start), set()).add(self.matcher.index_of(m.term))
+        sentence_fired = set()
+        for rule_idx in candidates:
+            keywords = self._keywords[rule_idx]
+            if any(keywords & sentence_hits and not (self._negations[rule_idx] & sentence_hits)
+                   for sentence_hits in by_sentence.values()):
+                sentence_fired.add(rule_idx)
+        return hits, frozenset(sentence_fired)
+    def evaluate(self, note: NoteInput) -> List[Dict[str, Any]]:
+        """Scans `note` once and returns the nudge dicts of every rule that fires, in rule order."""
+        start = time.perf_counter_ns()
+        hits, sentence_fired = self.scan_note(note)
+        checked = self.candidate_rules(hits)
+        nudges = [self.rules[rule_idx]["nudge"] for rule_idx in self.fired_rules(hits, sentence_fired, checked)]
+        self.record_evaluation(time.perf_counter_ns() - start, checked)
+        return nudges
+    def evaluate_hits(self, hits: frozenset, sentence_fired: frozenset = frozenset()) -> List[Dict[str, Any]]:
+        """Evaluates the rules against a precomputed set of matched term indices."""
+        return [self.rules[rule_idx]["nudge"] for rule_idx in self.fired_rules(hits, sentence_fired)]
+    def fired_rules(self, hits: frozenset, sentence_fired: frozenset = frozenset(),
+                    candidates: Optional[Iterable[int]] = None) -> List[int]:
+        """
+        Indices of the rules that fire for the given hits, in rule order.
+        `candidates` (default: `candidate_rules(hits)`) limits which are checked.
+        """
+        fired_rules = []
+        for rule_idx in self.candidate_rules(hits) if candidates is None else candidates:
+            # Counters are best-effort under concurrency; they are for reporting only.
+            self._evaluations[rule_idx] += 1
+            if self.fires(rule_idx, hits, sentence_fired):
+                self._fired[rule_idx] += 1
+                fired_rules.append(rule_idx)
+        return fired_rules
+    def record_evaluation(self, elapsed_ns: int, checked: Sequence[int] = ()):
+        """
+        Counts one computed note evaluation and its wall time (scan plus rule
+        checks), split evenly among the `checked` rules as their estimated cost.
+        """
+        self._notes += 1
+        self._eval_ns += elapsed_ns
+        if checked:
+            share = elapsed_ns / len(checked)
+            for rule_idx in checked:
+                self._est_cost_ns[rule_idx] += share
+        metrics.observe("stage_seconds", elapsed_ns / 1e9, stage="cdi_rules")
+    def record_cache_hit(self, nudges: Iterable[Dict[str, Any]]):
+        """Counts a note answered from the result cache, crediting the rules whose nudges it returned."""
+        self._notes += 1
+        self._cache_hits += 1
+        for nudge in nudges:
+            rule_idx = self._rule_by_nudge_id.get(nudge.get("id"))
+            if rule_idx is not None:
+                self._fired[rule_idx] += 1
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Per-rule check and fire counts and estimated cost. `fired` includes notes
+        answered from the result cache; `evaluations` counts only rule checks
+        actually run. Rules share one scan of the note, which dominates the cost
+        and cannot be timed per rule, so `est_cost_ns` is an estimate: each
+        computed note's wall time divided evenly among the rules it checked.
+        """
+        return [
+            {"id": rule["id"], "evaluations": self._evaluations[i], "fired": self._fired[i],
+             "est_cost_ns": round(self._est_cost_ns[i]),
+             "est_mean_cost_ns": self._est_cost_ns[i] / self._evaluations[i] if self._evaluations[i] else 0.0}
+            for i, rule in enumerate(self.rules)
+        ]
+    def evaluation_stats(self) -> Dict[str, Any]:
+        """
+        Notes evaluated (including result cache hits) and the wall time of the
+        computed ones; see `stats` for its estimated split per rule.
+        """
+        computed = self._notes - self._cache_hits
+        return {
+            "notes_evaluated": self._notes,
+            "cache_hits": self._cache_hits,
+            "total_eval_ns": self._eval_ns,
+            "mean_eval_ns": self._eval_ns / computed if computed else 0.0,
+        }
+# --- Hot-Reloadable Engine ---
+class CDIRuleEngine:
+    """
+    Holds the active CompiledRuleSet and swaps it atomically on reload.
+    In-flight evaluations keep using the snapshot they started with; a reload
+    that fails validation leaves the previous rule set active.
+    """
+    def __init__(self, base_rules: Sequence[Dict[str, Any]] = (), pack_paths: Sequence[str] = (), result_cache: Any = None):
+        self.base_rules = list(base_rules)
+        self.pack_paths = list(pack_paths)
+        # Optional result_cache.ResultCache; entries are keyed by rule set version, so a reload invalidates them.
+        self.result_cache = result_cache
+        self._reload_lock = threading.Lock()
+        self._ruleset = self._compile()
+    @property
+    def ruleset(self) -> CompiledRuleSet:
+        return self._ruleset
+    @property
+    def version(self) -> str:
+        return self._ruleset.version
+    def _compile(self) -> CompiledRuleSet:
+        rules = list(self.base_rules)
+        for path in discover_rule_packs(self.pack_paths):
+            rules.extend(load_rule_pack(path))
+        return CompiledRuleSet(rules)
+    def reload(self, pack_paths: Optional[Sequence[str]] = None) -> CompiledRuleSet:
+        """Recompiles the base rules plus rule packs and publishes the new snapshot."""
+        with self._reload_lock:
+            previous_paths = self.pack_paths
+            if pack_paths is not None:
+                self.pack_paths = list(pack_paths)
+            try:
+                ruleset = self._compile()
+            except RulePackError:
+                self.pack_paths = previous_paths
+                raise
+            self._ruleset = ruleset
+            return ruleset
+    def evaluate(self, note: NoteInput) -> List[Dict[str, Any]]:
+        ruleset = self._ruleset
+        if self.result_cache is None:
+            return ruleset.evaluate(note)
+        text = note.text if isinstance(note, PreprocessedNote) else note
+        key = result_cache_key("cdi", ruleset.version, text)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            ruleset.record_cache_hit(cached)
+            return cached
+        nudges = ruleset.evaluate(note)
+        self.result_cache.set(key, nudges)
+        return nudges
+    def evaluate_prioritized(self, note: NoteInput, on_critical: Callable[[List[Dict[str, Any]]], None],
+                             should_stop: Optional[Callable[[], bool]] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Scans the note once, then checks the critical rules first and hands
+        their nudges to `on_critical` before checking the rest, so a caller that
+        runs out of time can still answer with the critical nudges. Returns the
+        same nudges as `evaluate`, or None when `should_stop()` is true once the
+        critical rules are done (the caller gave up; nothing is cached).
+        """
+        ruleset = self._ruleset
+        text = note.text if isinstance(note, PreprocessedNote) else note
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = result_cache_key("cdi", ruleset.version, text)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                ruleset.record_cache_hit(cached)
+                return cached
+        start = time.perf_counter_ns()
+        hits, sentence_fired = ruleset.scan_note(note)
+        candidates = ruleset.candidate_rules(hits)
+        critical = ruleset.critical_rules
+        fired = ruleset.fired_rules(hits, sentence_fired, [r for r in candidates if r in critical])
+        on_critical([ruleset.rules[i]["nudge"] for i in fired])
+        if should_stop is not None and should_stop():
+            ruleset.record_evaluation(time.perf_counter_ns() - start, [r for r in candidates if r in critical])
+            return None
+        fired.extend(ruleset.fired_rules(hits, sentence_fired, [r for r in candidates if r not in critical]))
+        ruleset.record_evaluation(time.perf_counter_ns() - start, candidates)
+        nudges = [ruleset.rules[i]["nudge"] for i in sorted(fired)]
+        if cache_key is not None:
+            self.result_cache.set(cache_key, nudges)
+        return nudges
+    def stats(self) -> Dict[str, Any]:
+        ruleset = self._ruleset
+        return {
+            "version": ruleset.version,
+            "rule_count": len(ruleset),
+            "term_count": len(ruleset.matcher),
+            "loaded_at": ruleset.loaded_at,
+            **ruleset.evaluation_stats(),
+            "rules": ruleset.stats(),
+        }
+def rule_pack_paths_from_env(var: str = "CDI_RULE_PACKS") -> Tuple[str, ...]:
+    """Reads rule pack files/directories from an os.pathsep-separated environment variable."""
+    return tuple(p for p in os.getenv(var, "").split(os.pathsep) if p)
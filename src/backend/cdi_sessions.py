@@ -0,0 +1,129 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+try:
+    from .cdi_rules import CDIRuleEngine, CompiledRuleSet
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from cdi_rules import CDIRuleEngine, CompiledRuleSet
+class DraftSessionError(ValueError):
+    """Raised when a text delta cannot be applied to a draft session."""
+    pass
+class RevisionConflictError(DraftSessionError):
+    """Raised when a client sends deltas against a stale revision of the note."""
+    pass
+def _split_segments(text: str) -> List[str]:
+    # Lines are the unit of re-evaluation. As long as no rule term contains a
+    # newline, no substring match can span two segments.
+    return text.split("\n")
+def apply_text_deltas(text: str, deltas: Sequence[Dict[str, Any]]) -> str:
+    """
+    Applies `{"start", "end", "text"}` replacements in order; each delta's
+    offsets refer to the text produced by the previous delta.
+    """
+    for delta in deltas:
+        start, end = delta["start"], delta["end"]
+        if not 0 <= start <= end <= len(text):
+            raise DraftSessionError(f"Delta range [{start}, {end}) is outside the note (length {len(text)}).")
+        text = text[:start] + delta.get("text", "") + text[end:]
+    return text
+class DraftSession:
+    """
+    Incrementally analyzes a draft note as the physician types.
+    The note is kept as line segments, each with the set of rule terms it
+    contains. After an edit only the lines whose text changed are rescanned;
+    the CDI rules are then re-evaluated from the union of the segment term
+    sets (and of the sentence-scoped rules each line satisfies) and the
+    resulting nudges are diffed against the previous revision.
+    """
+    def __init__(self, engine: CDIRuleEngine, note: str = "", encounter_id: Optional[str] = None):
+        self.session_id = uuid.uuid4().hex
+        self.encounter_id = encounter_id
+        self.engine = engine
+        self.revision = 0
+        self.text = ""
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        self._ruleset: Optional[CompiledRuleSet] = None
+        self._line_safe = True
+        self._segments: List[Tuple[str, frozenset, frozenset]] = []
+        self._nudges: Dict[str, Dict[str, Any]] = {}
+        self.segments_scanned = 0
+        self._analyze(note)
+    @property
+    def nudges(self) -> List[Dict[str, Any]]:
+        return list(self._nudges.values())
+    def _analyze(self, text: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+        ruleset = self.engine.ruleset
+        if ruleset is not self._ruleset:
+            # New session or rules reloaded: nothing cached is reusable.
+            self._segments = []
+            self._line_safe = not any("\n" in term for term in ruleset.matcher.terms)
+        previous = {}
+        for segment, hits, sentence_fired in self._segments:
+            previous.setdefault(segment, (hits, sentence_fired))
+        segments = []
+        hits_union, fired_union = set(), set()
+        for segment in (_split_segments(text) if self._line_safe else [text]):
+            scanned = previous.get(segment)
+            if scanned is None:
+                scanned = ruleset.scan_note(segment) if segment else (frozenset(), frozenset())
+                previous[segment] = scanned
+                self.segments_scanned += 1
+            segments.append((segment, *scanned))
+            hits_union.update(scanned[0])
+            fired_union.update(scanned[1])
+        self._ruleset, self._segments, self.text = ruleset, segments, text
+        current = {n["id"]: n for n in ruleset.evaluate_hits(frozenset(hits_union), frozenset(fired_union))}
+        added = [n for nid, n in current.items() if nid not in self._nudges]
+        resolved = [nid for nid in self._nudges if nid not in current]
+        self._nudges = current
+        self.revision += 1
+        self.last_used = time.monotonic()
+        return added, resolved
+    def apply_deltas(self, deltas: Sequence[Dict[str, Any]], base_revision: Optional[int] = None) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Applies text deltas and returns `(added_nudges, resolved_nudge_ids)`
+        relative to the previous revision.
+        """
+        if base_revision is not None and base_revision != self.revision:
+            raise RevisionConflictError(f"Session is at revision {self.revision}, deltas target revision {base_revision}.")
+        return self._analyze(apply_text_deltas(self.text, deltas))
+class DraftSessionStore:
+    """
+    Bounded, thread-safe registry of live draft sessions.
+    Sessions idle longer than `ttl_seconds` expire; when `max_sessions` is
+    reached the least recently used session is evicted.
+    """
+    def __init__(self, engine: CDIRuleEngine, max_sessions: int = 10_000, ttl_seconds: float = 1800):
+        self.engine = engine
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, DraftSession]" = OrderedDict()
+        self._lock = threading.Lock()
+    def __len__(self) -> int:
+        return len(self._sessions)
+    def _expire(self, now: float):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.ttl_seconds and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+    def create(self, note: str, encounter_id: Optional[str] = None) -> DraftSession:
+        session = DraftSession(self.engine, note, encounter_id=encounter_id)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._expire(time.monotonic())
+        return session
+    def get(self, session_id: str) -> Optional[DraftSession]:
+        with self._lock:
+            self._expire(time.monotonic())
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.last_used = time.monotonic()
+            return session
+    def close(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
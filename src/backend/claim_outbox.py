@@ -0,0 +1,213 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+try:
+    from .rate_limiter import jittered_backoff
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from rate_limiter import jittered_backoff
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS claim_outbox (
+  claim_number TEXT PRIMARY KEY,           -- Idempotency key: a claim is enqueued at most once
+  payload TEXT NOT NULL,                   -- Internal claim payload (JSON), mapped to FHIR at submission
+  status TEXT NOT NULL DEFAULT 'PENDING',  -- PENDING | IN_FLIGHT | SENT | DEAD
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at REAL NOT NULL,           -- Epoch seconds; also the lease expiry while IN_FLIGHT
+  lease_id TEXT,                           -- Fencing token of the drainer currently holding the entry
+  last_error TEXT,
+  result TEXT,                             -- Last nphies response for the claim (JSON)
+  created_at REAL NOT NULL,
+  updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_claim_outbox_due ON claim_outbox(status, next_attempt_at);
+"""
+class ClaimOutbox:
+    """
+    Durable, SQLite-backed queue of claims awaiting submission to nphies.
+    `enqueue` is a single local transaction, so coding never waits on the
+    remote API and an accepted claim survives a process crash. Entries are
+    keyed by `claimNumber`; enqueuing the same claim twice is a no-op.
+    Drainers lease due entries (`lease_batch`), and a lease that is not
+    completed before it expires (e.g. the drainer died) makes the entry
+    due again. Each lease carries a fencing token: `extend_lease`,
+    `mark_sent` and `mark_failed` given a `lease_id` only touch entries still
+    held by that lease, so a drainer whose lease was taken over cannot
+    overwrite the new holder's outcome.
+    """
+    def __init__(self, path: str = "claim_outbox.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(OUTBOX_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(claim_outbox)")}
+        if "lease_id" not in columns:  # Outbox files created before leases were fenced
+            self._conn.execute("ALTER TABLE claim_outbox ADD COLUMN lease_id TEXT")
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    def enqueue(self, claim_payload: Dict[str, Any]) -> bool:
+        """Adds a claim; returns False if a claim with the same claimNumber was already enqueued."""
+        return self.enqueue_many([claim_payload]) == 1
+    def enqueue_many(self, claim_payloads: Iterable[Dict[str, Any]]) -> int:
+        """Adds claims in one transaction and returns how many were new."""
+        now = time.time()
+        rows = []
+        for payload in claim_payloads:
+            claim_number = payload.get("claimNumber")
+            if not claim_number:
+                raise ValueError("Outbox claims need a 'claimNumber' to use as idempotency key.")
+            rows.append((claim_number, json.dumps(payload), now, now, now))
+        with self._lock:
+            before = self._conn.total_changes
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO claim_outbox (claim_number, payload, next_attempt_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)", rows)
+            return self._conn.total_changes - before
+    def lease_batch(self, batch_size: int = 100, lease_seconds: float = 300) -> List[Dict[str, Any]]:
+        """
+        Atomically claims up to `batch_size` due entries for submission. Returns
+        dicts with `claim_number`, `attempts`, the decoded `payload` and the
+        batch's `lease_id`.
+        """
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                "SELECT claim_number, payload, attempts FROM claim_outbox "
+                "WHERE status IN ('PENDING', 'IN_FLIGHT') AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?", (now, batch_size)).fetchall()
+            self._conn.executemany(
+                "UPDATE claim_outbox SET status = 'IN_FLIGHT', attempts = attempts + 1, next_attempt_at = ?, lease_id = ?, "
+                "updated_at = ? WHERE claim_number = ?", [(now + lease_seconds, lease_id, now, row[0]) for row in rows])
+        return [{"claim_number": r[0], "payload": json.loads(r[1]), "attempts": r[2] + 1, "lease_id": lease_id} for r in rows]
+    def extend_lease(self, lease_id: str, lease_seconds: float = 300) -> int:
+        """Pushes back the expiry of every entry still held by `lease_id`; returns how many are still held."""
+        now = time.time()
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "UPDATE claim_outbox SET next_attempt_at = ?, updated_at = ? WHERE status = 'IN_FLIGHT' AND lease_id = ?",
+                (now + lease_seconds, now, lease_id))
+            return cur.rowcount
+    def mark_sent(self, claim_number: str, result: Optional[Dict[str, Any]] = None, lease_id: Optional[str] = None) -> bool:
+        return self._update(claim_number, "SENT", None, None, result, lease_id)
+    def mark_failed(self, claim_number: str, error: str, retry_at: Optional[float], lease_id: Optional[str] = None) -> bool:
+        """Schedules a retry at `retry_at`, or dead-letters the entry when `retry_at` is None."""
+        return self._update(claim_number, "PENDING" if retry_at is not None else "DEAD", retry_at, error, None, lease_id)
+    def _update(self, claim_number: str, status: str, next_attempt_at: Optional[float], error: Optional[str],
+                result: Optional[Dict[str, Any]], lease_id: Optional[str]) -> bool:
+        """Returns False when `lease_id` no longer holds the entry (the update is then skipped)."""
+        now = time.time()
+        query = ("UPDATE claim_outbox SET status = ?, next_attempt_at = COALESCE(?, next_attempt_at), last_error = ?, "
+                 "result = COALESCE(?, result), lease_id = NULL, updated_at = ? WHERE claim_number = ?")
+        params = [status, next_attempt_at, error, json.dumps(result) if result is not None else None, now, claim_number]
+        if lease_id is not None:
+            query += " AND lease_id = ?"
+            params.append(lease_id)
+        with self._lock, self._conn:
+            return self._conn.execute(query, params).rowcount == 1
+    def requeue_dead(self, claim_numbers: Optional[Iterable[str]] = None) -> int:
+        """Moves dead-lettered entries (all, or the given ones) back to PENDING with a fresh attempt budget."""
+        now = time.time()
+        with self._lock, self._conn:
+            if claim_numbers is None:
+                cur = self._conn.execute(
+                    "UPDATE claim_outbox SET status = 'PENDING', attempts = 0, next_attempt_at = ?, updated_at = ? "
+                    "WHERE status = 'DEAD'", (now, now))
+                return cur.rowcount
+            cur = self._conn.executemany(
+                "UPDATE claim_outbox SET status = 'PENDING', attempts = 0, next_attempt_at = ?, updated_at = ? "
+                "WHERE status = 'DEAD' AND claim_number = ?", [(now, now, c) for c in claim_numbers])
+            return cur.rowcount
+    def get(self, claim_number: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT claim_number, status, attempts, last_error, result FROM claim_outbox WHERE claim_number = ?",
+                (claim_number,)).fetchone()
+        if row is None:
+            return None
+        return {"claim_number": row[0], "status": row[1], "attempts": row[2], "last_error": row[3],
+                "result": json.loads(row[4]) if row[4] else None}
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM claim_outbox GROUP BY status").fetchall()
+        return {"PENDING": 0, "IN_FLIGHT": 0, "SENT": 0, "DEAD": 0, **dict(rows)}
+class OutboxDrainer:
+    """
+    Submits outbox entries to nphies in batches, separately from coding.
+    Uses the connector's bulk `submit_claims` with a "batch" Bundle when
+    available (falling back to `submit_claim` per entry), so nphies accepts or
+    rejects each claim independently and one invalid claim does not fail the
+    others. Failed claims are retried with jittered exponential backoff and
+    dead-lettered after `max_attempts`. The lease is renewed while a batch is
+    being submitted, so a slow submission is not leased and sent again by
+    another drainer.
+    """
+    def __init__(self, outbox: ClaimOutbox, connector: Any, batch_size: int = 100, max_attempts: int = 5,
+                 backoff_base: float = 30.0, backoff_cap: float = 3600.0, lease_seconds: float = 300.0):
+        self.outbox = outbox
+        self.connector = connector
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.lease_seconds = lease_seconds
+    def _submit(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        submit_claims = getattr(self.connector, "submit_claims", None)
+        if submit_claims is not None:
+            try:
+                return submit_claims(payloads, bundle_type="batch")
+            except Exception as e:
+                return [{"success": False, "error": str(e)} for _ in payloads]
+        results = []
+        for payload in payloads:
+            try:
+                results.append({"success": True, "response": self.connector.submit_claim(payload)})
+            except Exception as e:
+                results.append({"success": False, "error": str(e)})
+        return results
+    def drain_once(self) -> Dict[str, int]:
+        """Leases and submits one batch. Returns counts of sent, retried and dead-lettered claims."""
+        leased = self.outbox.lease_batch(self.batch_size, self.lease_seconds)
+        stats = {"sent": 0, "retried": 0, "dead": 0}
+        if not leased:
+            return stats
+        lease_id = leased[0]["lease_id"]
+        submitted = threading.Event()
+        def keep_leased():
+            while not submitted.wait(self.lease_seconds / 3):
+                self.outbox.extend_lease(lease_id, self.lease_seconds)
+        heartbeat = threading.Thread(target=keep_leased, name="outbox-lease-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            results = self._submit([entry["payload"] for entry in leased])
+        finally:
+            submitted.set()
+            heartbeat.join()
+        now = time.time()
+        for entry, result in zip(leased, results):
+            # Connectors without per-claim results (e.g. mocks) signal success by not raising.
+            if result.get("success", True):
+                self.outbox.mark_sent(entry["claim_number"], result, lease_id)
+                stats["sent"] += 1
+            elif entry["attempts"] >= self.max_attempts:
+                self.outbox.mark_failed(entry["claim_number"], result.get("error") or "Submission failed.", None, lease_id)
+                stats["dead"] += 1
+            else:
+                delay = jittered_backoff(entry["attempts"] - 1, self.backoff_base, self.backoff_cap)
+                self.outbox.mark_failed(entry["claim_number"], result.get("error") or "Submission failed.", now + delay, lease_id)
+                stats["retried"] += 1
+        return stats
+    def run(self, stop_event: threading.Event, poll_interval: float = 1.0):
+        """Drains continuously until `stop_event` is set, idling `poll_interval` when nothing is due."""
+        while not stop_event.is_set():
+            stats = self.drain_once()
+            if not any(stats.values()):
+                stop_event.wait(poll_interval)
@@ -1,10 +1,31 @@
-import re
-from typing import Dict, Any, List, TypedDict
+import copy
+import itertools
+import logging
+import os
+from collections import deque
+from concurrent.futures import Executor, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, TypedDict, Union
+try:
+    from .coding_results import CodeEntry, CompactCodingResult, SourceLoader, code_entries_for, intern_codes
+    from .note_preprocessing import NoteInput, preprocess_note
+    from .result_cache import dictionary_fingerprint
+    from .term_matcher import FrozenTerms, TermMatch, TermMatcher, get_term_matcher
+    from .instrumentation import registry as metrics
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from coding_results import CodeEntry, CompactCodingResult, SourceLoader, code_entries_for, intern_codes
+    from note_preprocessing import NoteInput, preprocess_note
+    from result_cache import dictionary_fingerprint
+    from term_matcher import FrozenTerms, TermMatch, TermMatcher, get_term_matcher
+    from instrumentation import registry as metrics
+logger = logging.getLogger(__name__)
 # Mock NphiesConnector for demonstration without real API calls
 class MockNphiesConnector:
     def submit_claim(self, claim_data: Dict[str, Any]) -> Dict[str, Any]:
         print(f"--- [MOCK NPHIES] Submitting claim: {claim_data.get('claimNumber')} ---")
         return {"status": "SUBMITTED", "nphiesClaimId": f"NPH-{claim_data.get('claimNumber')}"}
+    def submit_claims(self, claims: List[Dict[str, Any]], bundle_type: str = "transaction") -> List[Dict[str, Any]]:
+        print(f"--- [MOCK NPHIES] Submitting {len(claims)} claims in bulk ---")
+        return [{"status": "SUBMITTED", "nphiesClaimId": f"NPH-{c.get('claimNumber')}"} for c in claims]
 # Type definitions for clarity
 class SuggestedCode(TypedDict):
     code: str
@@ -25,85 +46,311 @@ class CodingEngine:
     business rules to determine the automation phase (CAC, Semi-Autonomous, Autonomous).
     """
     ENGINE_VERSION = "0.1.0-mock"
-    # A simple dictionary to map clinical terms to ICD-10 codes
-    TERM_TO_CODE_MAP = {
+    # A simple dictionary to map clinical terms to ICD-10 codes. It is read-only,
+    # so caches keyed on it cannot go stale; subclasses and callers swap in a
+    # new dictionary instead of editing this one.
+    TERM_TO_CODE_MAP = FrozenTerms({
         "pneumonia": {"code": "J18.9", "desc": "Pneumonia, unspecified organism", "confidence": 0.85},
         "myocardial infarction": {"code": "I21.9", "desc": "Acute myocardial infarction, unspecified", "confidence": 0.99},
         "appendicitis": {"code": "K37", "desc": "Unspecified appendicitis", "confidence": 0.95},
         "uti": {"code": "N39.0", "desc": "Urinary tract infection, site not specified", "confidence": 0.80},
         "fracture": {"code": "S82.90XA", "desc": "Unspecified fracture of unspecified lower leg, initial encounter", "confidence": 0.75},
-    }
-    def __init__(self, nphies_connector: Any = None):
+    })
+    def __init__(self, nphies_connector: Any = None, outbox: Any = None, result_cache: Any = None, cdi_engine: Any = None):
         self.nphies_connector = nphies_connector or MockNphiesConnector()
-    def _placeholder_nlp(self, text: str) -> List[SuggestedCode]:
+        # With an outbox (see claim_outbox.ClaimOutbox), AUTONOMOUS claims are
+        # enqueued locally and submitted later by an OutboxDrainer.
+        self.outbox = outbox
+        # Optional result_cache.ResultCache for NLP output; claim submission is never cached.
+        self.result_cache = result_cache
+        # Optional cdi_rules.CDIRuleEngine (or CompiledRuleSet) evaluated on the same
+        # PreprocessedNote; a critical documentation query keeps a claim from going out autonomously.
+        self.cdi_engine = cdi_engine
+    def _worker_copy(self) -> "CodingEngine":
         """
-        A placeholder for a real NLP model. This function uses regex to find
-        keywords and maps them to predefined codes.
+        A copy for process-pool workers, which only code notes: the connector
+        (and its HTTP session), outbox and result cache stay in the parent.
         """
-        suggestions = []
-        text_lower = text.lower()
-        for term, code_info in self.TERM_TO_CODE_MAP.items():
-            if re.search(r'\b' + re.escape(term) + r'\b', text_lower):
-                suggestions.append(code_info.copy())
-        return suggestions
-    def run_coding_job(self, clinical_note: str, encounter_meta: Dict[str, Any]) -> CodingResult:
+        worker = copy.copy(self)
+        worker.nphies_connector = None
+        worker.outbox = None
+        worker.result_cache = None
+        # The engine's reload lock does not pickle; workers evaluate its current rule set snapshot.
+        worker.cdi_engine = getattr(self.cdi_engine, "ruleset", self.cdi_engine)
+        return worker
+    @property
+    def term_matcher(self) -> TermMatcher:
+        """The compiled matcher for TERM_TO_CODE_MAP, built once and shared across engines."""
+        return get_term_matcher(self.TERM_TO_CODE_MAP)
+    def find_term_matches(self, text: NoteInput) -> List[TermMatch]:
+        """
+        Scans the note once and returns every whole-word dictionary hit with its
+        character offsets; `TermMatch.value` is the TERM_TO_CODE_MAP entry.
+        """
+        return preprocess_note(text).find_all(self.term_matcher)
+    def _placeholder_nlp(self, text: NoteInput) -> List[SuggestedCode]:
+        """
+        A placeholder for a real NLP model. This function scans the note with a
+        precompiled multi-term matcher and maps each distinct hit to its code,
+        in dictionary order.
+        """
+        matcher = self.term_matcher
+        return [matcher.value_at(idx).copy() for idx in preprocess_note(text).matched_indices(matcher)]
+    @property
+    def nlp_version(self) -> str:
+        """Identifies the NLP output for a given note: engine version plus dictionary contents."""
+        return f"{self.ENGINE_VERSION}+{dictionary_fingerprint(self.TERM_TO_CODE_MAP)}"
+    def _suggest_codes(self, note: NoteInput) -> List[SuggestedCode]:
+        if self.result_cache is None:
+            return self._placeholder_nlp(note)
+        text = preprocess_note(note).text
+        return self.result_cache.get_or_compute("coding", self.nlp_version, text, lambda: self._placeholder_nlp(note))
+    def run_coding_job(self, clinical_note: NoteInput, encounter_meta: Dict[str, Any]) -> CodingResult:
         """
         Executes the full coding logic flow from ingestion to decision.
         Args:
-            clinical_note: The unstructured clinical text.
+            clinical_note: The unstructured clinical text, or a PreprocessedNote
+                shared with the CDI rules for the same encounter.
             encounter_meta: A dictionary with metadata like 'visit_complexity'.
         Returns:
             A dictionary representing the outcome of the coding job.
         """
-        suggested_codes = self._placeholder_nlp(clinical_note)
-        if not suggested_codes:
-            confidence_score = 0.0
-        else:
-            confidence_score = sum(c['confidence'] for c in suggested_codes) / len(suggested_codes)
+        with metrics.stage("coding_job"):
+            result, claim_payload = self._code_note(clinical_note, encounter_meta)
+            if claim_payload is not None:
+                with metrics.stage("submit"):
+                    if self.outbox is not None:
+                        self.outbox.enqueue(claim_payload)
+                        result["status"] = "QUEUED_FOR_NPHIES"
+                    else:
+                        result["status"] = _claim_status(self.nphies_connector.submit_claim(claim_payload))
+        return result
+    def _has_critical_cdi_query(self, prepared: NoteInput) -> bool:
+        if self.cdi_engine is None:
+            return False
+        return any(nudge["severity"] == "critical" for nudge in self.cdi_engine.evaluate(prepared))
+    def _classify(self, confidence_score: float, encounter_meta: Dict[str, Any], prepared: NoteInput) -> Tuple[str, str]:
+        """Applies the phase business rules; returns `(phase, status)`."""
+        with metrics.stage("phase_decision"):
+            phase, status = self._phase_rules(confidence_score, encounter_meta, prepared)
+        metrics.inc("coding_phase_total", phase=phase)
+        return phase, status
+    def _phase_rules(self, confidence_score: float, encounter_meta: Dict[str, Any], prepared: NoteInput) -> Tuple[str, str]:
         visit_complexity = encounter_meta.get("visit_complexity", "standard")
-        # Phase 3: Autonomous
-        if visit_complexity == 'low-complexity outpatient' and confidence_score > 0.98:
-            claim_payload = self._create_claim_payload(encounter_meta, suggested_codes)
-            self.nphies_connector.submit_claim(claim_payload)
-            return {
-                "engine_version": self.ENGINE_VERSION,
-                "source_text": clinical_note,
-                "suggested_codes": suggested_codes,
-                "final_codes": suggested_codes, # Codes are accepted automatically
-                "status": "SENT_TO_NPHIES",
-                "confidence_score": round(confidence_score, 2),
-                "phase": "AUTONOMOUS",
-            }
+        # Phase 3: Autonomous (the status is settled once the claim is submitted or queued)
+        if (visit_complexity == 'low-complexity outpatient' and confidence_score > 0.98
+                and not self._has_critical_cdi_query(prepared)):
+            return "AUTONOMOUS", "SENT_TO_NPHIES"
         # Phase 2: Semi-Autonomous
         if confidence_score > 0.90:
-            return {
-                "engine_version": self.ENGINE_VERSION,
-                "source_text": clinical_note,
-                "suggested_codes": suggested_codes,
-                "final_codes": [],
-                "status": "AUTO_DROP", # Ready for batch review
-                "confidence_score": round(confidence_score, 2),
-                "phase": "SEMI_AUTONOMOUS",
-            }
+            return "SEMI_AUTONOMOUS", "AUTO_DROP" # Ready for batch review
         # Phase 1: Computer-Assisted Coding (CAC) - Default
+        return "CAC", "NEEDS_REVIEW"
+    def _code_note(self, note: NoteInput, encounter_meta: Dict[str, Any]) -> Tuple[CodingResult, Optional[Dict[str, Any]]]:
+        """
+        Runs NLP and phase decisioning without side effects. Returns the coding
+        result and, for the AUTONOMOUS phase, the claim payload to submit.
+        """
+        with metrics.stage("preprocess"):
+            prepared = preprocess_note(note)
+        with metrics.stage("nlp"):
+            suggested_codes = self._suggest_codes(prepared)
+        if not suggested_codes:
+            confidence_score = 0.0
+        else:
+            confidence_score = sum(c['confidence'] for c in suggested_codes) / len(suggested_codes)
+        phase, status = self._classify(confidence_score, encounter_meta, prepared)
+        autonomous = phase == "AUTONOMOUS"
         return {
             "engine_version": self.ENGINE_VERSION,
-            "source_text": clinical_note,
+            "source_text": prepared.text,
             "suggested_codes": suggested_codes,
-            "final_codes": [],
-            "status": "NEEDS_REVIEW",
+            "final_codes": suggested_codes if autonomous else [], # Codes are accepted automatically when autonomous
+            "status": status,
             "confidence_score": round(confidence_score, 2),
-            "phase": "CAC",
-        }
+            "phase": phase,
+        }, self._create_claim_payload(encounter_meta, suggested_codes) if autonomous else None
+    def _code_note_compact(self, note: NoteInput, encounter_meta: Dict[str, Any]) -> Tuple[CompactCodingResult, Optional[Dict[str, Any]]]:
+        """
+        Like `_code_note`, but builds a CompactCodingResult from interned code
+        entries. The note text is not attached; the caller decides how the
+        result refers to it.
+        """
+        with metrics.stage("preprocess"):
+            prepared = preprocess_note(note)
+        with metrics.stage("nlp"):
+            if self.result_cache is None:
+                entries = code_entries_for(self.term_matcher)
+                codes = intern_codes(entries[idx] for idx in prepared.matched_indices(self.term_matcher))
+            else:
+                codes = intern_codes(CodeEntry(c["code"], c["desc"], c["confidence"]) for c in self._suggest_codes(prepared))
+        confidence_score = sum(c.confidence for c in codes) / len(codes) if codes else 0.0
+        phase, status = self._classify(confidence_score, encounter_meta, prepared)
+        result = CompactCodingResult(self.ENGINE_VERSION, phase, status, round(confidence_score, 2), codes)
+        if phase != "AUTONOMOUS":
+            return result, None
+        return result, self._create_claim_payload(encounter_meta, [c.to_dict() for c in codes])
+    def _code_chunk(self, chunk: List[Tuple[str, Dict[str, Any]]], compact: bool = False) -> List[Tuple[Any, Optional[Dict[str, Any]]]]:
+        code = self._code_note_compact if compact else self._code_note
+        return [code(note, meta) for note, meta in chunk]
+    def run_coding_jobs(
+        self,
+        jobs: Iterable[Tuple[str, Dict[str, Any]]],
+        executor: Union[str, Executor] = "process",
+        max_workers: Optional[int] = None,
+        chunksize: int = 64,
+        ordered: bool = True,
+        max_in_flight: Optional[int] = None,
+        submit_batch_size: int = 100,
+        compact: bool = False,
+        source_loader: Optional[SourceLoader] = None,
+    ) -> Iterator[Union[CodingResult, CompactCodingResult]]:
+        """
+        Codes a stream of (clinical_note, encounter_meta) pairs in parallel.
+        Jobs are read lazily in chunks of `chunksize` and fanned out to a
+        "process" or "thread" pool (or a caller-supplied Executor). At most
+        `max_in_flight` chunks (default: 2 per worker) are pending at once, so
+        memory stays bounded however long `jobs` is. Results are yielded in input
+        order when `ordered`, otherwise as soon as each chunk completes.
+        AUTONOMOUS claim payloads are not submitted per job: they are collected
+        and handed to the connector in bulk every `submit_batch_size` claims,
+        with any remainder flushed when the stream ends or is closed. Results
+        are held back until their claim is submitted (held chunks count against
+        `max_in_flight`), so an AUTONOMOUS result's status reflects the outcome:
+        SENT_TO_NPHIES, SUBMISSION_FAILED, or QUEUED_FOR_NPHIES with an outbox.
+        With `compact`, CompactCodingResult objects are yielded instead of dicts.
+        Each refers to its note by `encounter_meta["source_ref"]` (default: the
+        encounter `id`); given a `source_loader`, the note text is not retained
+        and is re-read through the loader only when `source_text` is accessed.
+        """
+        if chunksize < 1 or submit_batch_size < 1:
+            raise ValueError("chunksize and submit_batch_size must be positive.")
+        own_pool = isinstance(executor, str)
+        if own_pool:
+            workers = max_workers or os.cpu_count() or 1
+            if executor == "process":
+                pool: Executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                                     initargs=(self._worker_copy(),))
+                task = _code_chunk_in_worker
+            elif executor == "thread":
+                pool = ThreadPoolExecutor(max_workers=workers)
+                task = self._code_chunk
+            else:
+                raise ValueError(f"Unknown executor '{executor}'; expected 'process', 'thread' or an Executor.")
+        else:
+            pool, task = executor, self._code_chunk
+            workers = max_workers or getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+        in_flight_limit = max_in_flight or 2 * workers
+        job_iter = iter(jobs)
+        pending: deque = deque()
+        chunks: Dict[Any, List[Tuple[NoteInput, Dict[str, Any]]]] = {}
+        claims: List[Tuple[Any, Dict[str, Any]]] = []  # (result, claim payload) awaiting submission
+        held: List[Any] = []  # Results not yet yielded because an earlier or own claim is unsettled
+        def submit_next() -> bool:
+            chunk = list(itertools.islice(job_iter, chunksize))
+            if chunk:
+                future = pool.submit(task, chunk, compact)
+                pending.append(future)
+                if compact:
+                    chunks[future] = chunk
+            return bool(chunk)
+        try:
+            while len(pending) < in_flight_limit and submit_next():
+                pass
+            while pending:
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    done = [f for f in pending if f in finished]
+                    for future in done:
+                        pending.remove(future)
+                while done:
+                    future = done.pop(0)
+                    coded = future.result()
+                    if compact:
+                        for (result, _), (note, meta) in zip(coded, chunks.pop(future)):
+                            result.attach_source(meta.get("source_ref", meta.get("id")), getattr(note, "text", note), source_loader)
+                    claims.extend((result, payload) for result, payload in coded if payload is not None)
+                    held.extend(result for result, _ in coded)
+                    # Held (and completed but unprocessed) chunks count against the in-flight limit;
+                    # settle early rather than stall.
+                    if claims and (len(claims) >= submit_batch_size or
+                                   len(pending) + len(done) + -(-len(held) // chunksize) >= in_flight_limit):
+                        self._settle_claims(claims)
+                        claims = []
+                    ready, held = (held, []) if not claims else ([], held)
+                    while len(pending) + len(done) + -(-len(held) // chunksize) < in_flight_limit and submit_next():
+                        pass
+                    yield from ready
+            if claims:
+                self._settle_claims(claims)
+                claims = []
+            yield from held
+        finally:
+            for future in pending:
+                future.cancel()
+            if claims:
+                self._settle_claims(claims)
+            if own_pool:
+                pool.shutdown(wait=True)
+    def _settle_claims(self, claims: List[Tuple[Any, Dict[str, Any]]]):
+        """Submits the claims of AUTONOMOUS results and sets each result's status from its outcome."""
+        outcomes = self._submit_claims_bulk([payload for _, payload in claims])
+        for (result, _), outcome in zip(claims, outcomes):
+            status = "QUEUED_FOR_NPHIES" if self.outbox is not None else _claim_status(outcome)
+            if isinstance(result, dict):
+                result["status"] = status
+            else:
+                result.status = status
+    def _submit_claims_bulk(self, claims: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Hands a batch of claim payloads to the outbox when one is configured,
+        otherwise to the connector, using its bulk API (as a "batch" Bundle, so
+        claims succeed or fail independently) when available. Returns one
+        outcome per claim; a claim whose single submission raised gets
+        `{"success": False, "error": ...}`.
+        """
+        if self.outbox is not None:
+            self.outbox.enqueue_many(claims)
+            return [None] * len(claims)
+        submit_claims = getattr(self.nphies_connector, "submit_claims", None)
+        if submit_claims is not None:
+            return submit_claims(claims, bundle_type="batch")
+        outcomes = []
+        for claim in claims:
+            try:
+                outcomes.append(self.nphies_connector.submit_claim(claim))
+            except Exception as e:
+                logger.warning("Claim submission failed for %s: %s", claim.get("claimNumber"), e,
+                               extra={"event": "claim_submission_failed", "claim_number": claim.get("claimNumber")})
+                outcomes.append({"success": False, "error": str(e)})
+        return outcomes
     def _create_claim_payload(self, encounter: Dict[str, Any], codes: List[SuggestedCode]) -> Dict[str, Any]:
         """Creates a mock claim payload for submission."""
         return {
             "claimNumber": f"CLAIM-{encounter.get('id', 'UNKNOWN')}",
+            "encounter": {"id": encounter.get("id")},
             "patient": {"id": encounter.get("patient_id")},
             "provider": {"cr_number": encounter.get("provider_cr")},
             "items": [{"serviceCode": c["code"], "description": c["desc"]} for c in codes],
             "total": 1000.00, # Mock total
         }
+def _claim_status(outcome: Optional[Dict[str, Any]]) -> str:
+    # Connectors without per-claim results (e.g. mocks) signal success by not raising.
+    if isinstance(outcome, dict) and outcome.get("success") is False:
+        return "SUBMISSION_FAILED"
+    if isinstance(outcome, dict) and outcome.get("status") == "DRAFT":
+        return "QUEUED_FOR_NPHIES"  # Stored for later submission (e.g. by bulk_ingest.ResultWriter)
+    return "SENT_TO_NPHIES"
+# --- Process Pool Workers ---
+# Each worker process holds one engine (without its connector), installed by the pool initializer.
+_BATCH_ENGINE: Optional[CodingEngine] = None
+def _init_batch_worker(engine: CodingEngine):
+    global _BATCH_ENGINE
+    _BATCH_ENGINE = engine
+def _code_chunk_in_worker(chunk: List[Tuple[str, Dict[str, Any]]], compact: bool = False) -> List[Tuple[Any, Optional[Dict[str, Any]]]]:
+    return _BATCH_ENGINE._code_chunk(chunk, compact)
 # Example Usage
 if __name__ == "__main__":
     engine = CodingEngine()
@@ -0,0 +1,122 @@
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+try:
+    from .term_matcher import TermMatcher
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from term_matcher import TermMatcher
+SourceLoader = Callable[[Hashable], str]
+class CodeEntry(NamedTuple):
+    """An immutable suggested code; equal entries are interned and shared by every result."""
+    code: str
+    desc: str
+    confidence: float
+    def to_dict(self) -> Dict[str, Any]:
+        return {"code": self.code, "desc": self.desc, "confidence": self.confidence}
+# --- Interning ---
+# Distinct code lists are few (one per combination of dictionary hits), so every
+# result with the same codes points at the same tuple of the same entries. The
+# table is a bounded LRU: a long-running process that sees many dictionaries
+# evicts the least recently used lists (results keep theirs; later equal lists
+# just stop being shared with them).
+MAX_INTERNED_CODE_LISTS = 4096
+_CODE_LISTS: "OrderedDict[Tuple[CodeEntry, ...], Tuple[CodeEntry, ...]]" = OrderedDict()
+_CODE_LISTS_LOCK = threading.Lock()
+# Entries live as long as their matcher does.
+_MATCHER_ENTRIES: "weakref.WeakKeyDictionary[TermMatcher, Tuple[int, List[CodeEntry]]]" = weakref.WeakKeyDictionary()
+def intern_codes(codes: Sequence[CodeEntry]) -> Tuple[CodeEntry, ...]:
+    codes = tuple(codes)
+    with _CODE_LISTS_LOCK:
+        interned = _CODE_LISTS.get(codes)
+        if interned is not None:
+            _CODE_LISTS.move_to_end(codes)
+            return interned
+        _CODE_LISTS[codes] = codes
+        while len(_CODE_LISTS) > MAX_INTERNED_CODE_LISTS:
+            _CODE_LISTS.popitem(last=False)
+        return codes
+def code_entries_for(matcher: TermMatcher) -> List[CodeEntry]:
+    """CodeEntry for each dictionary index of `matcher` (whose values are SuggestedCode dicts), built once."""
+    cached = _MATCHER_ENTRIES.get(matcher)
+    if cached is not None and cached[0] == len(matcher):
+        return cached[1]
+    entries = []
+    for idx in range(len(matcher)):
+        value = matcher.value_at(idx)
+        entries.append(CodeEntry(sys.intern(value["code"]), sys.intern(value["desc"]), value["confidence"]))
+    _MATCHER_ENTRIES[matcher] = (len(matcher), entries)
+    return entries
+# --- Compact Result ---
+class CompactCodingResult:
+    """
+    Memory-lean equivalent of a CodingResult dict for large batches.
+    Codes are an interned tuple of CodeEntry shared between results, and
+    `final_codes` is the same tuple (AUTONOMOUS) or empty rather than a copy.
+    The note itself is not stored when a `source_loader` is attached: only
+    `source_ref` (e.g. the encounter id) is kept and `source_text` is loaded
+    on access. `to_dict()` returns the regular CodingResult shape.
+    Results compare equal by value but are unhashable: `status` is updated once
+    the claim of an AUTONOMOUS result has been submitted.
+    """
+    __slots__ = ("engine_version", "phase", "status", "confidence_score", "codes", "source_ref", "_source_text", "_source_loader")
+    def __init__(self, engine_version: str, phase: str, status: str, confidence_score: float,
+                 codes: Sequence[CodeEntry], source_ref: Hashable = None, source_text: Optional[str] = None,
+                 source_loader: Optional[SourceLoader] = None):
+        self.engine_version = sys.intern(engine_version)
+        self.phase = sys.intern(phase)
+        self.status = sys.intern(status)
+        self.confidence_score = confidence_score
+        self.codes = intern_codes(codes)
+        self.source_ref = source_ref
+        self._source_text = source_text
+        self._source_loader = source_loader
+    def attach_source(self, source_ref: Hashable = None, source_text: Optional[str] = None,
+                      source_loader: Optional[SourceLoader] = None):
+        """Points the result at its note: either the text itself (by reference) or a ref plus loader."""
+        self.source_ref = source_ref
+        self._source_text = None if source_loader is not None else source_text
+        self._source_loader = source_loader
+    @property
+    def source_text(self) -> Optional[str]:
+        if self._source_text is not None:
+            return self._source_text
+        if self._source_loader is not None:
+            return self._source_loader(self.source_ref)
+        return None
+    @property
+    def suggested_codes(self) -> Tuple[CodeEntry, ...]:
+        return self.codes
+    @property
+    def final_codes(self) -> Tuple[CodeEntry, ...]:
+        # Codes are accepted automatically only in the AUTONOMOUS phase.
+        return self.codes if self.phase == "AUTONOMOUS" else ()
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the result in the CodingResult dict shape, with fresh code dicts."""
+        suggested = [c.to_dict() for c in self.codes]
+        return {
+            "engine_version": self.engine_version,
+            "source_text": self.source_text,
+            "suggested_codes": suggested,
+            "final_codes": suggested if self.phase == "AUTONOMOUS" else [],
+            "status": self.status,
+            "confidence_score": self.confidence_score,
+            "phase": self.phase,
+        }
+    def __getstate__(self) -> Tuple[Any, ...]:
+        # Loaders are usually closures over a connection, so they are not pickled; re-attach after loading.
+        return (self.engine_version, self.phase, self.status, self.confidence_score, self.codes,
+                self.source_ref, self._source_text)
+    def __setstate__(self, state: Tuple[Any, ...]):
+        engine_version, phase, status, confidence_score, codes, source_ref, source_text = state
+        self.__init__(engine_version, phase, status, confidence_score,
+                      tuple(CodeEntry(*c) for c in codes), source_ref, source_text)
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, CompactCodingResult):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+    __hash__ = None  # Mutable; see the class docstring
+    def __repr__(self) -> str:
+        return (f"CompactCodingResult(phase={self.phase!r}, status={self.status!r}, "
+                f"codes={[c.code for c in self.codes]!r}, source_ref={self.source_ref!r})")
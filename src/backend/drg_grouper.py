@@ -0,0 +1,186 @@
+import csv
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+import sqlalchemy
+UNGROUPABLE_DRG = "999"
+# Illustrative MS-DRG style weights for the conditions CodingEngine recognizes.
+# Production deployments load the licensed grouper table with `load_drg_table`.
+DEFAULT_DRG_TABLE: List[Dict[str, Any]] = [
+    {"drg": "193", "description": "Simple pneumonia and pleurisy with CC", "weight": 1.3224, "principal_prefix": "J18", "cc": "Y"},
+    {"drg": "195", "description": "Simple pneumonia and pleurisy without CC", "weight": 0.7054, "principal_prefix": "J18", "cc": "N"},
+    {"drg": "280", "description": "Acute myocardial infarction with CC", "weight": 1.7033, "principal_prefix": "I21", "cc": "Y"},
+    {"drg": "282", "description": "Acute myocardial infarction without CC", "weight": 0.7933, "principal_prefix": "I21", "cc": "N"},
+    {"drg": "342", "description": "Appendectomy without complicated principal diagnosis with CC", "weight": 1.0823, "principal_prefix": "K37", "cc": "Y"},
+    {"drg": "343", "description": "Appendectomy without complicated principal diagnosis without CC", "weight": 0.9667, "principal_prefix": "K37", "cc": "N"},
+    {"drg": "689", "description": "Kidney and urinary tract infections with CC", "weight": 1.1052, "principal_prefix": "N39.0", "cc": "Y"},
+    {"drg": "690", "description": "Kidney and urinary tract infections without CC", "weight": 0.7745, "principal_prefix": "N39.0", "cc": "N"},
+    {"drg": "562", "description": "Fracture, sprain, strain and dislocation except femur, hip, pelvis or thigh with CC", "weight": 1.2131, "principal_prefix": "S82", "cc": "Y"},
+    {"drg": "563", "description": "Fracture, sprain, strain and dislocation except femur, hip, pelvis or thigh without CC", "weight": 0.8306, "principal_prefix": "S82", "cc": "N"},
+]
+def _normalize_code(code: str) -> str:
+    return code.replace(".", "").strip().upper()
+def load_drg_table(path: str) -> List[Dict[str, Any]]:
+    """
+    Reads a DRG weight table from CSV with columns `drg, description, weight,
+    principal_prefix` and optional `cc` (Y, N or blank for either) and
+    `encounter_type` (blank for any).
+    """
+    with open(path, "r", encoding="utf-8", newline="") as fh:
+        return [dict(row) for row in csv.DictReader(fh)]
+def _factorize(values: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """`np.unique(values, return_inverse=True)`, comparing non-numeric columns as strings."""
+    values = np.asarray(values)
+    if values.dtype.kind not in "biufmM":
+        values = values.astype(str)
+    return np.unique(values, return_inverse=True)
+# --- Grouper ---
+class DRGGrouper:
+    """
+    Maps a principal diagnosis, encounter type and CC status to a DRG and its
+    relative weight. The most specific table row wins: longest matching ICD-10
+    prefix, then an exact encounter type over "any", then an exact CC flag over
+    "any". An encounter has a CC when it carries at least one secondary code.
+    Batches are grouped column-wise: the table is consulted once per distinct
+    (code, encounter type, CC) combination and the answers are broadcast back
+    to every row with NumPy, so cost is dominated by array operations rather
+    than per-encounter Python.
+    """
+    def __init__(self, table: Sequence[Dict[str, Any]] = DEFAULT_DRG_TABLE):
+        drgs, descriptions, weights = [UNGROUPABLE_DRG], ["Ungroupable"], [0.0]
+        self._by_prefix: Dict[str, List[Tuple[int, str, str]]] = {}
+        for row in table:
+            try:
+                weight = float(row["weight"])
+                prefix = _normalize_code(row["principal_prefix"])
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Invalid DRG table row {row!r}: {e}")
+            cc = (row.get("cc") or "").strip().upper()
+            if weight < 0 or not prefix or cc not in ("", "Y", "N"):
+                raise ValueError(f"Invalid DRG table row {row!r}.")
+            self._by_prefix.setdefault(prefix, []).append((len(drgs), (row.get("encounter_type") or "").strip().upper(), cc))
+            drgs.append(str(row["drg"]))
+            descriptions.append(row.get("description") or "")
+            weights.append(weight)
+        self.drgs = np.array(drgs, dtype=object)
+        self.descriptions = np.array(descriptions, dtype=object)
+        self.weights = np.array(weights, dtype=np.float64)
+    @classmethod
+    def from_csv(cls, path: str) -> "DRGGrouper":
+        return cls(load_drg_table(path))
+    def _resolve(self, code: str, encounter_type: str, has_cc: bool) -> int:
+        code = _normalize_code(code)
+        cc = "Y" if has_cc else "N"
+        for length in range(len(code), 0, -1):
+            rows = self._by_prefix.get(code[:length])
+            if not rows:
+                continue
+            best, best_rank = 0, -1
+            for row_idx, row_type, row_cc in rows:
+                if row_type not in ("", encounter_type) or row_cc not in ("", cc):
+                    continue
+                rank = 2 * (row_type != "") + (row_cc != "")
+                if rank > best_rank:
+                    best, best_rank = row_idx, rank
+            if best:
+                return best
+        return 0
+    def group(self, principal_codes: Sequence[str], encounter_types: Optional[Sequence[str]] = None,
+              secondary_counts: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Returns the table row index of the DRG for each encounter (0 means
+        ungroupable); index `drgs` / `weights` with it.
+        """
+        n = len(principal_codes)
+        if n == 0:
+            return np.zeros(0, dtype=np.int32)
+        unique_codes, code_inv = _factorize(principal_codes)
+        unique_types, type_inv = _factorize(encounter_types if encounter_types is not None else np.full(n, ""))
+        unique_types = np.char.upper(unique_types)
+        cc = (np.asarray(secondary_counts) > 0).astype(np.int64) if secondary_counts is not None else np.zeros(n, np.int64)
+        n_types = len(unique_types)
+        keys = (code_inv.astype(np.int64) * n_types + type_inv) * 2 + cc
+        unique_keys, key_inv = np.unique(keys, return_inverse=True)
+        resolved = np.fromiter(
+            (self._resolve(unique_codes[k // 2 // n_types], unique_types[(k // 2) % n_types], bool(k % 2)) for k in unique_keys.tolist()),
+            dtype=np.int32, count=len(unique_keys))
+        return resolved[key_inv]
+    def case_mix_index(self, drg_idx: np.ndarray) -> float:
+        """Mean relative weight of the grouped encounters; ungroupable ones are excluded."""
+        grouped = drg_idx[drg_idx > 0]
+        return float(self.weights[grouped].mean()) if len(grouped) else 0.0
+    def rollup(self, drg_idx: np.ndarray, providers: Sequence[Any], periods: Sequence[Any]) -> "CMIRollup":
+        """Aggregates encounter counts, total weight and CMI per (provider, period) with bincount."""
+        unique_providers, provider_inv = _factorize(providers)
+        unique_periods, period_inv = _factorize(periods)
+        n_groups = len(unique_providers) * len(unique_periods)
+        group_ids = provider_inv.astype(np.int64) * len(unique_periods) + period_inv
+        grouped_mask = drg_idx > 0
+        encounters = np.bincount(group_ids, minlength=n_groups)
+        grouped = np.bincount(group_ids[grouped_mask], minlength=n_groups)
+        total_weight = np.bincount(group_ids[grouped_mask], weights=self.weights[drg_idx[grouped_mask]], minlength=n_groups)
+        present = np.flatnonzero(encounters)
+        cmi = np.divide(total_weight[present], grouped[present], out=np.zeros(len(present)), where=grouped[present] > 0)
+        return CMIRollup(
+            provider=unique_providers[present // len(unique_periods)],
+            period=unique_periods[present % len(unique_periods)],
+            encounters=encounters[present],
+            grouped=grouped[present],
+            total_weight=total_weight[present],
+            cmi=cmi,
+        )
+class CMIRollup(NamedTuple):
+    """Columnar CMI report: one entry per (provider, period) that has encounters."""
+    provider: np.ndarray
+    period: np.ndarray
+    encounters: np.ndarray
+    grouped: np.ndarray
+    total_weight: np.ndarray
+    cmi: np.ndarray
+    def to_records(self) -> List[Dict[str, Any]]:
+        periods = np.datetime_as_string(self.period) if self.period.dtype.kind == "M" else self.period
+        return [
+            {"provider": p, "period": q, "encounters": int(n), "grouped": int(g), "total_weight": round(float(w), 4), "cmi": round(float(c), 4)}
+            for p, q, n, g, w, c in zip(self.provider.tolist(), periods.tolist(), self.encounters, self.grouped, self.total_weight, self.cmi)
+        ]
+# --- Columnar Inputs ---
+def period_keys(dates: Sequence[Any], freq: str = "M") -> np.ndarray:
+    """
+    Buckets dates (ISO strings or datetime64) into monthly (freq="M") or yearly
+    (freq="Y") datetime64 periods; they render as "YYYY-MM" / "YYYY".
+    """
+    if freq not in ("M", "Y"):
+        raise ValueError("freq must be 'M' or 'Y'.")
+    values = np.asarray(dates)
+    if values.dtype.kind in ("U", "S", "O"):
+        values = np.asarray(values.astype(str), dtype="U10")  # Keep the date part; drops times and UTC offsets
+    return values.astype(f"datetime64[{freq}]")
+def encounter_columns(encounters: Iterable[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Converts encounter dicts (`final_codes`, `encounter_type`, `provider_id`,
+    `discharge_dt`) into the column arrays taken by DRGGrouper.group/rollup.
+    """
+    principal, types, secondary, providers, dates = [], [], [], [], []
+    for encounter in encounters:
+        codes = encounter.get("final_codes") or []
+        principal.append(codes[0]["code"] if codes else "")
+        secondary.append(max(0, len(codes) - 1))
+        types.append(encounter.get("encounter_type") or "")
+        providers.append(str(encounter.get("provider_id")))
+        dates.append(str(encounter.get("discharge_dt") or "NaT"))
+    return {
+        "principal_codes": np.array(principal, dtype=str),
+        "encounter_types": np.array(types, dtype=str),
+        "secondary_counts": np.array(secondary, dtype=np.int32),
+        "providers": np.array(providers, dtype=str),
+        "periods": period_keys(np.array(dates, dtype=str)) if dates else np.array([], dtype="datetime64[M]"),
+    }
+def write_case_mix_index(db: sqlalchemy.engine.Engine, encounter_ids: Sequence[Any], weights: np.ndarray,
+                         batch_size: int = 1000) -> int:
+    """Stores each encounter's DRG weight in `encounters.case_mix_index` with batched updates."""
+    statement = sqlalchemy.text("UPDATE encounters SET case_mix_index = :cmi, updated_at = CURRENT_TIMESTAMP WHERE id = :id")
+    rounded = np.round(weights, 3).tolist()
+    with db.begin() as conn:
+        for start in range(0, len(rounded), batch_size):
+            conn.execute(statement, [{"id": str(encounter_ids[i]), "cmi": rounded[i]}
+                                     for i in range(start, min(start + batch_size, len(rounded)))])
+    return len(rounded)
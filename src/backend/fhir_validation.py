@@ -0,0 +1,185 @@
+import threading
+import jsonschema
+from typing import Any, Dict, List, Mapping, Tuple, TypedDict
+# --- nphies Claim / Bundle Profile ---
+# A JSON Schema rendering of the parts of the FHIR R4 Claim resource and the
+# nphies Claim profile that are checked before submission: required elements,
+# cardinalities, value sets for codes, and reference/money datatypes.
+_DATATYPES = {
+    "Reference": {
+        "type": "object",
+        "properties": {
+            "reference": {"type": "string", "minLength": 1},
+            "identifier": {"type": "object"},
+            "display": {"type": "string"},
+        },
+        "anyOf": [{"required": ["reference"]}, {"required": ["identifier"]}],
+    },
+    "Coding": {
+        "type": "object",
+        "properties": {
+            "system": {"type": "string", "minLength": 1},
+            "code": {"type": "string", "minLength": 1},
+            "display": {"type": ["string", "null"]},
+        },
+        "required": ["system", "code"],
+    },
+    "CodeableConcept": {
+        "type": "object",
+        "properties": {
+            "coding": {"type": "array", "minItems": 1, "items": {"$ref": "#/$defs/Coding"}},
+            "text": {"type": "string"},
+        },
+        "required": ["coding"],
+    },
+    "Money": {
+        "type": "object",
+        "properties": {
+            "value": {"type": "number", "minimum": 0},
+            "currency": {"const": "SAR"},
+        },
+        "required": ["value", "currency"],
+    },
+    "PositiveInt": {"type": "integer", "minimum": 1},
+    "DateTime": {"type": "string", "pattern": r"^\d{4}(-\d{2}(-\d{2}(T\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:\d{2})?)?)?)?$"},
+}
+NPHIES_CLAIM_SCHEMA: Dict[str, Any] = {
+    "$schema": "https://json-schema.org/draft/2020-12/schema",
+    "$id": "https://nphies.sa/schemas/Claim",
+    "$defs": _DATATYPES,
+    "type": "object",
+    "properties": {
+        "resourceType": {"const": "Claim"},
+        "status": {"enum": ["active", "cancelled", "draft", "entered-in-error"]},
+        "type": {"$ref": "#/$defs/CodeableConcept"},
+        "subType": {"$ref": "#/$defs/CodeableConcept"},
+        "use": {"enum": ["claim", "preauthorization", "predetermination"]},
+        "patient": {"$ref": "#/$defs/Reference"},
+        "created": {"$ref": "#/$defs/DateTime"},
+        "insurer": {"$ref": "#/$defs/Reference"},
+        "provider": {"$ref": "#/$defs/Reference"},
+        "priority": {"$ref": "#/$defs/CodeableConcept"},
+        "insurance": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "sequence": {"$ref": "#/$defs/PositiveInt"},
+                    "focal": {"type": "boolean"},
+                    "coverage": {"$ref": "#/$defs/Reference"},
+                },
+                "required": ["sequence", "focal", "coverage"],
+            },
+        },
+        "diagnosis": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "sequence": {"$ref": "#/$defs/PositiveInt"},
+                    "diagnosisCodeableConcept": {"$ref": "#/$defs/CodeableConcept"},
+                    "type": {"type": "array", "items": {"$ref": "#/$defs/CodeableConcept"}},
+                },
+                "required": ["sequence", "diagnosisCodeableConcept"],
+            },
+        },
+        "item": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "sequence": {"$ref": "#/$defs/PositiveInt"},
+                    "productOrService": {"$ref": "#/$defs/CodeableConcept"},
+                    "diagnosisSequence": {"type": "array", "items": {"$ref": "#/$defs/PositiveInt"}},
+                    "quantity": {"type": "object", "properties": {"value": {"type": "number", "exclusiveMinimum": 0}}},
+                    "unitPrice": {"$ref": "#/$defs/Money"},
+                    "net": {"$ref": "#/$defs/Money"},
+                },
+                "required": ["sequence", "productOrService"],
+            },
+        },
+        "total": {"$ref": "#/$defs/Money"},
+    },
+    "required": ["resourceType", "status", "type", "use", "patient", "created", "provider", "priority", "insurance", "item"],
+}
+NPHIES_CLAIM_BUNDLE_SCHEMA: Dict[str, Any] = {
+    "$schema": "https://json-schema.org/draft/2020-12/schema",
+    "$id": "https://nphies.sa/schemas/ClaimBundle",
+    "$defs": {**_DATATYPES, "Claim": {k: v for k, v in NPHIES_CLAIM_SCHEMA.items() if k not in ("$schema", "$id", "$defs")}},
+    "type": "object",
+    "properties": {
+        "resourceType": {"const": "Bundle"},
+        "type": {"enum": ["transaction", "batch", "message", "collection"]},
+        "entry": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "fullUrl": {"type": "string", "pattern": "^(urn:uuid:|https?://)"},
+                    "resource": {"type": "object", "required": ["resourceType"]},
+                    "request": {
+                        "type": "object",
+                        "properties": {
+                            "method": {"enum": ["GET", "HEAD", "POST", "PUT", "DELETE", "PATCH"]},
+                            "url": {"type": "string", "minLength": 1},
+                        },
+                        "required": ["method", "url"],
+                    },
+                },
+                "required": ["fullUrl", "resource"],
+                "allOf": [{
+                    "if": {"properties": {"resource": {"properties": {"resourceType": {"const": "Claim"}}}}},
+                    "then": {"properties": {"resource": {"$ref": "#/$defs/Claim"}}},
+                }],
+            },
+        },
+    },
+    "required": ["resourceType", "type", "entry"],
+    "allOf": [{
+        "if": {"properties": {"type": {"enum": ["transaction", "batch"]}}},
+        "then": {"properties": {"entry": {"items": {"required": ["request"]}}}},
+    }],
+}
+# --- Validator Registry ---
+class FhirValidationIssue(TypedDict):
+    path: str
+    message: str
+class FhirValidatorRegistry:
+    """
+    Compiles each JSON schema once and reuses the validator for every payload.
+    `jsonschema.validate` re-checks the schema and builds a new validator on
+    each call; here that cost is paid only on first use of a schema. Schemas are
+    keyed by identity, so pass the same dict object (e.g. a module constant).
+    """
+    def __init__(self):
+        self._validators: Dict[int, Tuple[Mapping[str, Any], Any]] = {}
+        self._lock = threading.Lock()
+    def __len__(self) -> int:
+        return len(self._validators)
+    def validator_for(self, schema: Mapping[str, Any]):
+        cached = self._validators.get(id(schema))
+        if cached is not None and cached[0] is schema:
+            return cached[1]
+        with self._lock:
+            cached = self._validators.get(id(schema))
+            if cached is not None and cached[0] is schema:
+                return cached[1]
+            cls = jsonschema.validators.validator_for(schema)
+            cls.check_schema(schema)
+            validator = cls(schema)
+            # The schema is held alongside its validator so its id cannot be reused.
+            self._validators[id(schema)] = (schema, validator)
+            return validator
+    def iter_issues(self, instance: Any, schema: Mapping[str, Any]):
+        for error in self.validator_for(schema).iter_errors(instance):
+            path = "/".join(str(p) for p in error.absolute_path)
+            yield {"path": path or "(root)", "message": error.message}
+    def errors(self, instance: Any, schema: Mapping[str, Any]) -> List[FhirValidationIssue]:
+        """Returns every validation issue in `instance`, ordered by path (empty when valid)."""
+        return sorted(self.iter_issues(instance, schema), key=lambda issue: issue["path"])
+    def is_valid(self, instance: Any, schema: Mapping[str, Any]) -> bool:
+        return self.validator_for(schema).is_valid(instance)
+default_registry = FhirValidatorRegistry()
@@ -0,0 +1,170 @@
+"""
+Process-local instrumentation: counters, latency histograms and stage timers,
+rendered in the Prometheus text exposition format, plus a JSON log formatter.
+Metrics are off unless METRICS_ENABLED=1 (or `registry.enable()`); while off,
+`inc` and `observe` return after one attribute check and `timer` hands out a
+shared no-op context manager, so instrumented hot paths cost well under a
+microsecond per call. Each process has its own registry: coding done in
+process-pool workers (CodingEngine.run_coding_jobs with processes) is not
+counted by the parent.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit.
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_HELP: Dict[str, Tuple[str, str]] = {
+    "stage_seconds": ("histogram", "Time spent per pipeline stage (nlp, phase_decision, fhir_map, fhir_validate, auth, http, ...)."),
+    "coding_phase_total": ("counter", "Coding jobs by automation phase (AUTONOMOUS, SEMI_AUTONOMOUS, CAC)."),
+    "nphies_responses_total": ("counter", "HTTP responses from nphies by endpoint class and status code."),
+    "nphies_retries_total": ("counter", "Requests to nphies retried after a throttling or server error."),
+    "nphies_token_refreshes_total": ("counter", "OAuth tokens fetched from nphies."),
+    "nphies_401_replays_total": ("counter", "Requests replayed with a new token after a 401."),
+    "nphies_request_errors_total": ("counter", "Requests to nphies that failed, by kind."),
+}
+LabelKey = Tuple[Tuple[str, str], ...]
+class _NullTimer:
+    __slots__ = ()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        return False
+_NULL_TIMER = _NullTimer()
+class _Timer:
+    __slots__ = ("registry", "name", "labels", "start")
+    def __init__(self, registry: "MetricsRegistry", name: str, labels: Dict[str, Any]):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+class MetricsRegistry:
+    """Thread-safe counters and histograms keyed by metric name and label values."""
+    def __init__(self, enabled: bool = False, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        # name -> labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._histograms: Dict[str, Dict[LabelKey, List[Any]]] = {}
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+    def inc(self, name: str, amount: float = 1, **labels: Any):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+    def observe(self, name: str, seconds: float, **labels: Any):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        idx = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += seconds
+            entry[2] += 1
+    def timer(self, name: str, **labels: Any):
+        """Context manager observing the elapsed time of its block into histogram `name`."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+    def stage(self, stage: str):
+        """Shorthand for `timer("stage_seconds", stage=stage)`."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, "stage_seconds", {"stage": stage})
+    def counter(self, name: str, **labels: Any) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+    def histogram(self, name: str, **labels: Any) -> Dict[str, float]:
+        """`{"count", "sum"}` of one histogram series (zeros if never observed)."""
+        with self._lock:
+            entry = self._histograms.get(name, {}).get(_label_key(labels))
+            return {"count": entry[2], "sum": entry[1]} if entry else {"count": 0, "sum": 0.0}
+    def render(self) -> str:
+        """All series in the Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {k: [list(v[0]), v[1], v[2]] for k, v in series.items()} for name, series in self._histograms.items()}
+        for name in sorted(counters):
+            _header(lines, name, "counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {value:g}")
+        for name in sorted(histograms):
+            _header(lines, name, "histogram")
+            for key, (counts, total, count) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key)} {total:.9g}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
+def _header(lines: List[str], name: str, kind: str):
+    kind, help_text = METRIC_HELP.get(name, (kind, ""))
+    if help_text:
+        lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+def metrics_enabled_from_env(var: str = "METRICS_ENABLED") -> bool:
+    return os.getenv(var, "").strip().lower() in ("1", "true", "yes", "on")
+# The process-wide registry used by the instrumented modules and GET /metrics.
+registry = MetricsRegistry(enabled=metrics_enabled_from_env())
+# --- Structured logging ---
+# LogRecord attributes that are not user-supplied `extra` fields.
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra={...}` fields."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+def configure_logging(level: Optional[str] = None, json_format: Optional[bool] = None):
+    """
+    Installs a stderr handler on the root logger unless one exists; level
+    from LOG_LEVEL (default INFO), JSON lines unless LOG_FORMAT=text.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler()
+    if json_format if json_format is not None else os.getenv("LOG_FORMAT", "json").lower() != "text":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root.addHandler(handler)
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
@@ -0,0 +1,333 @@
+"""
+A local stand-in for the nphies API, served over real HTTP (stdlib
+http.server on a background thread) so NphiesConnector can be exercised
+end to end: connection pooling, timeouts, token refresh and retries.
+Endpoints: POST /oauth/token, POST /Claim, GET /Claim/{id} (with ETag /
+If-None-Match), POST /PaymentNotice, and POST to the FHIR base for
+transaction/batch Bundles. Faults are injected at configurable rates:
+server-side token expiry (401 invalid_token), 429 with Retry-After, 5xx,
+and slow bodies that trickle out in chunks; every response can be delayed
+by a latency distribution per route.
+Usage (from the repository root):
+    python -m src.backend.mock_nphies_server --port 8089 --latency lognormal:0.05:0.6 \\
+        --token-lifetime 30 --throttle-rate 0.02 --error-rate 0.01
+"""
+import argparse
+import gzip
+import itertools
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import parse_qs
+Latency = Callable[[], float]  # Returns a delay in seconds
+ROUTES = ("token", "claim", "claim_status", "payment_notice", "bundle")
+# --- Latency distributions ---
+def fixed_latency(seconds: float) -> Latency:
+    return lambda: seconds
+def uniform_latency(low: float, high: float, rng: Optional[random.Random] = None) -> Latency:
+    rng = rng or random.Random()
+    return lambda: rng.uniform(low, high)
+def lognormal_latency(median: float, sigma: float, rng: Optional[random.Random] = None, cap: float = 30.0) -> Latency:
+    """Long-tailed latency: `median` seconds at the 50th percentile, spread `sigma` (0.5 is moderate)."""
+    rng = rng or random.Random()
+    mu = math.log(median)
+    return lambda: min(cap, rng.lognormvariate(mu, sigma))
+def parse_latency(spec: str, rng: Optional[random.Random] = None) -> Latency:
+    """Parses `fixed:S`, `uniform:LOW:HIGH` or `lognormal:MEDIAN:SIGMA` (seconds)."""
+    kind, *args = spec.split(":")
+    try:
+        values = [float(a) for a in args]
+        if kind == "fixed" and len(values) == 1:
+            return fixed_latency(values[0])
+        if kind == "uniform" and len(values) == 2:
+            return uniform_latency(values[0], values[1], rng)
+        if kind == "lognormal" and len(values) == 2:
+            return lognormal_latency(values[0], values[1], rng)
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency spec {spec!r}; expected fixed:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA.")
+# --- Server ---
+class MockNphiesServer:
+    """
+    Mock nphies server. `latency` is one distribution for every route or a
+    dict keyed by route name (see ROUTES; "default" applies to the rest).
+    Tokens report `token_ttl` as expires_in but stop being accepted after
+    `token_lifetime` seconds (default: the same), so a shorter lifetime
+    simulates early revocation. `throttle_rate`, `error_rate` and
+    `slow_body_rate` are per-request probabilities (token requests excepted);
+    injected 429s and 503s carry `Retry-After: retry_after`. Claims become
+    "active" (adjudicated) `adjudication_delay` seconds after submission.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: Union[None, Latency, Dict[str, Latency]] = None, token_ttl: int = 3600,
+                 token_lifetime: Optional[float] = None, throttle_rate: float = 0.0, error_rate: float = 0.0,
+                 error_statuses: Tuple[int, ...] = (500, 502, 503), retry_after: float = 1,
+                 slow_body_rate: float = 0.0, slow_body_chunks: int = 10, slow_body_delay: float = 0.05,
+                 adjudication_delay: float = 0.0, seed: Optional[int] = None):
+        if not isinstance(latency, dict):
+            latency = {"default": latency} if latency is not None else {}
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.token_lifetime = token_ttl if token_lifetime is None else token_lifetime
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.retry_after = retry_after
+        self.slow_body_rate = slow_body_rate
+        self.slow_body_chunks = slow_body_chunks
+        self.slow_body_delay = slow_body_delay
+        self.adjudication_delay = adjudication_delay
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, float] = {}  # access token -> time it stops being accepted
+        self._claims: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._counts: Dict[str, int] = {}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    def start(self) -> "MockNphiesServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, kwargs={"poll_interval": 0.05},
+                                        name="mock-nphies", daemon=True)
+        self._thread.start()
+        return self
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+    def __enter__(self) -> "MockNphiesServer":
+        return self.start()
+    def __exit__(self, *exc_info):
+        self.stop()
+    def _count(self, key: str):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+    def stats(self) -> Dict[str, int]:
+        """Request counts per route and per response status, plus injected faults."""
+        with self._lock:
+            return dict(sorted(self._counts.items()))
+    def expire_tokens(self):
+        """Revokes every issued token; the next request with one gets 401 invalid_token."""
+        with self._lock:
+            self._tokens.clear()
+    def _chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < rate
+    def _delay(self, route: str) -> float:
+        latency = self.latency.get(route) or self.latency.get("default")
+        if latency is None:
+            return 0.0
+        with self._lock:  # Distributions share the seeded generator
+            return max(0.0, latency())
+    # --- Route handlers: return (status, body, extra headers) ---
+    def _issue_token(self) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._tokens[token] = time.monotonic() + self.token_lifetime
+        self._count("tokens_issued")
+        return 200, {"access_token": token, "token_type": "Bearer", "expires_in": self.token_ttl}, {}
+    def _authorized(self, header: Optional[str]) -> bool:
+        if not header or not header.startswith("Bearer "):
+            return False
+        with self._lock:
+            expires = self._tokens.get(header[7:])
+        return expires is not None and time.monotonic() < expires
+    def _store_claim(self, claim: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        claim_id = str(claim.get("id") or f"{next(self._ids)}")
+        record = {"resourceType": "Claim", **claim, "id": claim_id, "status": "draft", "_version": 1,
+                  "_adjudicate_at": time.monotonic() + self.adjudication_delay}
+        with self._lock:
+            self._claims[claim_id] = record
+        return claim_id, record
+    def _claim_from_bundle(self, bundle: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+        """The Claim in a single-claim Bundle and its id (from the urn:uuid fullUrl)."""
+        for entry in bundle.get("entry") or []:
+            resource = entry.get("resource") or {}
+            if resource.get("resourceType", "Claim") == "Claim":
+                full_url = str(entry.get("fullUrl") or "")
+                return (full_url.rsplit(":", 1)[-1] or None), resource
+        return None, bundle
+    def _submit_claim(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        claim_id, claim = self._claim_from_bundle(body) if body.get("resourceType") == "Bundle" else (None, body)
+        claim_id, _ = self._store_claim({**claim, "id": claim_id or claim.get("id")})
+        return 201, {"resourceType": "ClaimResponse", "id": claim_id, "status": "active", "outcome": "queued",
+                     "request": {"reference": f"Claim/{claim_id}"}}, {"Location": f"Claim/{claim_id}"}
+    def _claim_status(self, claim_id: str, if_none_match: Optional[str]) -> Tuple[int, Any, Dict[str, str]]:
+        with self._lock:
+            record = self._claims.get(claim_id)
+            if record is not None and record["status"] == "draft" and time.monotonic() >= record["_adjudicate_at"]:
+                record["status"] = "active"
+                record["_version"] += 1
+            snapshot = dict(record) if record is not None else None
+        if snapshot is None:
+            return 404, _operation_outcome("not-found", f"Claim/{claim_id} is not known."), {}
+        etag = f'W/"{snapshot["_version"]}"'
+        if if_none_match == etag:
+            return 304, None, {"ETag": etag}
+        return 200, {k: v for k, v in snapshot.items() if not k.startswith("_")}, {"ETag": etag}
+    def _payment_notice(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        notice_id = f"PN-{next(self._ids)}"
+        return 201, {**body, "resourceType": "PaymentNotice", "id": notice_id}, {"Location": f"PaymentNotice/{notice_id}"}
+    def _bundle(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        entries = []
+        for entry in body.get("entry") or []:
+            resource = entry.get("resource") or {}
+            url = str((entry.get("request") or {}).get("url") or resource.get("resourceType") or "")
+            if url.startswith("PaymentNotice"):
+                _, _, headers = self._payment_notice(resource)
+                entries.append({"response": {"status": "201 Created", "location": headers["Location"]}})
+            elif url.startswith("Claim"):
+                claim_id = str(entry.get("fullUrl") or "").rsplit(":", 1)[-1] or None
+                claim_id, _ = self._store_claim({**resource, "id": claim_id or resource.get("id")})
+                entries.append({"response": {"status": "201 Created", "location": f"Claim/{claim_id}"}})
+            else:
+                entries.append({"response": {"status": "400 Bad Request",
+                                             "outcome": _operation_outcome("not-supported", f"Unsupported entry {url!r}.")}})
+        return 200, {"resourceType": "Bundle", "type": f"{body.get('type', 'batch')}-response", "entry": entries}, {}
+    def _handler_class(self):
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, so client connection pooling is exercised
+            def log_message(self, format, *args):
+                pass
+            def _body(self) -> bytes:
+                data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    data = gzip.decompress(data)
+                return data
+            def _send(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None, slow: bool = False):
+                payload = b"" if body is None else json.dumps(body).encode("utf-8")
+                server._count(f"status_{status}")
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if body is not None:
+                    self.send_header("Content-Type", "application/fhir+json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                if not slow or not payload:
+                    self.wfile.write(payload)
+                    return
+                server._count("slow_bodies")
+                step = max(1, -(-len(payload) // server.slow_body_chunks))
+                for start in range(0, len(payload), step):
+                    self.wfile.write(payload[start:start + step])
+                    self.wfile.flush()
+                    time.sleep(server.slow_body_delay)
+            def _route(self, method: str) -> Optional[str]:
+                path = self.path.split("?", 1)[0].rstrip("/")
+                if method == "POST" and path == "/oauth/token":
+                    return "token"
+                if method == "POST" and path == "/Claim":
+                    return "claim"
+                if method == "GET" and path.startswith("/Claim/"):
+                    return "claim_status"
+                if method == "POST" and path == "/PaymentNotice":
+                    return "payment_notice"
+                if method == "POST" and path == "":
+                    return "bundle"
+                return None
+            def _handle(self, method: str):
+                route = self._route(method)
+                raw = self._body() if method == "POST" else b""
+                if route is None:
+                    self._send(404, _operation_outcome("not-found", f"No route for {method} {self.path}."))
+                    return
+                server._count(route)
+                delay = server._delay(route)
+                if delay:
+                    time.sleep(delay)
+                if route == "token":
+                    form = parse_qs(raw.decode("utf-8"))
+                    if not form.get("client_id") or form.get("grant_type") != ["client_credentials"]:
+                        self._send(400, {"error": "invalid_request"})
+                        return
+                    self._send(*server._issue_token())
+                    return
+                if not server._authorized(self.headers.get("Authorization")):
+                    server._count("unauthorized")
+                    self._send(401, {"error": "invalid_token", "error_description": "The access token expired or is invalid."},
+                               {"WWW-Authenticate": 'Bearer error="invalid_token"'})
+                    return
+                if server._chance(server.throttle_rate):
+                    server._count("injected_throttles")
+                    self._send(429, _operation_outcome("throttled", "Too many requests."), {"Retry-After": f"{server.retry_after:g}"})
+                    return
+                if server._chance(server.error_rate):
+                    with server._lock:
+                        status = server._rng.choice(server.error_statuses)
+                    server._count("injected_errors")
+                    headers = {"Retry-After": f"{server.retry_after:g}"} if status == 503 else {}
+                    self._send(status, _operation_outcome("transient", "Injected server error."), headers)
+                    return
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    self._send(400, _operation_outcome("structure", "Request body is not JSON."))
+                    return
+                if route == "claim":
+                    result = server._submit_claim(body)
+                elif route == "claim_status":
+                    result = server._claim_status(self.path.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1],
+                                                  self.headers.get("If-None-Match"))
+                elif route == "payment_notice":
+                    result = server._payment_notice(body)
+                else:
+                    result = server._bundle(body)
+                self._send(*result, slow=server._chance(server.slow_body_rate))
+            def do_GET(self):
+                self._handle("GET")
+            def do_POST(self):
+                self._handle("POST")
+        return Handler
+def _operation_outcome(code: str, diagnostics: str) -> Dict[str, Any]:
+    return {"resourceType": "OperationOutcome", "issue": [{"severity": "error", "code": code, "diagnostics": diagnostics}]}
+# --- CLI ---
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run a local mock nphies server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", help="Latency for every route: fixed:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA.")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="expires_in reported for tokens (seconds).")
+    parser.add_argument("--token-lifetime", type=float, help="Seconds until tokens are actually rejected (default: the TTL).")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered 429.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered 500/502/503.")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After seconds on injected 429/503.")
+    parser.add_argument("--slow-body-rate", type=float, default=0.0, help="Fraction of responses sent in slow chunks.")
+    parser.add_argument("--slow-body-delay", type=float, default=0.05, help="Seconds between slow-body chunks.")
+    parser.add_argument("--seed", type=int)
+    return parser.parse_args(argv)
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    rng = random.Random(args.seed)
+    server = MockNphiesServer(
+        args.host, args.port, latency=parse_latency(args.latency, rng) if args.latency else None,
+        token_ttl=args.token_ttl, token_lifetime=args.token_lifetime, throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate, retry_after=args.retry_after, slow_body_rate=args.slow_body_rate,
+        slow_body_delay=args.slow_body_delay, seed=args.seed,
+    ).start()
+    print(f"Mock nphies server listening on {server.url} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.stats()))
+    return 0
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import re
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple, Union
+try:
+    from .term_matcher import TermMatch, TermMatcher
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from term_matcher import TermMatch, TermMatcher
+# A sentence ends at terminal punctuation followed by whitespace (or the end of
+# the note), or at a line break. Clinical notes are often one finding per line,
+# and treating newlines as boundaries keeps sentences within a line.
+_SENTENCE_END_RE = re.compile(r"[.!?]+(?=\s|$)|\n")
+class PreprocessedNote:
+    """
+    A clinical note normalized once and shared by every analysis stage.
+    `normalized` is the lowercased text that dictionary matchers scan; sentence
+    boundaries (for sentence-scoped negation) are built on first use and stored
+    as compact integer arrays of character offsets into `normalized`. Matcher
+    results are memoized per matcher, so the coding engine and the CDI rules
+    each scan the note once however many times they consult it. Create one per
+    encounter with `preprocess_note` and pass it to both engines (a CodingEngine
+    with a `cdi_engine` does this itself).
+    """
+    __slots__ = ("text", "normalized", "_sentence_starts", "_sentence_ends", "_matches")
+    def __init__(self, text: str):
+        self.text = text
+        self.normalized = text.lower()
+        self._sentence_starts: Optional[array] = None
+        self._sentence_ends: Optional[array] = None
+        self._matches: Dict[int, Tuple[TermMatcher, List[TermMatch]]] = {}
+    def __getstate__(self) -> Dict[str, Any]:
+        # Memoized matches reference matchers by identity, which does not survive pickling.
+        return {"text": self.text}
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__init__(state["text"])
+    def __len__(self) -> int:
+        return len(self.text)
+    # --- Sentences ---
+    def _split_sentences(self):
+        starts, ends = array("l"), array("l")
+        text = self.normalized
+        start = 0
+        for m in _SENTENCE_END_RE.finditer(text):
+            self._add_sentence(starts, ends, text, start, m.end())
+            start = m.end()
+        self._add_sentence(starts, ends, text, start, len(text))
+        self._sentence_starts, self._sentence_ends = starts, ends
+    @staticmethod
+    def _add_sentence(starts: array, ends: array, text: str, start: int, end: int):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            starts.append(start)
+            ends.append(end)
+    @property
+    def sentence_starts(self) -> array:
+        if self._sentence_starts is None:
+            self._split_sentences()
+        return self._sentence_starts
+    @property
+    def sentence_ends(self) -> array:
+        if self._sentence_ends is None:
+            self._split_sentences()
+        return self._sentence_ends
+    @property
+    def sentence_count(self) -> int:
+        return len(self.sentence_starts)
+    def sentence_spans(self) -> List[Tuple[int, int]]:
+        return list(zip(self.sentence_starts, self.sentence_ends))
+    def sentence_of(self, offset: int) -> int:
+        """Index of the sentence containing (or immediately preceding) a character offset."""
+        return max(0, bisect_right(self.sentence_starts, offset) - 1)
+    # --- Dictionary Matching ---
+    def find_all(self, matcher: TermMatcher) -> List[TermMatch]:
+        """Every hit of `matcher` in the note; the scan runs once per matcher and is then reused."""
+        cached = self._matches.get(id(matcher))
+        if cached is not None and cached[0] is matcher:
+            return cached[1]
+        if matcher.case_insensitive:
+            matches = list(matcher.finditer_normalized(self.normalized))
+        else:
+            matches = list(matcher.finditer(self.text))
+        self._matches[id(matcher)] = (matcher, matches)
+        return matches
+    def matched_indices(self, matcher: TermMatcher) -> List[int]:
+        """Sorted dictionary indices of the terms of `matcher` present in the note."""
+        return sorted({matcher.index_of(m.term) for m in self.find_all(matcher)})
+NoteInput = Union[str, PreprocessedNote]
+def preprocess_note(note: NoteInput) -> PreprocessedNote:
+    """Returns `note` unchanged if it is already preprocessed, otherwise preprocesses it."""
+    return note if isinstance(note, PreprocessedNote) else PreprocessedNote(note)
@@ -1,11 +1,25 @@
 import os
+import gzip
+import logging
 import time
 import requests
 import json
 import jsonschema
+from contextlib import nullcontext
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Sequence, Tuple, TypedDict
+try:
+    from .fhir_validation import NPHIES_CLAIM_BUNDLE_SCHEMA, FhirValidationIssue, default_registry
+    from .token_manager import OAuthTokenManager, default_token_cache_path
+    from .rate_limiter import NphiesRateLimiter, is_retryable, jittered_backoff, parse_retry_after
+    from .instrumentation import registry as metrics
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from fhir_validation import NPHIES_CLAIM_BUNDLE_SCHEMA, FhirValidationIssue, default_registry
+    from token_manager import OAuthTokenManager, default_token_cache_path
+    from rate_limiter import NphiesRateLimiter, is_retryable, jittered_backoff, parse_retry_after
+    from instrumentation import registry as metrics
+logger = logging.getLogger(__name__)
 # Custom Exceptions for clear error handling
 class NphiesAuthError(Exception):
     """Raised when authentication with the Nphies platform fails."""
@@ -15,7 +29,9 @@ class NphiesAPIError(Exception):
     pass
 class NphiesValidationError(Exception):
     """Raised when a payload fails FHIR schema validation."""
-    pass
+    def __init__(self, message: str, errors: Optional[List[FhirValidationIssue]] = None):
+        super().__init__(message)
+        self.errors: List[FhirValidationIssue] = errors or []
 # A simplified FHIR Bundle schema for validation purposes.
 # In a real-world scenario, this would be a comprehensive schema.
 FHIR_BUNDLE_SCHEMA = {
@@ -36,26 +52,227 @@ FHIR_BUNDLE_SCHEMA = {
     },
     "required": ["resourceType", "type", "entry"]
 }
-class NphiesConnector:
+class ClaimSubmissionResult(TypedDict):
+    claimNumber: Optional[str]
+    success: bool
+    status: Optional[str]          # Per-entry HTTP status from the response Bundle, e.g. "201 Created"
+    location: Optional[str]        # Location of the created Claim/ClaimResponse, if returned
+    outcome: Optional[Dict[str, Any]]  # OperationOutcome attached to the entry, if any
+    error: Optional[str]
+class NphiesPayloadMixin:
+    """
+    FHIR mapping, validation and response parsing shared by the blocking and
+    asyncio nphies connectors. None of these methods perform I/O.
+    """
+    FHIR_BUNDLE_SCHEMA = FHIR_BUNDLE_SCHEMA
+    NPHIES_CLAIM_BUNDLE_SCHEMA = NPHIES_CLAIM_BUNDLE_SCHEMA
+    # Schema claim Bundles are validated against before submission. Pass
+    # bundle_schema=NPHIES_CLAIM_BUNDLE_SCHEMA to enforce the full nphies profile.
+    bundle_schema: Dict[str, Any] = FHIR_BUNDLE_SCHEMA
+    def _validate_fhir(self, data: Dict[str, Any], schema: Dict[str, Any]):
+        """
+        Validates `data` with a cached, precompiled validator for `schema` and
+        reports every violation at once via NphiesValidationError.errors.
+        """
+        try:
+            with metrics.stage("fhir_validate"):
+                errors = default_registry.errors(data, schema)
+        except jsonschema.exceptions.SchemaError as e:
+            raise NphiesValidationError(f"Invalid FHIR validation schema: {e.message}") from e
+        if errors:
+            summary = "; ".join(f"{e['path']}: {e['message']}" for e in errors[:5])
+            if len(errors) > 5:
+                summary += f" (and {len(errors) - 5} more)"
+            raise NphiesValidationError(f"FHIR payload validation failed: {summary}", errors=errors)
+    def _map_to_fhir_claim_bundle(self, claim_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Stub function to map internal claim data to a FHIR Bundle for a Claim.
+        """
+        return {
+            "resourceType": "Bundle",
+            "type": "transaction",
+            "entry": [self._map_to_fhir_claim_entry(claim_data)]
+        }
+    def _map_to_fhir_claim_entry(self, claim_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Maps internal claim data to a single Bundle entry POSTing a Claim."""
+        with metrics.stage("fhir_map"):
+            return self._build_claim_entry(claim_data)
+    def _build_claim_entry(self, claim_data: Dict[str, Any]) -> Dict[str, Any]:
+        claim_resource = {
+            "resourceType": "Claim",
+            "status": "active",
+            "use": "claim",
+            "patient": {"reference": f"Patient/{claim_data.get('patient', {}).get('id')}"},
+            "item": [
+                {
+                    "sequence": i + 1,
+                    "productOrService": {
+                        "coding": [{
+                            "system": "http://hl7.org/fhir/sid/icd-10",
+                            "code": item.get("serviceCode"),
+                            "display": item.get("description")
+                        }]
+                    }
+                } for i, item in enumerate(claim_data.get("items", []))
+            ]
+        }
+        return {
+            "fullUrl": f"urn:uuid:{claim_data.get('claimNumber')}",
+            "resource": claim_resource,
+            "request": {
+                "method": "POST",
+                "url": "Claim"
+            }
+        }
+    def _pack_claim_bundles(
+        self,
+        claims: Sequence[Dict[str, Any]],
+        max_bundle_entries: int = 100,
+        max_bundle_bytes: Optional[int] = None,
+        bundle_type: str = "transaction",
+    ) -> Tuple[List[Tuple[Dict[str, Any], List[int]]], Dict[int, ClaimSubmissionResult]]:
+        """
+        Maps and validates each claim, then packs the valid entries into Bundles
+        of at most `max_bundle_entries` entries and (approximately) `max_bundle_bytes`
+        of JSON. Returns `(bundles, rejected)`: each bundle paired with the input
+        indices of its claims, and validation failures keyed by input index.
+        """
+        if max_bundle_entries < 1:
+            raise ValueError("max_bundle_entries must be positive.")
+        bundles: List[Tuple[Dict[str, Any], List[int]]] = []
+        rejected: Dict[int, ClaimSubmissionResult] = {}
+        entries: List[Dict[str, Any]] = []
+        indices: List[int] = []
+        size = 0
+        def flush():
+            if entries:
+                bundles.append(({"resourceType": "Bundle", "type": bundle_type, "entry": list(entries)}, list(indices)))
+                entries.clear()
+                indices.clear()
+        for idx, claim_data in enumerate(claims):
+            entry = self._map_to_fhir_claim_entry(claim_data)
+            try:
+                self._validate_fhir({"resourceType": "Bundle", "type": bundle_type, "entry": [entry]}, self.bundle_schema)
+            except NphiesValidationError as e:
+                rejected[idx] = self._claim_result(claim_data, error=str(e))
+                continue
+            entry_size = len(json.dumps(entry, separators=(",", ":"))) if max_bundle_bytes else 0
+            if len(entries) >= max_bundle_entries or (max_bundle_bytes and entries and size + entry_size > max_bundle_bytes):
+                flush()
+                size = 0
+            entries.append(entry)
+            indices.append(idx)
+            size += entry_size
+        flush()
+        return bundles, rejected
+    def _encode_bundle(self, bundle: Dict[str, Any], compress: bool) -> Tuple[bytes, Dict[str, str]]:
+        body = json.dumps(bundle, separators=(",", ":")).encode("utf-8")
+        if compress:
+            return gzip.compress(body), {"Content-Encoding": "gzip"}
+        return body, {}
+    def _claim_result(self, claim_data: Dict[str, Any], success: bool = False, status: Optional[str] = None,
+                      location: Optional[str] = None, outcome: Optional[Dict[str, Any]] = None,
+                      error: Optional[str] = None) -> ClaimSubmissionResult:
+        return {
+            "claimNumber": claim_data.get("claimNumber"),
+            "success": success,
+            "status": status,
+            "location": location,
+            "outcome": outcome,
+            "error": error,
+        }
+    def _parse_bundle_response(self, claims: Sequence[Dict[str, Any]], response: Dict[str, Any]) -> List[ClaimSubmissionResult]:
+        """
+        Splits a transaction/batch-response Bundle into one result per submitted
+        claim. Entries are matched positionally, as FHIR requires the response
+        to mirror the request order. Raises NphiesAPIError when the response is
+        not a Bundle (e.g. an OperationOutcome, a list or an error string).
+        """
+        if not isinstance(response, dict) or response.get("resourceType", "Bundle") != "Bundle":
+            kind = response.get("resourceType") if isinstance(response, dict) else type(response).__name__
+            issues = response.get("issue") if isinstance(response, dict) else None
+            detail = "; ".join(str(i.get("diagnostics") or i.get("code", "")) for i in issues if isinstance(i, dict)) if isinstance(issues, list) else ""
+            raise NphiesAPIError(f"Expected a response Bundle from nphies, got {kind}" + (f": {detail}" if detail else "."))
+        entries = response.get("entry") or []
+        if not isinstance(entries, list):
+            raise NphiesAPIError("Malformed response Bundle from nphies: 'entry' is not a list.")
+        results = []
+        for i, claim_data in enumerate(claims):
+            if i >= len(entries):
+                results.append(self._claim_result(claim_data, error="No response entry returned for this claim."))
+                continue
+            if not isinstance(entries[i], dict):
+                results.append(self._claim_result(claim_data, error="Malformed response entry returned for this claim."))
+                continue
+            entry_response = entries[i].get("response")
+            entry_response = entry_response if isinstance(entry_response, dict) else {}
+            status = entry_response.get("status")
+            outcome = entry_response.get("outcome") or (
+                entries[i].get("resource") if (entries[i].get("resource") or {}).get("resourceType") == "OperationOutcome" else None
+            )
+            success = bool(status) and str(status).strip()[:1] == "2"
+            error = None
+            if not success:
+                issues = (outcome or {}).get("issue") or []
+                error = "; ".join(issue.get("diagnostics") or issue.get("code", "") for issue in issues) or f"Entry failed with status {status}."
+            results.append(self._claim_result(claim_data, success, status, entry_response.get("location"), outcome, error))
+        return results
+    def _parse_claim_status(self, claim_id: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        # Mock parsing logic: In real FHIR, you'd traverse the bundle to find the outcome.
+        if response.get("status") == "active":
+            return {"status": "FC_3", "claimId": claim_id}
+        return {"status": "PENDING", "claimId": claim_id}
+class NphiesConnector(NphiesPayloadMixin):
     """
     Manages all API interactions with the Saudi national 'nphies' platform.
     This class handles OAuth 2.0 authentication, enforces TLS 1.2, manages
     request timeouts, and implements a retry strategy for transient errors.
     It provides methods for core nphies workflows like claim submission and
     status checks, with basic FHIR payload mapping and validation.
+    OAuth tokens are held by an OAuthTokenManager. Pass the same
+    `token_manager` to several connectors to share one token in-process, set
+    `share_token_across_processes=True` to also share it with other workers
+    via a local file cache, and `proactive_token_refresh=True` to renew it in
+    the background before it expires.
+    Throttling (429) and 5xx responses are retried here rather than by urllib3:
+    Retry-After is honored, other retries use jittered exponential backoff, and
+    POSTs are only retried when the server did not process them (429, or 503
+    with Retry-After; see `is_retryable`) so a claim is never submitted twice.
+    Client-side rate limiting is opt-in: pass a NphiesRateLimiter (token bucket
+    plus AIMD concurrency limit per endpoint class, configured with the quota
+    in the provider's nphies agreement) and every request passes through it.
+    Share one `rate_limiter` between connectors/threads to coordinate them;
+    see `rate_limiter.metrics()`. Without one, requests are not throttled
+    locally and a Retry-After is waited out by the requesting thread only.
     """
-    def __init__(self, base_url: str, client_id: str, client_secret: str, timeout: int = 15, verify: bool = True):
+    def __init__(self, base_url: str, client_id: str, client_secret: str, timeout: int = 15, verify: bool = True,
+                 bundle_schema: Optional[Dict[str, Any]] = None, token_manager: Optional[OAuthTokenManager] = None,
+                 share_token_across_processes: bool = False, token_cache_dir: Optional[str] = None,
+                 proactive_token_refresh: bool = False, rate_limiter: Optional[NphiesRateLimiter] = None,
+                 max_retries: int = 3, backoff_base: float = 1.0, backoff_cap: float = 30.0):
         self.base_url = base_url
         self.client_id = client_id
         self.client_secret = client_secret
         self.timeout = timeout
-        self._token_data: Dict[str, Any] = {}
+        if bundle_schema is not None:
+            self.bundle_schema = bundle_schema
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
         self.session = self._create_session()
+        if token_manager is None:
+            cache_path = default_token_cache_path(base_url, client_id, token_cache_dir) if share_token_across_processes else None
+            token_manager = OAuthTokenManager(self._fetch_oauth_token, cache_path=cache_path)
+        self.token_manager = token_manager
+        if proactive_token_refresh:
+            self.token_manager.start_background_refresh()
     def _create_session(self) -> requests.Session:
         session = requests.Session()
+        # Connection-level retries only; status-based retries are handled in _request.
         retry_strategy = Retry(
             total=3,
-            status_forcelist=[429, 500, 502, 503, 504],
+            status_forcelist=[],
             backoff_factor=1
         )
         adapter = HTTPAdapter(max_retries=retry_strategy)
@@ -63,9 +280,10 @@ class NphiesConnector:
         session.mount("http://", adapter)
         return session
     def _get_oauth_token(self) -> str:
+        return self.token_manager.get_token()
+    def _fetch_oauth_token(self) -> Dict[str, Any]:
+        """Performs the client-credentials grant; called by the token manager only."""
         now = time.time()
-        if self._token_data and self._token_data.get("expires_at", 0) > now + 60:
-            return self._token_data["access_token"]
         token_url = f"{self.base_url}/oauth/token"
         payload = {
             "grant_type": "client_credentials",
@@ -77,90 +295,97 @@ class NphiesConnector:
             response = self.session.post(token_url, data=payload, headers=headers, timeout=self.timeout)
             response.raise_for_status()
             token_info = response.json()
-            self._token_data = {
+            return {
                 "access_token": token_info["access_token"],
                 "expires_at": now + token_info.get("expires_in", 3600),
             }
-            return self._token_data["access_token"]
-        except requests.exceptions.RequestException as e:
-            print(f"OAuth token request failed: {e}")
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            logger.error("OAuth token request failed: %s", e, extra={"event": "nphies_token_error", "url": token_url})
+            metrics.inc("nphies_request_errors_total", kind="auth")
             raise NphiesAuthError("Failed to obtain OAuth token from nphies.") from e
     def _get_auth_headers(self) -> Dict[str, str]:
-        token = self._get_oauth_token()
+        with metrics.stage("auth"):
+            token = self._get_oauth_token()
         return {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/fhir+json",
             "Accept": "application/fhir+json",
         }
-    def _request(self, method: str, path: str, **kwargs) -> Any:
+    def _request(self, method: str, path: str, headers: Optional[Dict[str, str]] = None, **kwargs) -> Any:
+        response = self._send(method, path, headers, **kwargs)
+        try:
+            return response.json()
+        except ValueError as e:
+            logger.error("Nphies API request to %s returned invalid JSON: %s", response.url, e,
+                         extra={"event": "nphies_invalid_response", "url": response.url, "status": response.status_code})
+            metrics.inc("nphies_request_errors_total", kind="invalid_response")
+            raise NphiesAPIError(f"Invalid response from nphies: {e}") from e
+    def _send(self, method: str, path: str, headers: Optional[Dict[str, str]] = None, **kwargs) -> requests.Response:
+        """Performs the request with token refresh, rate limiting and retries; raises NphiesAPIError on failure."""
         url = f"{self.base_url}{path}"
-        headers = self._get_auth_headers()
+        endpoint = NphiesRateLimiter.classify(method, path)
+        extra_headers = headers or {}
+        headers = {**self._get_auth_headers(), **extra_headers}
         try:
-            response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
-            # Handle OAuth token refresh on 401 Unauthorized
-            if response.status_code == 401 and "token" in response.text.lower():
-                print("Token expired or invalid, attempting refresh...")
-                self._token_data = {} # Force token refresh
-                headers = self._get_auth_headers()
-                response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+            attempt = 0
+            limiter = self.rate_limiter
+            while True:
+                with limiter.slot(method, path) if limiter is not None else nullcontext() as slot:
+                    response = self._http(method, url, endpoint, headers, **kwargs)
+                    # Handle OAuth token refresh on 401 Unauthorized
+                    if response.status_code == 401 and "token" in response.text.lower():
+                        logger.info("Token expired or invalid, attempting refresh...",
+                                    extra={"event": "nphies_token_rejected", "url": url, "method": method})
+                        metrics.inc("nphies_401_replays_total")
+                        # Force token refresh; concurrent 401s for the same token trigger only one.
+                        self.token_manager.invalidate(headers["Authorization"].split(" ", 1)[1])
+                        headers = {**self._get_auth_headers(), **extra_headers}
+                        response = self._http(method, url, endpoint, headers, **kwargs)
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    if slot is not None:
+                        slot.record(response.status_code, retry_after)
+                if not is_retryable(method, response.status_code, retry_after) or attempt >= self.max_retries:
+                    break
+                if retry_after is not None and retry_after > self.backoff_cap:
+                    break  # The server asked for a longer pause than we are willing to block for.
+                if slot is not None:
+                    slot.limiter.record_retry(retry_after_honored=retry_after is not None)
+                metrics.inc("nphies_retries_total", endpoint=endpoint, status=response.status_code)
+                attempt += 1
+                if retry_after is None:
+                    time.sleep(jittered_backoff(attempt - 1, self.backoff_base, self.backoff_cap))
+                elif slot is None:
+                    time.sleep(retry_after)
+                # With a limiter, Retry-After pauses this endpoint class for every thread instead.
+                headers = {**self._get_auth_headers(), **extra_headers}
             response.raise_for_status()
-            return response.json()
+            return response
         except requests.exceptions.HTTPError as e:
-            print(f"Nphies API request to {url} failed with status {e.response.status_code}: {e.response.text}")
+            logger.error("Nphies API request to %s failed with status %s: %s", url, e.response.status_code, e.response.text,
+                         extra={"event": "nphies_http_error", "url": url, "method": method, "status": e.response.status_code})
+            metrics.inc("nphies_request_errors_total", kind="http_status")
             raise NphiesAPIError(f"API Error: {e.response.status_code} - {e.response.text}") from e
         except requests.exceptions.Timeout:
-            print(f"Nphies API request to {url} timed out.")
+            logger.error("Nphies API request to %s timed out.", url, extra={"event": "nphies_timeout", "url": url, "method": method})
+            metrics.inc("nphies_request_errors_total", kind="timeout")
             raise NphiesAPIError("Request to nphies timed out.")
         except requests.exceptions.RequestException as e:
-            print(f"Nphies API request to {url} failed: {e}")
+            logger.error("Nphies API request to %s failed: %s", url, e,
+                         extra={"event": "nphies_network_error", "url": url, "method": method})
+            metrics.inc("nphies_request_errors_total", kind="network")
             raise NphiesAPIError(f"A network error occurred: {e}") from e
-    def _validate_fhir(self, data: Dict[str, Any], schema: Dict[str, Any]):
-        try:
-            jsonschema.validate(instance=data, schema=schema)
-        except jsonschema.exceptions.ValidationError as e:
-            raise NphiesValidationError(f"FHIR payload validation failed: {e.message}") from e
-    def _map_to_fhir_claim_bundle(self, claim_data: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Stub function to map internal claim data to a FHIR Bundle for a Claim.
-        """
-        claim_resource = {
-            "resourceType": "Claim",
-            "status": "active",
-            "use": "claim",
-            "patient": {"reference": f"Patient/{claim_data.get('patient', {}).get('id')}"},
-            "item": [
-                {
-                    "sequence": i + 1,
-                    "productOrService": {
-                        "coding": [{
-                            "system": "http://hl7.org/fhir/sid/icd-10",
-                            "code": item.get("serviceCode"),
-                            "display": item.get("description")
-                        }]
-                    }
-                } for i, item in enumerate(claim_data.get("items", []))
-            ]
-        }
-        bundle = {
-            "resourceType": "Bundle",
-            "type": "transaction",
-            "entry": [{
-                "fullUrl": f"urn:uuid:{claim_data.get('claimNumber')}",
-                "resource": claim_resource,
-                "request": {
-                    "method": "POST",
-                    "url": "Claim"
-                }
-            }]
-        }
-        return bundle
+    def _http(self, method: str, url: str, endpoint: str, headers: Dict[str, str], **kwargs) -> requests.Response:
+        with metrics.stage("http"):
+            response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+        metrics.inc("nphies_responses_total", endpoint=endpoint, status=response.status_code)
+        return response
     def submit_claim(self, claim_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Submits a claim to the nphies /claims endpoint.
         Maps internal data to a FHIR Bundle and validates it before sending.
         """
         fhir_bundle = self._map_to_fhir_claim_bundle(claim_data)
-        self._validate_fhir(fhir_bundle, FHIR_BUNDLE_SCHEMA)
+        self._validate_fhir(fhir_bundle, self.bundle_schema)
         return self._request("POST", "/Claim", json=fhir_bundle)
     def request_pre_auth(self, auth_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -174,16 +399,59 @@ class NphiesConnector:
         Parses the FHIR response to determine status.
         """
         response = self._request("GET", f"/Claim/{claim_id}")
-        # Mock parsing logic: In real FHIR, you'd traverse the bundle to find the outcome.
-        if response.get("status") == "active":
-            return {"status": "FC_3", "claimId": claim_id}
-        return {"status": "PENDING", "claimId": claim_id}
+        return self._parse_claim_status(claim_id, response)
+    def check_status_if_changed(self, claim_id: str, etag: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Conditional `check_status`: sends If-None-Match with the ETag of the last
+        response and returns None when nphies answers 304 Not Modified.
+        Otherwise returns the parsed status plus the new `etag` (None if the
+        server sends none) and the raw `response`.
+        """
+        headers = {"If-None-Match": etag} if etag else None
+        response = self._send("GET", f"/Claim/{claim_id}", headers)
+        if response.status_code == 304:
+            return None
+        try:
+            body = response.json()
+        except ValueError as e:
+            raise NphiesAPIError(f"Invalid response from nphies: {e}") from e
+        return {**self._parse_claim_status(claim_id, body), "etag": response.headers.get("ETag"), "response": body}
     def reconcile_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Sends payment reconciliation data (FHIR PaymentNotice).
         """
         # This would map to a FHIR PaymentNotice resource
         return self._request("POST", "/PaymentNotice", json=payment_data)
+    def submit_claims(
+        self,
+        claims: Sequence[Dict[str, Any]],
+        max_bundle_entries: int = 100,
+        max_bundle_bytes: Optional[int] = None,
+        compress: bool = False,
+        bundle_type: str = "transaction",
+    ) -> List[ClaimSubmissionResult]:
+        """
+        Submits many claims using as few requests as possible.
+        Claims are packed into Bundles (capped by entry count and optionally by
+        size) and POSTed to the FHIR base, optionally gzip-compressed. The
+        response Bundle of each request is split back into per-claim results,
+        returned in input order. Claims that fail validation, and every claim in
+        a Bundle whose request fails outright, are reported as unsuccessful
+        rather than raised; authentication failures still raise NphiesAuthError.
+        Note: nphies processes a "transaction" Bundle atomically; pass
+        bundle_type="batch" to have entries accepted or rejected independently.
+        """
+        bundles, results = self._pack_claim_bundles(claims, max_bundle_entries, max_bundle_bytes, bundle_type)
+        for bundle, indices in bundles:
+            body, headers = self._encode_bundle(bundle, compress)
+            batch = [claims[i] for i in indices]
+            try:
+                response = self._request("POST", "", data=body, headers=headers)
+                parsed = self._parse_bundle_response(batch, response)
+            except NphiesAPIError as e:
+                parsed = [self._claim_result(claim_data, error=str(e)) for claim_data in batch]
+            results.update(zip(indices, parsed))
+        return [results[i] for i in range(len(claims))]
 if __name__ == "__main__":
     # Example usage with environment variables
     NPHIES_BASE_URL = os.getenv("NPHIES_BASE_URL", "https://sandbox.nphies.sa/api")
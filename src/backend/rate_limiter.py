@@ -0,0 +1,254 @@
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+THROTTLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+# --- Retry helpers ---
+def is_retryable(method: str, status_code: int, retry_after: Optional[float] = None) -> bool:
+    """
+    Whether a response may be retried without risking a duplicate side effect.
+    Idempotent methods retry on any throttling or 5xx status. A POST (Claim,
+    Bundle, PaymentNotice) may already have been processed when a 5xx comes
+    back, so it is only retried when the server says it was not: 429, or 503
+    with a Retry-After.
+    """
+    if status_code not in THROTTLE_STATUS_CODES:
+        return False
+    if method.upper() in IDEMPOTENT_METHODS:
+        return True
+    return status_code == 429 or (status_code == 503 and retry_after is not None)
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Parses a Retry-After header (delta-seconds or HTTP-date) into seconds to wait."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+def jittered_backoff(attempt: int, base: float = 1.0, cap: float = 30.0, rng: Optional[random.Random] = None) -> float:
+    """
+    "Full jitter" exponential backoff: a uniform draw from [0, min(cap, base * 2**attempt)].
+    Randomizing the whole interval keeps workers that failed together from retrying together.
+    """
+    return (rng or random).uniform(0, min(cap, base * (2 ** attempt)))
+# --- Token bucket ---
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` requests per second with bursts up to `capacity`.
+    `pause(seconds)` empties the bucket and blocks new grants until the pause
+    ends, which is how a server-issued Retry-After is propagated to every thread.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("TokenBucket rate must be positive.")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+    def _refill(self, now: float):
+        if now < self._paused_until:
+            self._updated = now
+            return
+        start = max(self._updated, self._paused_until)
+        self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+        self._updated = now
+    def _reserve(self) -> float:
+        """Takes a token if available; otherwise returns the seconds until one will be."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+    def try_acquire(self) -> bool:
+        return self._reserve() == 0.0
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """Blocks until a token is granted and returns the time spent waiting (raises TimeoutError)."""
+        start = time.monotonic()
+        while True:
+            wait = self._reserve()
+            if wait == 0.0:
+                return time.monotonic() - start
+            if timeout is not None and time.monotonic() + wait - start > timeout:
+                raise TimeoutError("Timed out waiting for rate limiter token.")
+            time.sleep(wait)
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+# --- AIMD concurrency limit ---
+class AIMDLimiter:
+    """
+    Adaptive concurrency limit: additive increase on success, multiplicative
+    decrease on throttling (429) or server errors. Decreases are applied at
+    most once per `cooldown` seconds, so one burst of failures from requests
+    that were already in flight counts as a single congestion signal.
+    """
+    def __init__(self, initial: int = 16, min_limit: int = 1, max_limit: int = 256,
+                 increase: float = 1.0, decrease_factor: float = 0.5, cooldown: float = 1.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        start = time.monotonic()
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._in_flight < int(self._limit), timeout=timeout):
+                raise TimeoutError("Timed out waiting for a concurrency slot.")
+            self._in_flight += 1
+        return time.monotonic() - start
+    def release(self, congested: bool):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if congested:
+                if now - self._last_decrease >= self.cooldown:
+                    self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                # +increase per "window" of `limit` successful requests.
+                self._limit = min(self.max_limit, self._limit + self.increase / max(self._limit, 1.0))
+            self._cond.notify_all()
+# --- Per-endpoint limiter ---
+class EndpointLimiter:
+    """Rate, concurrency and throttling counters for one nphies endpoint class."""
+    def __init__(self, name: str, rate: Optional[float] = None, burst: Optional[float] = None,
+                 max_pause: float = 30.0, **aimd: Any):
+        self.name = name
+        self.max_pause = max_pause
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.concurrency = AIMDLimiter(**aimd)
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {
+            "requests": 0, "throttled_429": 0, "server_errors": 0, "network_errors": 0,
+            "retries": 0, "retry_after_honored": 0, "rate_wait_seconds": 0.0, "concurrency_wait_seconds": 0.0,
+        }
+    def _count(self, key: str, amount: float = 1):
+        with self._lock:
+            self.counters[key] += amount
+    def pause(self, seconds: float):
+        """
+        Holds back every new request for this endpoint class (e.g. for a server
+        Retry-After), for at most `max_pause` seconds.
+        """
+        seconds = min(seconds, self.max_pause)
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if self.bucket is not None:
+            self.bucket.pause(seconds)
+    def wait_if_paused(self, timeout: Optional[float] = None) -> float:
+        """Sleeps out an active pause and returns the time waited (raises TimeoutError if it exceeds `timeout`)."""
+        with self._lock:
+            wait = self._paused_until - time.monotonic()
+        if timeout is not None and wait > timeout:
+            raise TimeoutError("Timed out waiting for an endpoint pause to end.")
+        if wait > 0:
+            time.sleep(wait)
+            return wait
+        return 0.0
+    def record_retry(self, retry_after_honored: bool):
+        self._count("retries")
+        if retry_after_honored:
+            self._count("retry_after_honored")
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self.counters)
+        data.update(concurrency_limit=self.concurrency.limit, in_flight=self.concurrency.in_flight)
+        return data
+class RequestSlot:
+    """Handed out by NphiesRateLimiter.slot(); report the response status before the slot closes."""
+    def __init__(self, limiter: EndpointLimiter):
+        self.limiter = limiter
+        self.status_code: Optional[int] = None
+    def record(self, status_code: int, retry_after: Optional[float] = None):
+        self.status_code = status_code
+        if status_code == 429:
+            self.limiter._count("throttled_429")
+        elif status_code >= 500:
+            self.limiter._count("server_errors")
+        if retry_after and status_code in THROTTLE_STATUS_CODES:
+            self.limiter.pause(retry_after)
+class NphiesRateLimiter:
+    """
+    Client-side rate limiting for nphies, shared by every thread (and every
+    connector) it is passed to. Requests are classified into endpoint classes
+    (claim submission, status checks, PaymentNotice, other); each class has its
+    own token bucket and AIMD concurrency limit, so throttling on one endpoint
+    does not starve the others.
+    The default rates (requests per second, with `burst` headroom) are
+    conservative client-side ceilings; set them to the quota in the provider's
+    nphies agreement via `limits`, or pass {"rate": None} to disable a bucket.
+    """
+    DEFAULT_LIMITS: Dict[str, Dict[str, Any]] = {
+        "claim": {"rate": 10.0, "burst": 20},
+        "status": {"rate": 50.0, "burst": 100},
+        "payment": {"rate": 10.0, "burst": 20},
+        "default": {"rate": 20.0, "burst": 40},
+    }
+    def __init__(self, limits: Optional[Dict[str, Dict[str, Any]]] = None):
+        config = {**self.DEFAULT_LIMITS, **(limits or {})}
+        self.endpoints = {name: EndpointLimiter(name, **options) for name, options in config.items()}
+    @staticmethod
+    def classify(method: str, path: str) -> str:
+        path = path.split("?", 1)[0].rstrip("/")
+        if path.startswith("/PaymentNotice"):
+            return "payment"
+        if path.startswith("/Claim/") or (method.upper() == "GET" and path.startswith("/Claim")):
+            return "status"
+        if path in ("", "/Claim"):
+            return "claim"  # Single Claim POSTs and Bundle POSTs to the FHIR base
+        return "default"
+    def endpoint(self, name: str) -> EndpointLimiter:
+        return self.endpoints.get(name) or self.endpoints["default"]
+    @contextmanager
+    def slot(self, method: str, path: str, timeout: Optional[float] = None) -> Iterator[RequestSlot]:
+        """
+        Waits for a rate token and a concurrency slot for the request's endpoint
+        class. The slot's recorded status drives the AIMD limit on exit; an
+        exception inside the block counts as a network error.
+        """
+        limiter = self.endpoint(self.classify(method, path))
+        limiter._count("rate_wait_seconds", limiter.wait_if_paused(timeout=timeout))
+        if limiter.bucket is not None:
+            limiter._count("rate_wait_seconds", limiter.bucket.acquire(timeout=timeout))
+        limiter._count("concurrency_wait_seconds", limiter.concurrency.acquire(timeout=timeout))
+        limiter._count("requests")
+        slot = RequestSlot(limiter)
+        congested = True
+        try:
+            yield slot
+            congested = slot.status_code in THROTTLE_STATUS_CODES
+        except Exception:
+            limiter._count("network_errors")
+            raise
+        finally:
+            limiter.concurrency.release(congested)
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Per-endpoint-class counters and current concurrency limits."""
+        return {name: limiter.snapshot() for name, limiter in self.endpoints.items()}
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+try:
+    from .term_matcher import FrozenTerms, snapshot_terms
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from term_matcher import FrozenTerms, snapshot_terms
+def normalize_note(text: str) -> str:
+    """
+    Canonical form of a note for cache keys. Only changes that cannot alter a
+    case-insensitive term match are applied: line endings, surrounding
+    whitespace and case.
+    """
+    return text.replace("\r\n", "\n").strip().lower()
+def cache_key(namespace: str, version: str, text: str) -> str:
+    """Content address of `text` under a namespace (e.g. "coding") and the version of the logic producing it."""
+    digest = hashlib.sha256(f"{namespace}\x00{version}\x00".encode("utf-8"))
+    digest.update(normalize_note(text).encode("utf-8"))
+    return f"{namespace}:{digest.hexdigest()}"
+# Same invalidation as term_matcher.get_term_matcher: a FrozenTerms is trusted by
+# identity, any other mapping is compared with the snapshot it was hashed from.
+_FINGERPRINTS: Dict[int, Tuple[Mapping[str, Any], Mapping[str, Any], str]] = {}
+def _json_default(value: Any) -> Any:
+    return dict(value) if isinstance(value, Mapping) else str(value)
+def dictionary_fingerprint(terms: Mapping[str, Any]) -> str:
+    """
+    Short hash of a term dictionary's contents. Recomputed whenever the
+    contents change, including same-size in-place edits, so cache keys built
+    from it stay content-addressed; O(1) for a FrozenTerms.
+    """
+    cached = _FINGERPRINTS.get(id(terms))
+    if cached is not None and cached[0] is terms and (isinstance(terms, FrozenTerms) or cached[1] == terms):
+        return cached[2]
+    snapshot = terms if isinstance(terms, FrozenTerms) else snapshot_terms(terms)
+    fingerprint = hashlib.sha256(json.dumps(snapshot, sort_keys=True, default=_json_default).encode("utf-8")).hexdigest()[:16]
+    _FINGERPRINTS[id(terms)] = (terms, snapshot, fingerprint)
+    return fingerprint
+class SQLiteCacheStore:
+    """
+    Optional persistent tier for ResultCache: a single SQLite table of
+    JSON-encoded values, so cached results survive restarts and can be shared
+    by processes on one host.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM result_cache WHERE key = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row else None
+    def set(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO result_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                               (key, value, expires_at))
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM result_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM result_cache")
+    def close(self):
+        with self._lock:
+            self._conn.close()
+class ResultCache:
+    """
+    Two-tier cache for deterministic, JSON-serializable results (NLP code
+    suggestions, CDI nudges). Keys come from `cache_key`, so a new engine
+    version, dictionary or rule set simply addresses different entries and old
+    ones age out. Values are stored encoded; every hit returns a fresh copy
+    that callers may mutate. The in-process tier is LRU with a TTL; `store`
+    (e.g. SQLiteCacheStore) is consulted on a miss and populated on writes.
+    """
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 3600, store: Optional[SQLiteCacheStore] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"hits": 0, "misses": 0, "memory_hits": 0, "store_hits": 0, "evictions": 0, "expired": 0}
+    def _count(self, key: str):
+        with self._lock:
+            self.counters[key] += 1
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    self.counters["memory_hits"] += 1
+                    return json.loads(entry[1])
+                del self._entries[key]
+                self.counters["expired"] += 1
+        if self.store is not None:
+            stored = self.store.get(key)
+            if stored is not None and stored[1] > now:
+                self._remember(key, stored[0], stored[1])
+                self._count("hits")
+                self._count("store_hits")
+                return json.loads(stored[0])
+        self._count("misses")
+        return None
+    def set(self, key: str, value: Any):
+        encoded = json.dumps(value)
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, encoded, expires_at)
+        if self.store is not None:
+            self.store.set(key, encoded, expires_at)
+    def _remember(self, key: str, encoded: str, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, encoded)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+    def get_or_compute(self, namespace: str, version: str, text: str, compute: Callable[[], Any]) -> Any:
+        """Returns the cached result for `text` under (namespace, version), computing and storing it on a miss."""
+        key = cache_key(namespace, version, text)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        value = compute()
+        self.set(key, value)
+        return value
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.store is not None:
+            self.store.clear()
+    def __len__(self) -> int:
+        return len(self._entries)
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data: Dict[str, Any] = dict(self.counters)
+            data["size"] = len(self._entries)
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = data["hits"] / lookups if lookups else 0.0
+        return data
+def result_cache_from_env(path_var: str = "RESULT_CACHE_PATH", ttl_var: str = "RESULT_CACHE_TTL") -> ResultCache:
+    """Builds a ResultCache, adding a SQLite tier when `path_var` names a database file."""
+    path = os.getenv(path_var)
+    ttl = float(os.getenv(ttl_var, "3600"))
+    return ResultCache(ttl_seconds=ttl, store=SQLiteCacheStore(path) if path else None)
@@ -0,0 +1,7 @@
+"""
+SQL fragments shared by the modules that write to the database directly,
+kept portable between PostgreSQL (production) and SQLite (tests, local runs).
+"""
+def json_param(dialect: str, name: str) -> str:
+    """Bind parameter `:name` for a JSONB column: cast on PostgreSQL, plain text elsewhere."""
+    return f"CAST(:{name} AS JSONB)" if dialect == "postgresql" else f":{name}"
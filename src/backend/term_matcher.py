@@ -0,0 +1,167 @@
+from collections import deque
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Tuple, Union
+# --- Match Result ---
+class TermMatch(NamedTuple):
+    term: str
+    start: int
+    end: int
+    value: Any
+def _is_word_char(ch: str) -> bool:
+    # Mirrors the `\w` class used by `re` for `str` patterns.
+    return ch.isalnum() or ch == "_"
+class TermMatcher:
+    """
+    Precompiled Aho-Corasick automaton for matching many dictionary terms
+    against a clinical note in a single left-to-right pass.
+    The automaton is built once per dictionary; scanning a note costs
+    O(len(note) + matches) regardless of how many terms are loaded.
+    With `whole_words=True` a hit is only reported when it satisfies the same
+    `\\b` boundaries as `re.search(r'\\b' + re.escape(term) + r'\\b', text)`.
+    With `whole_words=False` it reports plain substring hits like `term in text`.
+    """
+    def __init__(self, terms: Mapping[str, Any], whole_words: bool = True, case_insensitive: bool = True):
+        self.whole_words = whole_words
+        self.case_insensitive = case_insensitive
+        self._terms: List[str] = []
+        self._values: List[Any] = []
+        self._index: Dict[str, int] = {}
+        # Trie stored as parallel lists indexed by state id; state 0 is the root.
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        for term, value in terms.items():
+            self._add(term, value)
+        self._build_failure_links()
+    def __len__(self) -> int:
+        return len(self._terms)
+    @property
+    def terms(self) -> List[str]:
+        return list(self._terms)
+    def index_of(self, term: str) -> int:
+        """Returns the insertion index of a term (its position in the source dictionary)."""
+        return self._index[self._normalize(term)]
+    def _normalize(self, text: str) -> str:
+        return text.lower() if self.case_insensitive else text
+    def _add(self, term: str, value: Any):
+        key = self._normalize(term)
+        if not key:
+            raise ValueError("TermMatcher terms must be non-empty strings.")
+        if key in self._index:
+            # Later duplicates (e.g. differing only by case) overwrite the value, like a dict would.
+            self._values[self._index[key]] = value
+            return
+        state = 0
+        for ch in key:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        idx = len(self._terms)
+        self._index[key] = idx
+        self._terms.append(key)
+        self._values.append(value)
+        self._out[state] = self._out[state] + (idx,)
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                if self._out[self._fail[nxt]]:
+                    self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+    def _on_boundary(self, text: str, start: int, end: int, term: str) -> bool:
+        before = text[start - 1] if start > 0 else ""
+        after = text[end] if end < len(text) else ""
+        if _is_word_char(term[0]) == (bool(before) and _is_word_char(before)):
+            return False
+        if _is_word_char(term[-1]) == (bool(after) and _is_word_char(after)):
+            return False
+        return True
+    def finditer(self, text: str) -> Iterator[TermMatch]:
+        """
+        Yields every (possibly overlapping) dictionary hit in `text`, ordered by end offset.
+        Offsets index into `text` (or its lowercased form when `case_insensitive`).
+        """
+        return self.finditer_normalized(self._normalize(text))
+    def finditer_normalized(self, haystack: str) -> Iterator[TermMatch]:
+        """Like `finditer`, for text the caller has already normalized (lowercased when `case_insensitive`)."""
+        goto, fail, out, terms = self._goto, self._fail, self._out, self._terms
+        whole_words = self.whole_words
+        state = 0
+        for pos, ch in enumerate(haystack):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            end = pos + 1
+            for idx in out[state]:
+                term = terms[idx]
+                start = end - len(term)
+                if whole_words and not self._on_boundary(haystack, start, end, term):
+                    continue
+                yield TermMatch(term, start, end, self._values[idx])
+    def find_all(self, text: str) -> List[TermMatch]:
+        return list(self.finditer(text))
+    def matched_indices(self, text: str) -> List[int]:
+        """Returns the sorted dictionary indices of every term present in `text`."""
+        return sorted({self._index[m.term] for m in self.finditer(text)})
+    def value_at(self, idx: int) -> Any:
+        return self._values[idx]
+# --- Frozen Dictionaries ---
+class FrozenTerms(Mapping):
+    """
+    Read-only term dictionary. Values that are mappings (e.g. SuggestedCode
+    dicts) are stored as read-only views of private copies, so neither the
+    dictionary nor its entries can change after construction; caches keyed on
+    a FrozenTerms can therefore trust its identity. To change a dictionary,
+    build a new FrozenTerms.
+    """
+    __slots__ = ("_data",)
+    def __init__(self, terms: Union[Mapping[str, Any], Iterable[Tuple[str, Any]]] = ()):
+        self._data = {term: MappingProxyType(dict(value)) if isinstance(value, Mapping) else value
+                      for term, value in dict(terms).items()}
+    def __getitem__(self, term: str) -> Any:
+        return self._data[term]
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+    def __len__(self) -> int:
+        return len(self._data)
+    def __repr__(self) -> str:
+        return f"FrozenTerms({snapshot_terms(self)!r})"
+    def __reduce__(self):
+        return FrozenTerms, (snapshot_terms(self),)  # Read-only views do not pickle
+def snapshot_terms(terms: Mapping[str, Any]) -> Dict[str, Any]:
+    """Plain-dict copy of a term dictionary, one level deep (as deep as FrozenTerms freezes)."""
+    return {term: dict(value) if isinstance(value, Mapping) else value for term, value in terms.items()}
+# --- Shared Matcher Cache ---
+# Keyed by the identity of the dictionary object; the dictionary itself is held
+# alongside the matcher so its id cannot be recycled while the entry is alive.
+# A FrozenTerms cannot change, so its entry is reused as is; any other mapping
+# is compared with the snapshot taken when its matcher was built.
+_MATCHER_CACHE: Dict[Tuple[int, bool, bool], Tuple[Mapping[str, Any], Mapping[str, Any], TermMatcher]] = {}
+def get_term_matcher(terms: Mapping[str, Any], whole_words: bool = True, case_insensitive: bool = True) -> TermMatcher:
+    """
+    Returns a cached TermMatcher for `terms`, compiling it on first use.
+    The matcher is rebuilt whenever the dictionary's contents change, including
+    in-place edits that keep its size. For a FrozenTerms the lookup is O(1);
+    for a mutable mapping it costs a comparison of the whole dictionary, so
+    large dictionaries on hot paths should be frozen.
+    """
+    key = (id(terms), whole_words, case_insensitive)
+    cached = _MATCHER_CACHE.get(key)
+    if cached is not None and cached[0] is terms and (isinstance(terms, FrozenTerms) or cached[1] == terms):
+        return cached[2]
+    matcher = TermMatcher(terms, whole_words=whole_words, case_insensitive=case_insensitive)
+    _MATCHER_CACHE[key] = (terms, terms if isinstance(terms, FrozenTerms) else snapshot_terms(terms), matcher)
+    return matcher
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+try:
+    import fcntl
+except ImportError:  # Non-POSIX platforms: the file cache still works, without cross-process locking.
+    fcntl = None
+try:
+    from .instrumentation import registry as metrics
+except ImportError:  # Running from src/backend directly (e.g. `uvicorn cdi_api:app`)
+    from instrumentation import registry as metrics
+logger = logging.getLogger(__name__)
+TokenFetcher = Callable[[], Dict[str, Any]]
+def default_token_cache_dir() -> str:
+    """Per-user cache directory for shared tokens ($XDG_CACHE_HOME/nphies or ~/.cache/nphies), created mode 0700."""
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    directory = os.path.join(base, "nphies")
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    except OSError:
+        # No usable home directory: fall back to a private directory under the temp dir.
+        directory = tempfile.mkdtemp(prefix="nphies-tokens-")
+    return directory
+def default_token_cache_path(base_url: str, client_id: str, directory: Optional[str] = None) -> str:
+    """Returns a per-(base_url, client_id) token cache file path in `directory` (default: default_token_cache_dir())."""
+    digest = hashlib.sha256(f"{base_url}|{client_id}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory or default_token_cache_dir(), f"nphies-token-{digest}.json")
+class OAuthTokenManager:
+    """
+    Thread-safe OAuth token holder with single-flight refresh.
+    `fetch_token` performs the actual `/oauth/token` call and returns
+    `{"access_token": ..., "expires_at": <epoch seconds>}`. Only one thread
+    refreshes at a time; the others wait and reuse its result. With
+    `cache_path` set, tokens are also shared with other processes through a
+    small JSON file guarded by an advisory lock, so a fleet of workers makes
+    one auth call per expiry window. `start_background_refresh()` renews the
+    token ahead of `expires_at` so request threads rarely wait on auth.
+    """
+    def __init__(self, fetch_token: TokenFetcher, refresh_margin: float = 60, cache_path: Optional[str] = None):
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.cache_path = cache_path
+        self.refresh_count = 0
+        self._token_data: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+    def _is_fresh(self, token_data: Dict[str, Any], now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        return bool(token_data) and token_data.get("expires_at", 0) > now + self.refresh_margin
+    @property
+    def expires_at(self) -> float:
+        return self._token_data.get("expires_at", 0)
+    def get_token(self) -> str:
+        token_data = self._token_data
+        if self._is_fresh(token_data):
+            return token_data["access_token"]
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock.
+            if self._is_fresh(self._token_data):
+                return self._token_data["access_token"]
+            return self._refresh_locked(force=False)
+    def refresh(self) -> str:
+        """Fetches a new token now, regardless of the current one's expiry."""
+        with self._lock:
+            return self._refresh_locked(force=True)
+    def invalidate(self, token: Optional[str] = None):
+        """
+        Drops the cached token (e.g. after a 401). When `token` is given, only
+        that token is dropped, so many threads reporting the same rejected token
+        trigger a single refresh rather than one each.
+        """
+        with self._lock:
+            if token is None or self._token_data.get("access_token") == token:
+                self._token_data = {}
+                with self._shared_lock():
+                    self._write_shared({}, only_if_token=token)
+    def _refresh_locked(self, force: bool) -> str:
+        with self._shared_lock():
+            shared = self._read_shared()
+            if not force and self._is_fresh(shared):
+                self._token_data = shared
+                return shared["access_token"]
+            token_data = self.fetch_token()
+            self.refresh_count += 1
+            metrics.inc("nphies_token_refreshes_total")
+            self._token_data = token_data
+            self._write_shared(token_data)
+            return token_data["access_token"]
+    # --- Cross-process file cache ---
+    @contextmanager
+    def _shared_lock(self) -> Iterator[None]:
+        if not self.cache_path or fcntl is None:
+            yield
+            return
+        # Token and lock files are created owner-only (0600).
+        with os.fdopen(os.open(self.cache_path + ".lock", os.O_RDWR | os.O_CREAT, 0o600), "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    def _read_shared(self) -> Dict[str, Any]:
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            return data if isinstance(data, dict) and "access_token" in data else {}
+        except (OSError, ValueError):
+            return {}
+    def _write_shared(self, token_data: Dict[str, Any], only_if_token: Optional[str] = None):
+        if not self.cache_path:
+            return
+        if only_if_token is not None and self._read_shared().get("access_token") not in (None, only_if_token):
+            return  # Another process already replaced the rejected token.
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(token_data, fh)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning("Could not write shared token cache %s: %s", self.cache_path, e,
+                           extra={"event": "token_cache_write_failed", "path": self.cache_path})
+    # --- Proactive background refresh ---
+    def start_background_refresh(self, lead_time: Optional[float] = None, retry_interval: float = 5.0):
+        """
+        Starts a daemon thread that refreshes the token `lead_time` seconds
+        (default: twice the refresh margin) before it would be considered stale.
+        After a refresh the thread waits at least `retry_interval` seconds and
+        half the new token's lifetime, so tokens that live no longer than the
+        lead time are not refreshed in a tight loop.
+        """
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        lead = 2 * self.refresh_margin if lead_time is None else lead_time
+        self._stop.clear()
+        def run():
+            refreshed = False
+            while not self._stop.is_set():
+                wait = 0.0
+                if self._token_data:
+                    remaining = self.expires_at - time.time()
+                    wait = max(0.0, remaining - lead)
+                    if refreshed:
+                        wait = max(wait, retry_interval, remaining / 2)
+                if self._stop.wait(wait):
+                    return
+                refreshed = False
+                try:
+                    with self._lock:
+                        if self.expires_at - lead <= time.time():
+                            self._refresh_locked(force=not self._is_fresh(self._read_shared(), time.time() + lead))
+                            refreshed = True
+                except Exception as e:
+                    logger.error("Background OAuth token refresh failed: %s", e, extra={"event": "nphies_token_refresh_failed"})
+                    if self._stop.wait(retry_interval):
+                        return
+        self._refresher = threading.Thread(target=run, name="nphies-token-refresh", daemon=True)
+        self._refresher.start()
+    def stop_background_refresh(self):
+        self._stop.set()
+        if self._refresher is not None:
+            self._refresher.join(timeout=5)
+            self._refresher = None
+class AsyncTokenManager:
+    """
+    asyncio front end for an OAuthTokenManager. A fresh token is returned
+    without leaving the event loop; refreshes and invalidations run on a
+    worker thread, so they stay single-flight with every thread (and, with a
+    cache path, every process) sharing the wrapped manager.
+    """
+    def __init__(self, manager: OAuthTokenManager):
+        self.manager = manager
+    async def get_token(self) -> str:
+        token_data = self.manager._token_data
+        if self.manager._is_fresh(token_data):
+            return token_data["access_token"]
+        return await asyncio.to_thread(self.manager.get_token)
+    async def invalidate(self, token: Optional[str] = None):
+        await asyncio.to_thread(self.manager.invalidate, token)
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import pytest
+from src.backend.async_nphies_connector import AsyncNphiesConnector, NphiesAPIError, NphiesAuthError, NphiesValidationError
+from src.backend.token_manager import OAuthTokenManager
+# --- Local Mock nphies Server ---
+class MockNphiesState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.token_requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.latency = 0.05
+        self.fail_token = False
+        self.throttle_next = 0
+class MockNphiesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    def setup(self):
+        super().setup()
+        with self.server.state.lock:
+            self.server.state.connections += 1
+    def log_message(self, *args):
+        pass
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/fhir+json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+    def _handle(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path.endswith("/oauth/token"):
+            with state.lock:
+                state.token_requests += 1
+            if state.fail_token:
+                return self._reply(401, {"error": "invalid_client"})
+            return self._reply(200, {"access_token": "mock_token_12345", "expires_in": 3600})
+        with state.lock:
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            throttled = state.throttle_next > 0
+            if throttled:
+                state.throttle_next -= 1
+        try:
+            time.sleep(state.latency)
+            if throttled:
+                return self._reply(429, {"error": "slow down"}, {"Retry-After": "0"})
+            if self.path == "/api":
+                entries = [{"response": {"status": "201 Created"}} for _ in json.loads(body)["entry"]]
+                return self._reply(200, {"resourceType": "Bundle", "type": "transaction-response", "entry": entries})
+            if self.command == "GET":
+                return self._reply(200, {"status": "active", "id": self.path.rsplit("/", 1)[-1]})
+            return self._reply(201, {"status": "success"})
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+    do_GET = _handle
+    do_POST = _handle
+@pytest.fixture
+def mock_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockNphiesHandler)
+    server.daemon_threads = True
+    server.state = MockNphiesState()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+def make_connector(server, **kwargs) -> AsyncNphiesConnector:
+    host, port = server.server_address
+    return AsyncNphiesConnector(f"http://{host}:{port}/api", "test_client_id", "test_client_secret", backoff_base=0, **kwargs)
+# --- Test Cases ---
+def test_concurrent_calls_share_pool_token_and_limit(mock_server):
+    async def scenario():
+        async with make_connector(mock_server, max_concurrency=8, max_connections=8) as nphies:
+            return await asyncio.gather(*(nphies.check_status(f"CLAIM-{i}") for i in range(40)))
+    results = asyncio.run(scenario())
+    assert [r["status"] for r in results] == ["FC_3"] * 40
+    state = mock_server.state
+    assert state.token_requests == 1
+    assert 1 < state.max_in_flight <= 8
+    assert state.connections <= 8 + 1  # The pool, plus the token manager's own auth connection
+def test_submit_claim_validates_and_retries_throttling(mock_server):
+    mock_server.state.throttle_next = 2
+    claim = {"claimNumber": "TEST-001", "patient": {"id": "PAT-123"}, "items": [{"serviceCode": "J18.9"}]}
+    async def scenario():
+        async with make_connector(mock_server) as nphies:
+            return await nphies.submit_claim(claim)
+    assert asyncio.run(scenario())["status"] == "success"
+def test_submit_claims_sends_bundles_concurrently(mock_server):
+    claims = [{"claimNumber": f"BULK-{i}", "patient": {"id": "P"}, "items": [{"serviceCode": "J18.9"}]} for i in range(10)]
+    async def scenario():
+        async with make_connector(mock_server) as nphies:
+            return await nphies.submit_claims(claims, max_bundle_entries=3)
+    results = asyncio.run(scenario())
+    assert [r["claimNumber"] for r in results] == [c["claimNumber"] for c in claims]
+    assert all(r["success"] for r in results)
+    assert mock_server.state.max_in_flight > 1
+def test_deadline_exceeded_raises_api_error(mock_server):
+    mock_server.state.latency = 1.0
+    async def scenario():
+        async with make_connector(mock_server) as nphies:
+            await nphies._get_oauth_token()
+            await nphies.check_status("SLOW", deadline=0.2)
+    with pytest.raises(NphiesAPIError, match="timed out"):
+        asyncio.run(scenario())
+def test_auth_failure_raises_auth_error(mock_server):
+    mock_server.state.fail_token = True
+    async def scenario():
+        async with make_connector(mock_server) as nphies:
+            await nphies.submit_claim({})
+    with pytest.raises(NphiesAuthError):
+        asyncio.run(scenario())
+def test_invalid_bundle_raises_validation_error(mock_server):
+    connector = make_connector(mock_server)
+    with pytest.raises(NphiesValidationError):
+        connector._validate_fhir({"resourceType": "Bundle", "entry": []}, {"required": ["type"]})
+    asyncio.run(connector.aclose())
+def transport_connector(handler, token_manager=None) -> AsyncNphiesConnector:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    tokens = token_manager or OAuthTokenManager(lambda: {"access_token": "t", "expires_at": time.time() + 3600})
+    return AsyncNphiesConnector("https://mock-nphies.sa/api", "client", "secret", backoff_base=0, client=client,
+                                token_manager=tokens)
+def test_posts_are_not_retried_after_server_errors():
+    calls = {"POST": 0, "GET": 0}
+    def handler(request):
+        if request.url.path.endswith("/oauth/token"):
+            return httpx.Response(200, json={"access_token": "t", "expires_in": 3600})
+        calls[request.method] += 1
+        return httpx.Response(502, json={})
+    async def scenario():
+        async with transport_connector(handler) as nphies:
+            for call in (nphies.reconcile_payment({"amount": 1}), nphies.check_status("C-1")):
+                with pytest.raises(NphiesAPIError):
+                    await call
+    asyncio.run(scenario())
+    assert calls == {"POST": 1, "GET": 4}
+def test_non_json_response_raises_api_error():
+    def handler(request):
+        if request.url.path.endswith("/oauth/token"):
+            return httpx.Response(200, json={"access_token": "t", "expires_in": 3600})
+        return httpx.Response(200, text="<html>gateway</html>")
+    async def scenario():
+        async with transport_connector(handler) as nphies:
+            await nphies.check_status("C-1")
+    with pytest.raises(NphiesAPIError, match="Invalid response"):
+        asyncio.run(scenario())
+def test_shares_a_token_manager_and_replays_once_after_401():
+    issued = []
+    def fetch():
+        issued.append(f"token-{len(issued)}")
+        return {"access_token": issued[-1], "expires_at": time.time() + 3600}
+    tokens = OAuthTokenManager(fetch)
+    tokens.get_token()  # e.g. already fetched by a sync NphiesConnector sharing the manager
+    seen = []
+    def handler(request):
+        seen.append(request.headers["Authorization"])
+        if request.headers["Authorization"] == "Bearer token-0":
+            return httpx.Response(401, json={"error": "invalid token"})
+        return httpx.Response(200, json={"status": "active"})
+    async def scenario():
+        async with transport_connector(handler, tokens) as nphies:
+            return await asyncio.gather(*(nphies.check_status(f"C-{i}") for i in range(5)))
+    assert [r["status"] for r in asyncio.run(scenario())] == ["FC_3"] * 5
+    assert issued == ["token-0", "token-1"] and seen.count("Bearer token-1") == 5
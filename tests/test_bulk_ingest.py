@@ -0,0 +1,115 @@
+import json
+import pytest
+import sqlalchemy
+from src.backend import bulk_ingest
+from src.backend.bulk_ingest import Checkpoint, ResultWriter, iter_db_encounters, iter_ndjson, note_text, run_ingest
+from src.backend.claim_outbox import ClaimOutbox
+from src.backend.coding_engine import CodingEngine
+# SQLite stand-in for the parts of sql/schema.sql used by bulk ingestion.
+SQLITE_SCHEMA = [
+    "CREATE TABLE providers (id TEXT PRIMARY KEY, name TEXT NOT NULL, cr_number TEXT UNIQUE)",
+    """CREATE TABLE encounters (id TEXT PRIMARY KEY, patient_id TEXT NOT NULL, provider_id TEXT REFERENCES providers(id),
+       encounter_type TEXT NOT NULL, visit_complexity TEXT, clinical_note TEXT DEFAULT '{}', archived BOOLEAN DEFAULT 0)""",
+    """CREATE TABLE claims (id TEXT PRIMARY KEY, encounter_id TEXT NOT NULL REFERENCES encounters(id), provider_id TEXT,
+       claim_payload TEXT NOT NULL, claim_number TEXT UNIQUE, status TEXT NOT NULL DEFAULT 'DRAFT',
+       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE coding_jobs (id TEXT PRIMARY KEY, encounter_id TEXT NOT NULL REFERENCES encounters(id),
+       engine_version TEXT, source_text TEXT, suggested_codes TEXT, final_codes TEXT, status TEXT DEFAULT 'NEEDS_REVIEW',
+       confidence_score NUMERIC DEFAULT 0, phase TEXT DEFAULT 'CAC',
+       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+    "CREATE UNIQUE INDEX uq_coding_jobs_encounter_engine ON coding_jobs(encounter_id, engine_version)",
+]
+NOTES = [
+    ("Acute myocardial infarction confirmed.", "low-complexity outpatient"),
+    ("Diagnosis of appendicitis confirmed by imaging.", "inpatient"),
+    ("Cough and fever. Suspected pneumonia.", "inpatient"),
+]
+@pytest.fixture
+def db(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'ingest.db'}")
+    with engine.begin() as conn:
+        for ddl in SQLITE_SCHEMA:
+            conn.execute(sqlalchemy.text(ddl))
+        conn.execute(sqlalchemy.text("INSERT INTO providers (id, name, cr_number) VALUES ('prov-1', 'Clinic', 'CR-1')"))
+        conn.execute(sqlalchemy.text(
+            "INSERT INTO encounters (id, patient_id, provider_id, encounter_type, visit_complexity, clinical_note, archived) "
+            "VALUES (:id, :patient_id, 'prov-1', 'OUTPATIENT', :complexity, :note, :archived)"),
+            [{"id": f"enc-{i:03d}", "patient_id": f"pat-{i}", "complexity": NOTES[i % 3][1],
+              "note": json.dumps({"original": NOTES[i % 3][0]}), "archived": i == 29} for i in range(30)])
+    return engine
+def count(db, table):
+    with db.connect() as conn:
+        return conn.execute(sqlalchemy.text(f"SELECT COUNT(*) FROM {table}")).scalar_one()
+def test_note_text_prefers_revised_note():
+    assert note_text(json.dumps({"original": "a", "revised": "b"})) == "b"
+    assert note_text({"original": "a"}) == "a"
+    assert note_text("plain text note") == "plain text note"
+def test_db_source_pages_by_id_and_skips_archived(db):
+    jobs = list(iter_db_encounters(db, page_size=7))
+    assert [j.encounter_id for j in jobs] == [f"enc-{i:03d}" for i in range(29)]
+    assert jobs[0].meta["provider_cr"] == "CR-1" and jobs[0].note == NOTES[0][0]
+    assert [j.encounter_id for j in iter_db_encounters(db, after="enc-025", page_size=7)] == ["enc-026", "enc-027", "enc-028"]
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_ingest_writes_jobs_and_draft_claims(db, tmp_path, executor):
+    outbox = ClaimOutbox(str(tmp_path / "outbox.db"))
+    checkpoint = Checkpoint(str(tmp_path / "ckpt.json"), "db:encounters")
+    stats = run_ingest(iter_db_encounters(db, page_size=8), ResultWriter(db, outbox=outbox), checkpoint,
+                       executor=executor, max_workers=2, chunksize=4, batch_size=5)
+    assert stats["processed"] == 29 and stats["claims_written"] == 10
+    assert count(db, "coding_jobs") == 29 and count(db, "claims") == 10
+    assert outbox.counts()["PENDING"] == 10
+    with db.connect() as conn:
+        row = conn.execute(sqlalchemy.text(
+            "SELECT phase, status, suggested_codes FROM coding_jobs WHERE encounter_id = 'enc-000'")).one()
+        claim = conn.execute(sqlalchemy.text("SELECT encounter_id, status FROM claims WHERE claim_number = 'CLAIM-enc-000'")).one()
+    assert row[0] == "AUTONOMOUS" and row[1] == "QUEUED_FOR_NPHIES" and json.loads(row[2])[0]["code"] == "I21.9"
+    assert tuple(claim) == ("enc-000", "DRAFT")
+    assert json.load(open(tmp_path / "ckpt.json"))["position"] == "enc-028"
+def test_interrupted_run_resumes_from_checkpoint(db, tmp_path):
+    path = str(tmp_path / "ckpt.json")
+    def interrupted():
+        for i, job in enumerate(iter_db_encounters(db, page_size=5)):
+            if i == 12:
+                raise KeyboardInterrupt
+            yield job
+    with pytest.raises(KeyboardInterrupt):
+        run_ingest(interrupted(), ResultWriter(db), Checkpoint(path, "db:encounters"), executor="thread",
+                   max_workers=1, chunksize=2, batch_size=4)
+    checkpoint = Checkpoint(path, "db:encounters")
+    assert checkpoint.processed == count(db, "coding_jobs") and checkpoint.processed <= 12
+    stats = run_ingest(iter_db_encounters(db, after=checkpoint.position), ResultWriter(db), checkpoint,
+                       executor="thread", max_workers=1, batch_size=4)
+    assert stats["processed"] == 29 and count(db, "coding_jobs") == 29 and count(db, "claims") == 10
+def test_draft_claims_missing_from_the_outbox_are_requeued(db, tmp_path):
+    coding_engine = CodingEngine()
+    connector = coding_engine.nphies_connector
+    # As if the process died after each commit, before enqueuing into the outbox.
+    run_ingest(iter_db_encounters(db), ResultWriter(db), Checkpoint(None, "db:encounters"), executor="thread",
+               max_workers=1, coding_engine=coding_engine)
+    assert coding_engine.nphies_connector is connector  # The caller's engine is left alone
+    outbox = ClaimOutbox(str(tmp_path / "outbox.db"))
+    writer = ResultWriter(db, outbox=outbox)
+    assert writer.requeue_drafts(page_size=3) == 10 and outbox.counts()["PENDING"] == 10
+    outbox.mark_sent("CLAIM-enc-000")
+    assert writer.requeue_drafts() == 0 and outbox.get("CLAIM-enc-000")["status"] == "SENT"
+def test_rerun_upserts_instead_of_duplicating(db):
+    for _ in range(2):
+        run_ingest(iter_db_encounters(db), ResultWriter(db), Checkpoint(None, "db:encounters"), executor="thread", max_workers=1)
+    assert count(db, "coding_jobs") == 29 and count(db, "claims") == 10
+def test_checkpoint_for_another_source_is_rejected(tmp_path):
+    path = str(tmp_path / "ckpt.json")
+    Checkpoint(path, "db:encounters").save("enc-001", 1)
+    with pytest.raises(ValueError):
+        Checkpoint(path, "ndjson:/tmp/other.ndjson")
+def test_cli_ingests_ndjson_file(db, tmp_path, capsys):
+    source = tmp_path / "encounters.ndjson"
+    source.write_text("\n".join(json.dumps({"id": f"enc-{i:03d}", "patient_id": f"pat-{i}", "clinical_note": NOTES[i % 3][0],
+                                             "visit_complexity": NOTES[i % 3][1]}) for i in range(6)) + "\n")
+    assert [j.position for j in iter_ndjson(str(source), after=4)] == [5, 6]
+    args = ["--database-url", str(db.url), "--source", "ndjson", "--input", str(source),
+            "--checkpoint", str(tmp_path / "ckpt.json"), "--executor", "thread", "--workers", "1"]
+    assert bulk_ingest.main(args) == 0
+    assert json.loads(capsys.readouterr().out.strip().splitlines()[-1])["processed"] == 6
+    assert bulk_ingest.main(args) == 0  # Nothing left after the checkpoint
+    assert json.loads(capsys.readouterr().out.strip().splitlines()[-1])["processed"] == 6
+    assert count(db, "coding_jobs") == 6
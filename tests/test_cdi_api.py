@@ -0,0 +1,150 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+from src.backend import cdi_api
+from src.backend.cdi_api import CDI_RULES, app, get_cdi_nudges
+from src.backend.cdi_rules import CDIRuleEngine, CompiledRuleSet, RulePackError, load_rule_pack
+# --- Helpers ---
+def legacy_cdi_nudge_ids(note):
+    """The original per-rule substring scan, kept as a reference implementation."""
+    note_lower = note.lower()
+    return [rule["nudge"]["id"] for rule in CDI_RULES
+            if rule["keyword"] in note_lower
+            and not any(neg in note_lower for neg in rule["negation_keywords"])]
+def sepsis_rule(rule_id="sepsis_organism"):
+    return {
+        "id": rule_id,
+        "keyword": "sepsis",
+        "negation_keywords": ["staphylococcal", "streptococcal"],
+        "nudge": {"id": rule_id, "severity": "critical", "prompt": "Specify the organism for 'sepsis'."},
+    }
+@pytest.fixture
+def client():
+    yield TestClient(app)
+    cdi_api.rule_engine.reload(pack_paths=[])
+# --- Rules Engine ---
+@pytest.mark.parametrize("note", [
+    "Patient has pneumonia and a fracture.",
+    "Bacterial pneumonia. Left fracture of the radius.",
+    "Urinary tract infection, likely cystitis.",
+    "Cleft palate repair; fracture noted.",
+    "No findings.",
+])
+def test_compiled_rules_match_legacy_scan(note):
+    assert [n.id for n in get_cdi_nudges(note)] == legacy_cdi_nudge_ids(note)
+def test_rule_pack_json_and_yaml(tmp_path):
+    (tmp_path / "a.json").write_text(json.dumps({"version": "1", "rules": [sepsis_rule()]}))
+    (tmp_path / "b.yaml").write_text(
+        "- id: copd_exacerbation\n"
+        "  keywords: [copd, emphysema]\n"
+        "  negation_keywords: [exacerbation]\n"
+        "  nudge: {id: copd_exacerbation, severity: info, prompt: Document exacerbation status.}\n"
+    )
+    engine = CDIRuleEngine(base_rules=CDI_RULES, pack_paths=[str(tmp_path)])
+    assert len(engine.ruleset) == len(CDI_RULES) + 2
+    ids = [n["id"] for n in engine.evaluate("Sepsis with underlying emphysema and pneumonia.")]
+    assert ids == ["pneumonia_specificity", "sepsis_organism", "copd_exacerbation"]
+    assert [n["id"] for n in engine.evaluate("Streptococcal sepsis; COPD exacerbation.")] == []
+def test_invalid_rule_pack_is_rejected(tmp_path):
+    bad = tmp_path / "bad.json"
+    bad.write_text(json.dumps([{"id": "no_keyword", "nudge": {"id": "x", "severity": "info", "prompt": "p"}}]))
+    with pytest.raises(RulePackError):
+        load_rule_pack(str(bad))
+    with pytest.raises(RulePackError):
+        CompiledRuleSet([sepsis_rule(), sepsis_rule()])
+def test_reload_swaps_atomically_and_keeps_previous_on_error(tmp_path):
+    engine = CDIRuleEngine(base_rules=CDI_RULES)
+    before = engine.ruleset
+    pack = tmp_path / "pack.json"
+    pack.write_text(json.dumps([sepsis_rule()]))
+    engine.reload([str(pack)])
+    assert engine.ruleset is not before and engine.version != before.version
+    assert [n["id"] for n in engine.evaluate("sepsis")] == ["sepsis_organism"]
+    pack.write_text("{not json")
+    active = engine.ruleset
+    with pytest.raises(RulePackError):
+        engine.reload()
+    assert engine.ruleset is active
+# --- API Endpoints ---
+def test_analyze_draft_note_endpoint(client):
+    response = client.post("/analyze_draft_note", json={"clinical_note": "Patient has pneumonia and a fracture."})
+    assert response.status_code == 200
+    assert [n["id"] for n in response.json()["nudges"]] == ["pneumonia_specificity", "fracture_laterality"]
+def test_rules_reload_and_stats_endpoints(client, tmp_path, monkeypatch):
+    packs = tmp_path / "packs"
+    packs.mkdir()
+    pack = packs / "pack.json"
+    pack.write_text(json.dumps([sepsis_rule()]))
+    monkeypatch.setattr(cdi_api, "RULE_PACK_ROOTS", (str(packs),))
+    response = client.post("/rules/reload", json={"pack_paths": [str(pack)]})
+    assert response.status_code == 200 and response.json()["rule_count"] == len(CDI_RULES) + 1
+    for _ in range(2):  # The second request is answered from the result cache
+        client.post("/analyze_draft_note", json={"clinical_note": "Sepsis, organism pending."})
+    status = client.get("/rules").json()
+    stats = {r["id"]: r for r in status["rules"]}
+    assert stats["sepsis_organism"]["evaluations"] == 1 and stats["sepsis_organism"]["fired"] == 2
+    assert stats["fracture_laterality"]["evaluations"] == 0 and stats["fracture_laterality"]["est_cost_ns"] == 0
+    assert status["notes_evaluated"] == 2 and status["cache_hits"] == 1 and status["mean_eval_ns"] > 0
+    # The only computed note checked one rule, which is charged its whole wall time.
+    assert abs(stats["sepsis_organism"]["est_cost_ns"] - status["total_eval_ns"]) <= 1
+    assert stats["sepsis_organism"]["est_mean_cost_ns"] == pytest.approx(status["total_eval_ns"], abs=1)
+    assert client.post("/rules/reload", json={"pack_paths": [str(packs / "missing.json")]}).status_code == 422
+    for outside in (str(tmp_path), str(packs / ".." / "pack.json"), "/etc/passwd"):
+        assert client.post("/rules/reload", json={"pack_paths": [outside]}).status_code == 403
+# --- Draft Sessions ---
+def test_draft_session_returns_only_changed_nudges(client):
+    note = "HPI: cough.\nAssessment: pneumonia.\nPlan: x-ray."
+    opened = client.post("/draft_sessions", json={"clinical_note": note}).json()
+    session_id = opened["session_id"]
+    assert [n["id"] for n in opened["added"]] == ["pneumonia_specificity"]
+    # Typing "viral " before "pneumonia" resolves the specificity nudge.
+    offset = note.index("pneumonia")
+    update = client.post(f"/draft_sessions/{session_id}/deltas", json={
+        "base_revision": opened["revision"],
+        "deltas": [{"start": offset, "end": offset, "text": "viral "}],
+    }).json()
+    assert update["added"] == [] and update["resolved"] == ["pneumonia_specificity"]
+    # Appending a new line only scans that line and surfaces the new nudge.
+    session = cdi_api.draft_sessions.get(session_id)
+    scanned = session.segments_scanned
+    end = len(session.text)
+    update = client.post(f"/draft_sessions/{session_id}/deltas", json={
+        "deltas": [{"start": end, "end": end, "text": "\nImaging: fracture of tibia."}],
+    }).json()
+    assert [n["id"] for n in update["added"]] == ["fracture_laterality"] and update["resolved"] == []
+    assert session.segments_scanned == scanned + 1
+def test_draft_session_errors(client):
+    session_id = client.post("/draft_sessions", json={"clinical_note": "pneumonia"}).json()["session_id"]
+    stale = client.post(f"/draft_sessions/{session_id}/deltas", json={"base_revision": 99, "deltas": []})
+    assert stale.status_code == 409
+    out_of_range = client.post(f"/draft_sessions/{session_id}/deltas", json={"deltas": [{"start": 5, "end": 50}]})
+    assert out_of_range.status_code == 422
+    assert client.delete(f"/draft_sessions/{session_id}").status_code == 204
+    assert client.post(f"/draft_sessions/{session_id}/deltas", json={"deltas": []}).status_code == 404
+def test_cache_stats_endpoint_counts_repeated_notes(client):
+    before = client.get("/cache").json()
+    note = {"clinical_note": "Cache probe: pneumonia with fracture."}
+    client.post("/analyze_draft_note", json=note)
+    client.post("/analyze_draft_note", json=note)
+    after = client.get("/cache").json()
+    assert after["misses"] - before["misses"] == 1 and after["hits"] - before["hits"] == 1
+# --- Batch Analysis ---
+def test_batch_analysis_streams_ndjson_results(client):
+    notes = ["Patient has pneumonia and a fracture.", "No findings.", "Urinary tract infection, likely cystitis.", "fracture"] * 5
+    requests = [{"encounter_id": f"enc-{i}", "clinical_note": note} for i, note in enumerate(notes)]
+    for body in (json.dumps(requests), "\n".join(json.dumps(r) for r in requests) + "\n"):
+        content_type = "application/json" if body.startswith("[") else "application/x-ndjson"
+        response = client.post("/analyze_draft_note/batch", content=body, headers={"Content-Type": content_type})
+        assert response.status_code == 200 and response.headers["content-type"].startswith("application/x-ndjson")
+        results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["index"])
+        assert [r["encounter_id"] for r in results] == [r["encounter_id"] for r in requests]
+        for result, note in zip(results, notes):
+            single = client.post("/analyze_draft_note", json={"clinical_note": note}).json()
+            assert {k: result[k] for k in single} == single
+def test_batch_analysis_reports_malformed_entries(client):
+    body = '{"clinical_note": "pneumonia"}\n{"note": "missing field"}\nnot json\n'
+    response = client.post("/analyze_draft_note/batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+    results = {r["index"]: r for r in map(json.loads, response.text.splitlines())}
+    assert [n["id"] for n in results[0]["nudges"]] == ["pneumonia_specificity"]
+    assert "error" in results[1] and "error" in results[2]
+    assert client.post("/analyze_draft_note/batch", json={"clinical_note": "x"}).status_code == 422
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from src.backend import cdi_api
+from src.backend.cdi_api import CDI_RULES, app
+from src.backend.cdi_executor import AnalysisTimeoutError, CDIAnalysisExecutor, ExecutorSaturatedError
+from src.backend.cdi_rules import CDIRuleEngine
+from src.backend.result_cache import ResultCache
+from src.backend.term_matcher import TermMatcher
+CRITICAL = {"id": "fracture_laterality", "severity": "critical", "prompt": "Specify laterality."}
+WARNING = {"id": "pneumonia_specificity", "severity": "warning", "prompt": "Specify the organism."}
+class BlockingEngine:
+    """Stands in for CDIRuleEngine: reports critical nudges, then waits on `release` before finishing."""
+    def __init__(self, critical=True):
+        self.critical = critical
+        self.release = threading.Event()
+        self.stopped = threading.Event()
+    def evaluate_prioritized(self, note, on_critical, should_stop=None):
+        if self.critical:
+            on_critical([CRITICAL])
+        self.release.wait(5)
+        if should_stop is not None and should_stop():
+            self.stopped.set()
+            return None
+        return [WARNING, CRITICAL]
+def test_prioritized_evaluation_matches_evaluate():
+    engine = CDIRuleEngine(base_rules=CDI_RULES, result_cache=ResultCache())
+    note = "Pneumonia and a fracture; urinary tract infection."
+    critical = []
+    nudges = engine.evaluate_prioritized(note, critical.extend)
+    assert [n["id"] for n in critical] == ["fracture_laterality"]
+    assert nudges == CDIRuleEngine(base_rules=CDI_RULES).evaluate(note)
+    assert engine.evaluate(note) == nudges  # The full result was cached
+    stats = {r["id"]: r for r in engine.stats()["rules"]}
+    assert stats["fracture_laterality"]["fired"] == 2 and stats["uti_specificity"]["evaluations"] == 1  # Once from the cache
+    assert engine.stats()["cache_hits"] == 1
+def test_prioritized_evaluation_scans_the_note_once(monkeypatch):
+    engine = CDIRuleEngine(base_rules=CDI_RULES)
+    scans = []
+    finditer = TermMatcher.finditer_normalized
+    monkeypatch.setattr(TermMatcher, "finditer_normalized", lambda self, text: scans.append(self) or finditer(self, text))
+    engine.evaluate_prioritized("Pneumonia and a fracture.", lambda nudges: None)
+    assert len(scans) == 1
+def test_over_budget_returns_only_critical_nudges():
+    executor = CDIAnalysisExecutor(max_workers=1, max_queue=0, time_budget=0.05)
+    engine = BlockingEngine()
+    outcome = asyncio.run(executor.analyze(engine, "note"))
+    engine.release.set()
+    assert outcome.degraded and outcome.nudges == [CRITICAL]
+    assert executor.stats()["degraded"] == 1
+    assert engine.stopped.wait(1)  # The abandoned analysis skipped the remaining rules
+    executor.shutdown()
+def test_abandoned_evaluation_skips_non_critical_rules():
+    engine = CDIRuleEngine(base_rules=CDI_RULES, result_cache=ResultCache())
+    note = "Pneumonia and a fracture."
+    assert engine.evaluate_prioritized(note, lambda nudges: None, should_stop=lambda: True) is None
+    stats = {r["id"]: r for r in engine.stats()["rules"]}
+    assert stats["fracture_laterality"]["evaluations"] == 1 and stats["pneumonia_specificity"]["evaluations"] == 0
+    assert engine.result_cache.stats()["size"] == 0
+def test_over_budget_without_critical_results_times_out():
+    executor = CDIAnalysisExecutor(max_workers=1, time_budget=0.05)
+    engine = BlockingEngine(critical=False)
+    with pytest.raises(AnalysisTimeoutError):
+        asyncio.run(executor.analyze(engine, "note"))
+    engine.release.set()
+    executor.shutdown()
+def test_saturated_executor_rejects_and_recovers():
+    executor = CDIAnalysisExecutor(max_workers=1, max_queue=1, time_budget=0.05)
+    engine = BlockingEngine()
+    async def burst():
+        return await asyncio.gather(*(executor.analyze(engine, "note", time_budget=0.2) for _ in range(3)), return_exceptions=True)
+    results = asyncio.run(burst())
+    assert sum(isinstance(r, ExecutorSaturatedError) for r in results) == 1
+    engine.release.set()
+    while executor.in_flight:
+        threading.Event().wait(0.01)
+    assert not asyncio.run(executor.analyze(engine, "note")).degraded
+    assert executor.stats()["rejected"] == 1
+    executor.shutdown()
+def test_analyze_endpoint_maps_saturation_and_degradation(monkeypatch):
+    client = TestClient(app)
+    engine = BlockingEngine()
+    executor = CDIAnalysisExecutor(max_workers=1, max_queue=0, time_budget=0.05, retry_after=2)
+    monkeypatch.setattr(cdi_api, "rule_engine", engine)
+    monkeypatch.setattr(cdi_api, "analysis_executor", executor)
+    degraded = client.post("/analyze_draft_note", json={"clinical_note": "fracture"}).json()
+    assert degraded["degraded"] and [n["id"] for n in degraded["nudges"]] == ["fracture_laterality"]
+    saturated = client.post("/analyze_draft_note", json={"clinical_note": "fracture"})
+    assert saturated.status_code == 429 and saturated.headers["Retry-After"] == "2"
+    batch = client.post("/analyze_draft_note/batch", json=[{"clinical_note": "fracture"}])
+    assert batch.status_code == 429 and batch.headers["Retry-After"] == "2"
+    engine.release.set()
+    executor.shutdown()
+def test_draft_sessions_run_on_the_pool_and_share_its_admission_limit(monkeypatch):
+    client = TestClient(app)
+    session_id = client.post("/draft_sessions", json={"clinical_note": "pneumonia"}).json()["session_id"]
+    engine = BlockingEngine()
+    executor = CDIAnalysisExecutor(max_workers=1, max_queue=0, time_budget=0.05, retry_after=2)
+    monkeypatch.setattr(cdi_api, "rule_engine", engine)
+    monkeypatch.setattr(cdi_api, "analysis_executor", executor)
+    client.post("/analyze_draft_note", json={"clinical_note": "fracture"})  # Holds the only worker
+    opened = client.post("/draft_sessions", json={"clinical_note": "fracture"})
+    update = client.post(f"/draft_sessions/{session_id}/deltas", json={"deltas": [{"start": 0, "end": 0, "text": "left "}]})
+    assert opened.status_code == update.status_code == 429 and update.headers["Retry-After"] == "2"
+    engine.release.set()
+    while executor.in_flight:
+        threading.Event().wait(0.01)
+    update = client.post(f"/draft_sessions/{session_id}/deltas", json={"deltas": [{"start": 0, "end": 0, "text": "viral "}]})
+    assert update.status_code == 200 and update.json()["resolved"] == ["pneumonia_specificity"]
+    executor.shutdown()
+def test_batch_leaves_queue_slots_for_interactive_requests():
+    executor = CDIAnalysisExecutor(max_workers=2, max_queue=2, time_budget=0.05)
+    engine = BlockingEngine()
+    async def run():
+        batch = executor.analyze_many(engine, [(i, "note") for i in range(4)])
+        first = await batch.__anext__()
+        assert executor.in_flight <= 2  # Batch notes never wait in the queue
+        interactive = asyncio.ensure_future(executor.analyze(engine, "note", time_budget=2))
+        await asyncio.sleep(0.01)
+        assert executor.in_flight == 3  # Admitted into the queue even though the batch holds every worker
+        engine.release.set()
+        return [first] + [item async for item in batch], await interactive
+    results, interactive = asyncio.run(run())
+    assert sorted(key for key, _ in results) == [0, 1, 2, 3]
+    assert results[0][1].degraded and results[0][1].nudges == [CRITICAL] and not interactive.degraded
+    assert executor.stats()["rejected"] == 0
+    executor.shutdown()
@@ -0,0 +1,101 @@
+import threading
+import time
+from src.backend.claim_outbox import ClaimOutbox, OutboxDrainer
+from src.backend.coding_engine import CodingEngine
+AUTONOMOUS_NOTE = "Patient presents with myocardial infarction."
+AUTONOMOUS_META = {"id": "enc-1", "patient_id": "p-1", "visit_complexity": "low-complexity outpatient"}
+class FlakyConnector:
+    """Bulk connector that fails the listed claim numbers and records every batch it receives."""
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.batches = []
+        self.bundle_types = []
+    def submit_claims(self, claims, bundle_type="transaction"):
+        self.batches.append([c["claimNumber"] for c in claims])
+        self.bundle_types.append(bundle_type)
+        return [{"claimNumber": c["claimNumber"], "success": c["claimNumber"] not in self.failing,
+                 "error": "Rejected" if c["claimNumber"] in self.failing else None} for c in claims]
+class BlockingConnector:
+    def submit_claim(self, claim):
+        raise AssertionError("Coding must not call nphies when an outbox is configured.")
+def test_coding_enqueues_instead_of_submitting(tmp_path):
+    outbox = ClaimOutbox(str(tmp_path / "outbox.db"))
+    engine = CodingEngine(nphies_connector=BlockingConnector(), outbox=outbox)
+    result = engine.run_coding_job(AUTONOMOUS_NOTE, AUTONOMOUS_META)
+    assert result["phase"] == "AUTONOMOUS"
+    assert outbox.get("CLAIM-enc-1")["status"] == "PENDING"
+def test_enqueue_is_idempotent_on_claim_number(tmp_path):
+    outbox = ClaimOutbox(str(tmp_path / "outbox.db"))
+    assert outbox.enqueue({"claimNumber": "C-1"}) is True
+    assert outbox.enqueue({"claimNumber": "C-1"}) is False
+    assert outbox.enqueue_many([{"claimNumber": "C-1"}, {"claimNumber": "C-2"}]) == 1
+    assert outbox.counts()["PENDING"] == 2
+def test_entries_survive_reopening(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    outbox = ClaimOutbox(path)
+    outbox.enqueue({"claimNumber": "C-1", "items": []})
+    outbox.close()
+    reopened = ClaimOutbox(path)
+    assert [e["payload"]["claimNumber"] for e in reopened.lease_batch()] == ["C-1"]
+def test_drainer_submits_in_batches_and_retries_failures(tmp_path):
+    outbox = ClaimOutbox(str(tmp_path / "outbox.db"))
+    outbox.enqueue_many([{"claimNumber": f"C-{i}"} for i in range(5)])
+    connector = FlakyConnector(failing={"C-3"})
+    drainer = OutboxDrainer(outbox, connector, batch_size=3, backoff_base=0.0)
+    assert drainer.drain_once() == {"sent": 3, "retried": 0, "dead": 0}
+    assert drainer.drain_once() == {"sent": 1, "retried": 1, "dead": 0}
+    assert [len(b) for b in connector.batches] == [3, 2]
+    assert connector.bundle_types == ["batch", "batch"]  # Claims succeed or fail independently
+    entry = outbox.get("C-3")
+    assert entry["status"] == "PENDING" and entry["attempts"] == 1 and entry["last_error"] == "Rejected"
+    assert outbox.get("C-0")["status"] == "SENT"
+def test_drainer_dead_letters_after_max_attempts(tmp_path):
+    outbox = ClaimOutbox(str(tmp_path / "outbox.db"))
+    outbox.enqueue({"claimNumber": "C-1"})
+    drainer = OutboxDrainer(outbox, FlakyConnector(failing={"C-1"}), max_attempts=2, backoff_base=0.0)
+    assert drainer.drain_once()["retried"] == 1
+    assert drainer.drain_once()["dead"] == 1
+    assert drainer.drain_once() == {"sent": 0, "retried": 0, "dead": 0}
+    assert outbox.counts()["DEAD"] == 1
+    assert outbox.requeue_dead() == 1 and outbox.get("C-1")["status"] == "PENDING"
+def test_expired_lease_is_picked_up_again(tmp_path):
+    outbox = ClaimOutbox(str(tmp_path / "outbox.db"))
+    outbox.enqueue({"claimNumber": "C-1"})
+    assert len(outbox.lease_batch(lease_seconds=0.05)) == 1
+    assert outbox.lease_batch() == []  # Still leased by the (crashed) first drainer
+    time.sleep(0.06)
+    leased = outbox.lease_batch()
+    assert [e["claim_number"] for e in leased] == ["C-1"] and leased[0]["attempts"] == 2
+def test_batch_coding_enqueues_and_background_drainer_submits(tmp_path):
+    outbox = ClaimOutbox(str(tmp_path / "outbox.db"))
+    engine = CodingEngine(nphies_connector=BlockingConnector(), outbox=outbox)
+    jobs = [(AUTONOMOUS_NOTE, {**AUTONOMOUS_META, "id": f"enc-{i}"}) for i in range(10)]
+    results = list(engine.run_coding_jobs(jobs, executor="thread", max_workers=2, chunksize=3))
+    assert len(results) == 10 and outbox.counts()["PENDING"] == 10
+    connector = FlakyConnector()
+    stop = threading.Event()
+    worker = threading.Thread(target=OutboxDrainer(outbox, connector, batch_size=4).run, args=(stop, 0.01))
+    worker.start()
+    deadline = time.time() + 5
+    while outbox.counts()["SENT"] < 10 and time.time() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    worker.join()
+    assert outbox.counts()["SENT"] == 10
+def test_lease_is_fenced_and_renewed_during_submission(tmp_path):
+    outbox = ClaimOutbox(str(tmp_path / "outbox.db"))
+    outbox.enqueue({"claimNumber": "C-1"})
+    stale = outbox.lease_batch(lease_seconds=0.01)[0]["lease_id"]
+    time.sleep(0.02)
+    current = outbox.lease_batch()[0]["lease_id"]
+    assert outbox.extend_lease(stale) == 0
+    assert outbox.mark_sent("C-1", {"late": True}, lease_id=stale) is False
+    assert outbox.get("C-1")["status"] == "IN_FLIGHT"
+    assert outbox.mark_failed("C-1", "Rejected", time.time(), lease_id=current) is True
+    class SlowConnector(FlakyConnector):
+        def submit_claims(self, claims, bundle_type="transaction"):
+            time.sleep(0.15)
+            assert outbox.lease_batch() == []  # The heartbeat kept the batch leased
+            return super().submit_claims(claims, bundle_type)
+    drainer = OutboxDrainer(outbox, SlowConnector(), lease_seconds=0.06)
+    assert drainer.drain_once()["sent"] == 1 and outbox.get("C-1")["status"] == "SENT"
@@ -0,0 +1,89 @@
+import json
+import pytest
+import sqlalchemy
+from src.backend.claim_status_poller import ClaimStatusPoller, poll_interval
+from src.backend.nphies_connector import NphiesAPIError, NphiesAuthError
+# SQLite stand-in for the parts of sql/schema.sql used by status polling.
+SQLITE_SCHEMA = [
+    """CREATE TABLE claims (id TEXT PRIMARY KEY, encounter_id TEXT, claim_payload TEXT, claim_number TEXT UNIQUE,
+       status TEXT NOT NULL DEFAULT 'DRAFT', nphies_response TEXT, submitted_at TIMESTAMP, last_status_at TIMESTAMP,
+       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE claim_history (id TEXT PRIMARY KEY, claim_id TEXT NOT NULL REFERENCES claims(id), prev_status TEXT,
+       new_status TEXT NOT NULL, actor TEXT, reason TEXT, metadata TEXT, occurred_at TIMESTAMP)""",
+]
+NOW = 1_700_000_000.0
+class ScriptedConnector:
+    """Answers status checks from a per-claim script; None stands for 304 Not Modified."""
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = []
+    def check_status_if_changed(self, claim_id, etag=None):
+        self.calls.append((claim_id, etag))
+        status = self.statuses[claim_id]
+        if isinstance(status, Exception):
+            raise status
+        if status is None:
+            return None
+        return {"status": status, "claimId": claim_id, "etag": f"v-{status}", "response": {"id": claim_id}}
+@pytest.fixture
+def db(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'claims.db'}")
+    with engine.begin() as conn:
+        for ddl in SQLITE_SCHEMA:
+            conn.execute(sqlalchemy.text(ddl))
+        conn.execute(sqlalchemy.text(
+            "INSERT INTO claims (id, claim_number, status, submitted_at) VALUES (:id, :number, :status, :submitted)"), [
+            {"id": "c-1", "number": "CLAIM-1", "status": "SENT", "submitted": "2023-11-14 22:00:00+00:00"},
+            {"id": "c-2", "number": "CLAIM-2", "status": "PENDING", "submitted": "2023-11-01 00:00:00+00:00"},
+            {"id": "c-3", "number": "CLAIM-3", "status": "SENT", "submitted": "2023-11-14 22:00:00+00:00"},
+            {"id": "c-4", "number": "CLAIM-4", "status": "DRAFT", "submitted": None},
+            {"id": "c-5", "number": "CLAIM-5", "status": "FC_3", "submitted": "2023-11-01 00:00:00+00:00"},
+        ])
+    return engine
+def statuses(db):
+    with db.connect() as conn:
+        return dict(conn.execute(sqlalchemy.text("SELECT claim_number, status FROM claims")).all())
+def test_poll_interval_backs_off_with_age_and_unchanged_polls():
+    assert poll_interval(60) < poll_interval(3 * 3600) < poll_interval(3 * 86400) < poll_interval(30 * 86400)
+    assert poll_interval(60, 1) == 2 * poll_interval(60) and poll_interval(60, 50) == 24 * 3600
+def test_polls_open_claims_and_writes_only_changes(db):
+    connector = ScriptedConnector({"CLAIM-1": "FC_3", "CLAIM-2": None, "CLAIM-3": "SENT"})
+    poller = ClaimStatusPoller(db, connector, max_concurrency=2, write_batch_size=2)
+    assert poller.load(NOW) == 3  # Drafts and final claims are never polled
+    stats = poller.poll_once(NOW)
+    assert stats == {"polled": 3, "changed": 1, "not_modified": 2, "finalized": 1, "errors": 0}
+    assert statuses(db) == {"CLAIM-1": "FC_3", "CLAIM-2": "PENDING", "CLAIM-3": "SENT", "CLAIM-4": "DRAFT", "CLAIM-5": "FC_3"}
+    with db.connect() as conn:
+        history = conn.execute(sqlalchemy.text("SELECT claim_id, prev_status, new_status FROM claim_history")).all()
+        response = conn.execute(sqlalchemy.text("SELECT nphies_response FROM claims WHERE id = 'c-1'")).scalar_one()
+    assert [tuple(h) for h in history] == [("c-1", "SENT", "FC_3")] and json.loads(response) == {"id": "CLAIM-1"}
+    assert len(poller) == 2 and poller.poll_once(NOW + 1)["polled"] == 0
+def test_fresh_claims_are_polled_more_often_with_etags(db):
+    connector = ScriptedConnector({"CLAIM-1": "SENT", "CLAIM-2": "PENDING", "CLAIM-3": "SENT"})
+    poller = ClaimStatusPoller(db, connector)
+    poller.load(NOW)
+    poller.poll_once(NOW)
+    connector.calls.clear()
+    poller.poll_once(NOW + 2 * 3600)
+    assert sorted(connector.calls) == [("CLAIM-1", "v-SENT"), ("CLAIM-3", "v-SENT")]  # CLAIM-2 is two weeks old
+def test_failed_checks_back_off_and_concurrent_changes_are_not_overwritten(db):
+    connector = ScriptedConnector({"CLAIM-1": NphiesAPIError("boom"), "CLAIM-2": "FC_3", "CLAIM-3": "SENT"})
+    poller = ClaimStatusPoller(db, connector)
+    poller.load(NOW)
+    with db.begin() as conn:
+        conn.execute(sqlalchemy.text("UPDATE claims SET status = 'PAID' WHERE id = 'c-2'"))
+    stats = poller.poll_once(NOW)
+    assert stats["errors"] == 1 and stats["changed"] == 1 and stats["finalized"] == 0
+    assert statuses(db)["CLAIM-2"] == "PAID"
+    assert poller.load(NOW) == 0 and len(poller) == 2
+def test_auth_failure_mid_batch_writes_changes_and_defers_the_rest(db):
+    connector = ScriptedConnector({"CLAIM-1": "FC_3", "CLAIM-2": NphiesAuthError("token"), "CLAIM-3": "PAID"})
+    poller = ClaimStatusPoller(db, connector, max_concurrency=1, write_batch_size=2)
+    poller.load(NOW)
+    stats = poller.poll_once(NOW)
+    assert stats == {"polled": 2, "changed": 1, "not_modified": 0, "finalized": 1, "errors": 1}
+    assert [c for c, _ in connector.calls] == ["CLAIM-1", "CLAIM-2"] and statuses(db)["CLAIM-1"] == "FC_3"
+    connector.statuses["CLAIM-2"] = "FC_3"
+    connector.calls.clear()
+    assert poller.poll_once(NOW + 13 * 3600)["finalized"] == 2  # Neither claim was lost from the schedule
+    assert sorted(c for c, _ in connector.calls) == ["CLAIM-2", "CLAIM-3"] and len(poller) == 0
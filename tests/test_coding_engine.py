@@ -0,0 +1,177 @@
+import copy
+import gc
+import pickle
+import re
+import pytest
+from src.backend.coding_engine import CodingEngine
+from src.backend import coding_results
+from src.backend.coding_results import CodeEntry, CompactCodingResult, code_entries_for, intern_codes
+from src.backend.term_matcher import FrozenTerms, TermMatcher, get_term_matcher
+# --- Helpers ---
+def legacy_placeholder_nlp(term_map, text):
+    """The original per-term regex scan, kept as a reference implementation."""
+    text_lower = text.lower()
+    return [info.copy() for term, info in term_map.items()
+            if re.search(r'\b' + re.escape(term) + r'\b', text_lower)]
+@pytest.fixture
+def engine() -> CodingEngine:
+    return CodingEngine()
+# --- Term Matcher ---
+@pytest.mark.parametrize("note", [
+    "Patient presents with classic signs of acute myocardial infarction. EKG confirms.",
+    "Diagnosis of appendicitis confirmed by imaging.",
+    "Suspected PNEUMONIA; rule out UTI. Old fracture noted.",
+    "No relevant findings: pneumonias, utility, refracture, myocardial_infarction.",
+    "uti",
+    "",
+])
+def test_placeholder_nlp_matches_legacy_regex(engine, note):
+    assert engine._placeholder_nlp(note) == legacy_placeholder_nlp(engine.TERM_TO_CODE_MAP, note)
+def test_term_matches_report_positions(engine):
+    note = "Fracture of tibia; follow-up for pneumonia."
+    matches = engine.find_term_matches(note)
+    assert [(m.term, note[m.start:m.end].lower(), m.value["code"]) for m in matches] == [
+        ("fracture", "fracture", "S82.90XA"),
+        ("pneumonia", "pneumonia", "J18.9"),
+    ]
+def test_overlapping_terms_and_boundaries():
+    matcher = TermMatcher({"heart": 1, "heart failure": 2, "failure": 3, "c++": 4})
+    found = [(m.term, m.start) for m in matcher.finditer("Acute heart failure; heartfailure; c++ code")]
+    assert found == [("heart", 6), ("heart failure", 6), ("failure", 12)]
+    # `\b` after a trailing non-word character needs a word character to follow, as in `re`.
+    assert TermMatcher({"c++": 4}).find_all("use c++ here") == []
+    assert re.search(r'\bc\+\+\b', "use c++ here") is None
+def test_substring_mode_matches_plain_containment():
+    matcher = TermMatcher({"left": 1, "ft": 2}, whole_words=False)
+    assert [m.term for m in matcher.finditer("cleft")] == ["left", "ft"]
+def test_matcher_is_compiled_once_per_dictionary(engine):
+    assert engine.term_matcher is CodingEngine().term_matcher
+    other = {"sepsis": {"code": "A41.9", "desc": "Sepsis, unspecified organism", "confidence": 0.9}}
+    assert get_term_matcher(other) is get_term_matcher(other)
+    assert get_term_matcher(other) is not engine.term_matcher
+def test_matcher_cache_sees_same_size_edits():
+    terms = {"sepsis": {"code": "A41.9", "desc": "Sepsis", "confidence": 0.9}}
+    before = get_term_matcher(terms)
+    terms["sepsis"]["code"] = "A41.0"
+    assert get_term_matcher(terms) is not before and get_term_matcher(terms).value_at(0)["code"] == "A41.0"
+    del terms["sepsis"]
+    terms["bacteremia"] = {"code": "R78.81", "desc": "Bacteremia", "confidence": 0.9}
+    assert [m.term for m in get_term_matcher(terms).finditer("Bacteremia")] == ["bacteremia"]
+    with pytest.raises(TypeError):
+        CodingEngine.TERM_TO_CODE_MAP["pneumonia"] = {"code": "J15.9"}
+    with pytest.raises(TypeError):
+        CodingEngine.TERM_TO_CODE_MAP["pneumonia"]["code"] = "J15.9"
+    frozen = FrozenTerms(terms)
+    assert get_term_matcher(frozen) is get_term_matcher(frozen) and dict(frozen) == terms
+# --- Batch Coding ---
+class RecordingConnector:
+    def __init__(self):
+        self.single_calls = []
+        self.bulk_calls = []
+    def submit_claim(self, claim_data):
+        self.single_calls.append(claim_data)
+        return {"status": "SUBMITTED"}
+    def submit_claims(self, claims, bundle_type="transaction"):
+        self.bulk_calls.append(list(claims))
+        return [{"claimNumber": c["claimNumber"], "success": "FAIL" not in c["claimNumber"]} for c in claims]
+def sample_jobs(n):
+    notes = [
+        ("Acute myocardial infarction confirmed.", {"visit_complexity": "low-complexity outpatient"}),
+        ("Diagnosis of appendicitis confirmed by imaging.", {"visit_complexity": "inpatient"}),
+        ("Cough and fever. Suspected pneumonia.", {"visit_complexity": "inpatient"}),
+    ]
+    for i in range(n):
+        note, meta = notes[i % len(notes)]
+        yield f"{note} Encounter {i}.", {**meta, "id": i}
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_run_coding_jobs_matches_serial_and_submits_in_bulk(executor):
+    connector = RecordingConnector()
+    engine = CodingEngine(nphies_connector=connector)
+    expected = [CodingEngine(nphies_connector=RecordingConnector()).run_coding_job(n, m) for n, m in sample_jobs(50)]
+    results = list(engine.run_coding_jobs(sample_jobs(50), executor=executor, max_workers=2, chunksize=4, submit_batch_size=5))
+    assert results == expected
+    assert connector.single_calls == []
+    submitted = [c["claimNumber"] for batch in connector.bulk_calls for c in batch]
+    assert submitted == [f"CLAIM-{i}" for i in range(0, 50, 3)]
+    assert all(len(batch) <= 5 + 3 for batch in connector.bulk_calls)
+def test_run_coding_jobs_unordered_and_bounded():
+    pulled = []
+    def jobs():
+        for job in sample_jobs(200):
+            pulled.append(job)
+            yield job
+    engine = CodingEngine(nphies_connector=RecordingConnector())
+    stream = engine.run_coding_jobs(jobs(), executor="thread", max_workers=2, chunksize=10, ordered=False, max_in_flight=3)
+    first = next(stream)
+    assert len(pulled) <= 10 * 4
+    rest = list(stream)
+    assert sorted(r["source_text"] for r in [first] + rest) == sorted(n for n, _ in sample_jobs(200))
+def test_run_coding_jobs_falls_back_to_per_claim_submission():
+    class SingleOnlyConnector:
+        def __init__(self):
+            self.calls = 0
+        def submit_claim(self, claim_data):
+            self.calls += 1
+    connector = SingleOnlyConnector()
+    list(CodingEngine(nphies_connector=connector).run_coding_jobs(sample_jobs(9), executor="thread", max_workers=1))
+    assert connector.calls == 3
+def test_run_coding_jobs_sets_status_from_submit_outcome():
+    connector = RecordingConnector()
+    engine = CodingEngine(nphies_connector=connector)
+    jobs = [(n, {**m, "id": "FAIL" if m["id"] == 3 else m["id"]}) for n, m in sample_jobs(9)]
+    for compact in (False, True):
+        results = list(engine.run_coding_jobs(jobs, executor="thread", max_workers=1, chunksize=2, compact=compact))
+        statuses = [r.status if compact else r["status"] for r in results]
+        assert statuses[0] == "SENT_TO_NPHIES" and statuses[3] == "SUBMISSION_FAILED" and statuses[6] == "SENT_TO_NPHIES"
+        assert statuses[1] != "SENT_TO_NPHIES"
+def test_worker_copy_strips_parent_resources_without_breaking_copies():
+    connector = RecordingConnector()
+    engine = CodingEngine(nphies_connector=connector)
+    assert copy.copy(engine).nphies_connector is connector
+    assert isinstance(copy.deepcopy(engine).nphies_connector, RecordingConnector)
+    worker = engine._worker_copy()
+    assert worker.nphies_connector is None and engine.nphies_connector is connector
+    assert pickle.loads(pickle.dumps(worker)).nphies_connector is None
+# --- Compact Results ---
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_compact_results_round_trip_to_dicts(executor):
+    expected = [CodingEngine(nphies_connector=RecordingConnector()).run_coding_job(n, m) for n, m in sample_jobs(30)]
+    connector = RecordingConnector()
+    results = list(CodingEngine(nphies_connector=connector).run_coding_jobs(
+        sample_jobs(30), executor=executor, max_workers=2, chunksize=4, compact=True))
+    assert all(isinstance(r, CompactCodingResult) for r in results)
+    assert [r.to_dict() for r in results] == expected
+    assert sum(len(batch) for batch in connector.bulk_calls) == 10
+def test_compact_results_share_codes_and_load_source_lazily():
+    notes = dict(sample_jobs(9))
+    loads = []
+    def loader(ref):
+        loads.append(ref)
+        return next(n for n, m in sample_jobs(9) if m["id"] == ref)
+    results = list(CodingEngine(nphies_connector=RecordingConnector()).run_coding_jobs(
+        sample_jobs(9), executor="thread", max_workers=1, compact=True, source_loader=loader))
+    assert results[0].codes is results[3].codes and results[0].final_codes is results[0].codes
+    assert results[1].final_codes == ()
+    assert loads == [] and results[4].source_text in notes and loads == [4]
+def test_compact_result_pickles_with_interned_codes(engine):
+    result, _ = engine._code_note_compact("Acute myocardial infarction.", {})
+    result.attach_source(source_ref=7, source_text="Acute myocardial infarction.")
+    restored = pickle.loads(pickle.dumps(result))
+    assert restored == result and restored.codes is result.codes
+def test_interned_code_lists_are_bounded(monkeypatch):
+    monkeypatch.setattr(coding_results, "MAX_INTERNED_CODE_LISTS", 2)
+    first = intern_codes([CodeEntry("A00", "a", 0.5)])
+    for i in range(3):
+        intern_codes([CodeEntry(f"B{i:02}", "b", 0.5)])
+    assert len(coding_results._CODE_LISTS) <= 2
+    assert intern_codes([CodeEntry("A00", "a", 0.5)]) is not first  # Evicted, so interned afresh
+    matcher = TermMatcher({"x": {"code": "X", "desc": "x", "confidence": 1.0}})
+    assert code_entries_for(matcher) is code_entries_for(matcher)
+    entries = len(coding_results._MATCHER_ENTRIES)
+    del matcher
+    gc.collect()
+    assert len(coding_results._MATCHER_ENTRIES) == entries - 1  # Dropped with its matcher
+def test_compact_results_are_unhashable(engine):
+    result, _ = engine._code_note_compact("Pneumonia.", {})
+    with pytest.raises(TypeError):
+        hash(result)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import sqlalchemy
+from src.backend.drg_grouper import DRGGrouper, encounter_columns, load_drg_table, period_keys, write_case_mix_index
+def per_row_reference(grouper, code, encounter_type, secondary):
+    return grouper._resolve(code, encounter_type.upper(), secondary > 0)
+def test_groups_by_prefix_and_cc():
+    grouper = DRGGrouper()
+    idx = grouper.group(["J18.9", "J18.9", "I21.4", "Z00.0", "N39.0"], secondary_counts=[0, 2, 1, 0, 0])
+    assert grouper.drgs[idx].tolist() == ["195", "193", "280", "999", "690"]
+    assert grouper.weights[idx][3] == 0.0
+def test_most_specific_row_wins():
+    grouper = DRGGrouper([
+        {"drg": "A", "weight": 1.0, "principal_prefix": "J18"},
+        {"drg": "B", "weight": 2.0, "principal_prefix": "J18.9"},
+        {"drg": "C", "weight": 3.0, "principal_prefix": "J18", "encounter_type": "OUTPATIENT"},
+    ])
+    idx = grouper.group(["J18.1", "J18.9", "J18.1"], encounter_types=["INPATIENT", "INPATIENT", "outpatient"])
+    assert grouper.drgs[idx].tolist() == ["A", "B", "C"]
+def test_vectorized_grouping_matches_per_row_lookup():
+    rng = np.random.default_rng(7)
+    grouper = DRGGrouper()
+    codes = rng.choice(["J18.9", "I21.9", "K37", "N39.0", "S82.90XA", "R69"], size=2000)
+    types = rng.choice(["INPATIENT", "OUTPATIENT"], size=2000)
+    secondary = rng.integers(0, 3, size=2000)
+    expected = [per_row_reference(grouper, c, t, s) for c, t, s in zip(codes, types, secondary)]
+    assert grouper.group(codes, types, secondary).tolist() == expected
+def test_rollup_per_provider_and_month():
+    grouper = DRGGrouper()
+    idx = grouper.group(["I21.9", "J18.9", "R69", "J18.9"], secondary_counts=[1, 0, 0, 0])
+    rollup = grouper.rollup(idx, ["p1", "p1", "p1", "p2"], period_keys(["2024-05-03", "2024-05-20T08:00:00+03:00", "2024-05-21", "2024-06-01"]))
+    records = rollup.to_records()
+    assert [(r["provider"], r["period"], r["encounters"], r["grouped"]) for r in records] == [("p1", "2024-05", 3, 2), ("p2", "2024-06", 1, 1)]
+    assert records[0]["cmi"] == pytest.approx((1.7033 + 0.7054) / 2, abs=1e-4)
+    assert grouper.case_mix_index(idx) == pytest.approx((1.7033 + 0.7054 * 2) / 3)
+def test_encounter_columns_from_coding_results():
+    columns = encounter_columns([
+        {"final_codes": [{"code": "I21.9"}, {"code": "J18.9"}], "encounter_type": "INPATIENT", "provider_id": "p1", "discharge_dt": "2024-05-02"},
+        {"final_codes": [], "encounter_type": "OUTPATIENT", "provider_id": "p1", "discharge_dt": None},
+    ])
+    grouper = DRGGrouper()
+    idx = grouper.group(columns["principal_codes"], columns["encounter_types"], columns["secondary_counts"])
+    assert grouper.drgs[idx].tolist() == ["280", "999"]
+    assert columns["periods"].astype(str).tolist() == ["2024-05", "NaT"]
+def test_loads_table_from_csv(tmp_path):
+    path = tmp_path / "drg.csv"
+    path.write_text("drg,description,weight,principal_prefix,cc,encounter_type\n871,Sepsis,1.9,A41,,\n")
+    grouper = DRGGrouper.from_csv(str(path))
+    assert load_drg_table(str(path))[0]["drg"] == "871"
+    assert grouper.drgs[grouper.group(["A41.9"])].tolist() == ["871"]
+    with pytest.raises(ValueError):
+        DRGGrouper([{"drg": "1", "weight": "heavy", "principal_prefix": "A"}])
+def test_writes_case_mix_index(tmp_path):
+    db = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'cmi.db'}")
+    with db.begin() as conn:
+        conn.execute(sqlalchemy.text("CREATE TABLE encounters (id TEXT PRIMARY KEY, case_mix_index NUMERIC DEFAULT 0, updated_at TIMESTAMP)"))
+        conn.execute(sqlalchemy.text("INSERT INTO encounters (id) VALUES ('e1'), ('e2')"))
+    grouper = DRGGrouper()
+    idx = grouper.group(["I21.9", "R69"])
+    assert write_case_mix_index(db, ["e1", "e2"], grouper.weights[idx], batch_size=1) == 2
+    with db.connect() as conn:
+        rows = conn.execute(sqlalchemy.text("SELECT id, case_mix_index FROM encounters ORDER BY id")).all()
+    assert [(r[0], float(r[1])) for r in rows] == [("e1", 0.793), ("e2", 0.0)]
@@ -0,0 +1,74 @@
+import json
+import logging
+import pytest
+from fastapi.testclient import TestClient
+from src.backend.cdi_api import app
+from src.backend.coding_engine import CodingEngine
+from src.backend.instrumentation import JsonLogFormatter, MetricsRegistry, registry
+from src.backend.mock_nphies_server import MockNphiesServer
+from src.backend.nphies_connector import NphiesAPIError, NphiesConnector
+CLAIM = {"claimNumber": "CLAIM-1", "patient": {"id": "PAT-1"}, "items": [{"serviceCode": "J18.9", "description": "Pneumonia"}]}
+@pytest.fixture
+def metrics():
+    registry.reset()
+    registry.enable()
+    yield registry
+    registry.enable(False)
+    registry.reset()
+def test_disabled_registry_records_nothing():
+    disabled = MetricsRegistry()
+    with disabled.stage("nlp"), disabled.timer("other_seconds"):
+        disabled.inc("coding_phase_total", phase="CAC")
+    assert disabled.stage("nlp") is disabled.timer("x")  # One shared no-op timer
+    assert disabled.render() == "" and disabled.counter("coding_phase_total", phase="CAC") == 0
+def test_prometheus_text_format():
+    metrics = MetricsRegistry(enabled=True, buckets=(0.01, 0.1))
+    metrics.inc("coding_phase_total", phase="CAC")
+    metrics.inc("coding_phase_total", 2, phase="AUTONOMOUS")
+    for seconds in (0.005, 0.05, 0.01, 3):
+        metrics.observe("stage_seconds", seconds, stage="nlp")
+    lines = metrics.render().splitlines()
+    assert "# TYPE coding_phase_total counter" in lines and "# TYPE stage_seconds histogram" in lines
+    assert 'coding_phase_total{phase="AUTONOMOUS"} 2' in lines and 'coding_phase_total{phase="CAC"} 1' in lines
+    assert [line for line in lines if line.startswith("stage_seconds")] == [
+        'stage_seconds_bucket{stage="nlp",le="0.01"} 2',
+        'stage_seconds_bucket{stage="nlp",le="0.1"} 3',
+        'stage_seconds_bucket{stage="nlp",le="+Inf"} 4',
+        'stage_seconds_sum{stage="nlp"} 3.065',
+        'stage_seconds_count{stage="nlp"} 4',
+    ]
+def test_coding_jobs_record_phases_and_stage_times(metrics):
+    engine = CodingEngine(nphies_connector=type("Quiet", (), {"submit_claim": lambda self, claim: {"success": True}})())
+    engine.run_coding_job("Acute myocardial infarction.", {"id": "E1", "visit_complexity": "low-complexity outpatient"})
+    engine.run_coding_job("Pneumonia.", {"id": "E2"})
+    engine.run_coding_job("Nothing to code.", {"id": "E3"})
+    assert [metrics.counter("coding_phase_total", phase=p) for p in ("AUTONOMOUS", "SEMI_AUTONOMOUS", "CAC")] == [1, 0, 2]
+    for stage, count in (("coding_job", 3), ("nlp", 3), ("phase_decision", 3), ("submit", 1)):
+        assert metrics.histogram("stage_seconds", stage=stage)["count"] == count
+def test_connector_counts_retries_token_refreshes_and_replays(metrics, caplog):
+    with MockNphiesServer(retry_after=0.01) as server:
+        connector = NphiesConnector(server.url, "client", "secret", backoff_base=0.01, max_retries=1)
+        connector.submit_claim(CLAIM)
+        server.expire_tokens()
+        server.throttle_rate = 1.0
+        with caplog.at_level(logging.INFO, logger="src.backend.nphies_connector"), pytest.raises(NphiesAPIError):
+            connector.submit_claim(CLAIM)
+    assert metrics.counter("nphies_token_refreshes_total") == 2
+    assert metrics.counter("nphies_401_replays_total") == 1
+    assert metrics.counter("nphies_retries_total", endpoint="claim", status=429) == 1
+    assert metrics.counter("nphies_responses_total", endpoint="claim", status=201) == 1
+    assert metrics.counter("nphies_request_errors_total", kind="http_status") == 1
+    for stage in ("fhir_map", "fhir_validate", "auth", "http"):
+        assert metrics.histogram("stage_seconds", stage=stage)["count"] >= 2
+    events = [getattr(r, "event", None) for r in caplog.records]
+    assert events == ["nphies_token_rejected", "nphies_http_error"]
+    logged = json.loads(JsonLogFormatter().format(caplog.records[-1]))
+    assert logged["level"] == "ERROR" and logged["status"] == 429 and logged["url"].endswith("/Claim")
+def test_metrics_endpoint(metrics):
+    client = TestClient(app)
+    client.post("/analyze_draft_note", json={"clinical_note": "Pneumonia with a fracture, unique note for metrics."})
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'stage_seconds_count{stage="cdi_rules"} 1' in response.text.splitlines()
+    metrics.enable(False)
+    assert client.get("/metrics").status_code == 404
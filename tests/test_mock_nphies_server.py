@@ -0,0 +1,51 @@
+import time
+import pytest
+from src.backend.mock_nphies_server import MockNphiesServer, parse_latency
+from src.backend.nphies_connector import NphiesAPIError, NphiesConnector
+from src.backend.rate_limiter import NphiesRateLimiter
+CLAIM = {"claimNumber": "CLAIM-1", "patient": {"id": "PAT-1"}, "items": [{"serviceCode": "J18.9", "description": "Pneumonia"}]}
+def connector_for(server, **kwargs):
+    return NphiesConnector(server.url, "client", "secret", rate_limiter=NphiesRateLimiter({"claim": {"rate": None}}),
+                           backoff_base=0.01, **kwargs)
+@pytest.fixture
+def server():
+    with MockNphiesServer(retry_after=0.01, adjudication_delay=0.2, seed=7) as server:
+        yield server
+def test_claims_round_trip_over_http_with_conditional_status(server):
+    connector = connector_for(server)
+    assert connector.submit_claim(CLAIM)["id"] == "CLAIM-1"
+    first = connector.check_status_if_changed("CLAIM-1")
+    assert first["status"] == "PENDING" and first["etag"] == 'W/"1"'
+    assert connector.check_status_if_changed("CLAIM-1", first["etag"]) is None
+    time.sleep(0.25)
+    adjudicated = connector.check_status_if_changed("CLAIM-1", first["etag"])
+    assert adjudicated["status"] == "FC_3" and adjudicated["etag"] == 'W/"2"'
+    results = connector.submit_claims([{**CLAIM, "claimNumber": f"CLAIM-{i}"} for i in range(2, 5)], bundle_type="batch")
+    assert [r["success"] for r in results] == [True] * 3 and results[0]["location"] == "Claim/CLAIM-2"
+    assert connector.reconcile_payment({"amount": {"value": 10}})["resourceType"] == "PaymentNotice"
+    assert server.stats()["tokens_issued"] == 1  # One token, reused over pooled connections
+def test_expired_token_is_refreshed_and_the_request_replayed(server):
+    connector = connector_for(server)
+    connector.submit_claim(CLAIM)
+    server.expire_tokens()
+    assert connector.check_status("CLAIM-1")["status"] == "PENDING"
+    stats = server.stats()
+    assert stats["unauthorized"] == 1 and stats["tokens_issued"] == 2
+def test_injected_throttling_is_retried_then_surfaced():
+    with MockNphiesServer(throttle_rate=1.0, retry_after=0.01) as server:
+        connector = connector_for(server, max_retries=2)
+        with pytest.raises(NphiesAPIError, match="429"):
+            connector.submit_claim(CLAIM)
+        assert server.stats()["injected_throttles"] == 3
+        assert connector.rate_limiter.metrics()["claim"]["retry_after_honored"] == 2
+def test_slow_bodies_hit_the_read_timeout():
+    with MockNphiesServer(slow_body_rate=1.0, slow_body_chunks=4, slow_body_delay=0.3) as server:
+        connector = connector_for(server, timeout=0.1)
+        with pytest.raises(NphiesAPIError, match="timed out"):
+            connector.submit_claim(CLAIM)
+def test_latency_specs():
+    assert parse_latency("fixed:0.25")() == 0.25
+    assert 0.1 <= parse_latency("uniform:0.1:0.2")() <= 0.2
+    assert parse_latency("lognormal:0.05:0.5")() > 0
+    with pytest.raises(ValueError):
+        parse_latency("gamma:1")
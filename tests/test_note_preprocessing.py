@@ -0,0 +1,67 @@
+import pickle
+import pytest
+from src.backend.cdi_rules import CDIRuleEngine, CompiledRuleSet
+from src.backend.cdi_sessions import DraftSession
+from src.backend.coding_engine import CodingEngine
+from src.backend.note_preprocessing import PreprocessedNote, preprocess_note
+SENTENCE_RULE = {
+    "id": "fracture_laterality",
+    "keyword": "fracture",
+    "negation_keywords": ["left", "right"],
+    "negation_scope": "sentence",
+    "nudge": {"id": "fracture_laterality", "severity": "critical", "prompt": "Specify laterality."},
+}
+NOTE_RULE = {**SENTENCE_RULE, "id": "note_scoped", "negation_scope": "note",
+             "nudge": {**SENTENCE_RULE["nudge"], "id": "note_scoped"}}
+def test_sentences_are_offsets_into_the_normalized_note():
+    note = PreprocessedNote("Left knee PAIN. Fracture of the radius!\nNo fever")
+    assert [note.normalized[s:e] for s, e in note.sentence_spans()] == [
+        "left knee pain.", "fracture of the radius!", "no fever"]
+    assert note.sentence_of(note.normalized.index("radius")) == 1
+    assert note.sentence_starts.typecode == "l"
+def test_decimal_points_do_not_split_sentences():
+    assert PreprocessedNote("Temp 38.5 with pneumonia. Stable.").sentence_count == 2
+def test_matches_are_memoized_per_matcher():
+    engine = CodingEngine()
+    note = preprocess_note("Pneumonia with UTI.")
+    assert note.find_all(engine.term_matcher) is note.find_all(engine.term_matcher)
+    assert preprocess_note(note) is note
+def test_engines_share_one_preprocessed_note():
+    note = preprocess_note("Patient with pneumonia and a fracture.")
+    coding = CodingEngine().run_coding_job(note, {})
+    nudges = CDIRuleEngine(base_rules=[SENTENCE_RULE]).evaluate(note)
+    assert coding["source_text"] == note.text
+    assert [c["code"] for c in coding["suggested_codes"]] == ["J18.9", "S82.90XA"]
+    assert [n["id"] for n in nudges] == ["fracture_laterality"]
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_critical_cdi_query_holds_autonomous_claims(executor):
+    rule = {"id": "mi_type", "keyword": "myocardial infarction", "negation_keywords": ["stemi", "nstemi"],
+            "nudge": {"id": "mi_type", "severity": "critical", "prompt": "Specify STEMI or NSTEMI."}}
+    cdi = CDIRuleEngine(base_rules=[rule])
+    engine = CodingEngine(cdi_engine=cdi)
+    meta = {"visit_complexity": "low-complexity outpatient", "id": 1}
+    jobs = [("Acute myocardial infarction.", meta), ("NSTEMI myocardial infarction.", meta)]
+    results = list(engine.run_coding_jobs(jobs, executor=executor, max_workers=1))
+    assert [r["phase"] for r in results] == ["SEMI_AUTONOMOUS", "AUTONOMOUS"]
+    assert cdi.stats()["rules"][0]["evaluations"] == (2 if executor == "thread" else 0)
+def test_sentence_scoped_negation():
+    ruleset = CompiledRuleSet([SENTENCE_RULE, NOTE_RULE])
+    # Laterality is documented for the knee, not for the fracture.
+    fired = [n["id"] for n in ruleset.evaluate("Left knee pain. Fracture of the tibia.")]
+    assert fired == ["fracture_laterality"]
+    assert ruleset.evaluate("Fracture of the right tibia.") == []
+def test_draft_session_matches_full_evaluation_for_sentence_rules():
+    engine = CDIRuleEngine(base_rules=[SENTENCE_RULE])
+    session = DraftSession(engine, "Right knee pain.\nFracture of the tibia.")
+    assert [n["id"] for n in session.nudges] == ["fracture_laterality"]
+    added, resolved = session.apply_deltas([{"start": len(session.text), "end": len(session.text), "text": " Left side."}])
+    assert resolved == [] and session.nudges
+    start = session.text.index("Fracture")
+    added, resolved = session.apply_deltas([{"start": start, "end": start, "text": "Left "}])
+    assert resolved == ["fracture_laterality"]
+    assert engine.evaluate(session.text) == []
+def test_preprocessed_notes_pickle_without_memoized_matches():
+    note = preprocess_note("Pneumonia.")
+    note.find_all(CodingEngine().term_matcher)
+    restored = pickle.loads(pickle.dumps(note))
+    assert restored.text == note.text and restored._matches == {}
@@ -1,4 +1,6 @@
 import os
+import gzip
+import json
 import time
 import pytest
 import requests
@@ -131,9 +133,96 @@ def test_e2e_claim_lifecycle_with_mock_db(connector, mocked_api, mock_db):
     with mock_db.connect() as conn:
         result = conn.execute(sqlalchemy.text(f"SELECT status FROM claims WHERE id = '{claim_id}'")).scalar_one()
         assert result == "FC_3"
+def test_conditional_status_check_uses_etags(connector, mocked_api):
+    """A 304 for the ETag of the previous response means the claim is unchanged."""
+    if IS_REAL_MODE:
+        pytest.skip("Conditional request test is only for mock mode.")
+    mocked_api.get(f"{MOCK_BASE_URL}/Claim/COND-1", [
+        {"json": {"status": "draft"}, "headers": {"ETag": 'W/"1"'}},
+        {"status_code": 304, "text": ""},
+    ])
+    first = connector.check_status_if_changed("COND-1")
+    assert first["status"] == "PENDING" and first["etag"] == 'W/"1"' and first["response"] == {"status": "draft"}
+    assert "If-None-Match" not in mocked_api.request_history[-1].headers
+    assert connector.check_status_if_changed("COND-1", first["etag"]) is None
+    assert mocked_api.last_request.headers["If-None-Match"] == 'W/"1"'
 def test_auth_failure_raises_exception(connector, requests_mock):
     if IS_REAL_MODE:
         pytest.skip("Auth failure test is only for mock mode.")
     requests_mock.post(f"{MOCK_BASE_URL}/oauth/token", status_code=401, text="Unauthorized")
     with pytest.raises(NphiesAuthError):
-        connector.submit_claim({})
\ No newline at end of file
+        connector.submit_claim({})
+def test_submit_claims_packs_bundles_and_reports_per_claim(connector, mocked_api):
+    """Bulk submission packs claims into capped Bundles and splits per-entry outcomes."""
+    if IS_REAL_MODE:
+        pytest.skip("Bulk submission test is only for mock mode.")
+    claims = [{"claimNumber": f"BULK-{i}", "patient": {"id": f"PAT-{i}"}, "items": [{"serviceCode": "J18.9"}]} for i in range(5)]
+    def bundle_response(request, context):
+        bundle = json.loads(gzip.decompress(request.body))
+        entries = []
+        for entry in bundle["entry"]:
+            if entry["fullUrl"].endswith("BULK-3"):
+                outcome = {"resourceType": "OperationOutcome", "issue": [{"severity": "error", "code": "invalid", "diagnostics": "Duplicate claim"}]}
+                entries.append({"response": {"status": "400 Bad Request", "outcome": outcome}})
+            else:
+                entries.append({"response": {"status": "201 Created", "location": f"Claim/{entry['fullUrl'][9:]}/_history/1"}})
+        return {"resourceType": "Bundle", "type": "transaction-response", "entry": entries}
+    mocked_api.post(MOCK_BASE_URL, json=bundle_response)
+    results = connector.submit_claims(claims, max_bundle_entries=2, compress=True, bundle_type="batch")
+    bundle_requests = [r for r in mocked_api.request_history if r.url.rstrip("/") == MOCK_BASE_URL]
+    assert len(bundle_requests) == 3
+    assert all(r.headers["Content-Encoding"] == "gzip" for r in bundle_requests)
+    assert [r["claimNumber"] for r in results] == [c["claimNumber"] for c in claims]
+    assert [r["success"] for r in results] == [True, True, True, False, True]
+    assert results[0]["location"] == "Claim/BULK-0/_history/1"
+    assert results[3]["error"] == "Duplicate claim"
+def test_submit_claims_marks_failed_bundle_claims(connector, mocked_api):
+    if IS_REAL_MODE:
+        pytest.skip("Bulk submission test is only for mock mode.")
+    mocked_api.post(MOCK_BASE_URL, status_code=400, text="Bad bundle")
+    claims = [{"claimNumber": "BULK-A", "items": []}, {"claimNumber": "BULK-B", "items": []}]
+    results = connector.submit_claims(claims)
+    assert [r["success"] for r in results] == [False, False]
+    assert "400" in results[0]["error"]
+@pytest.mark.parametrize("body", [
+    ["not", "a", "bundle"],
+    "Service unavailable",
+    {"resourceType": "OperationOutcome", "issue": [{"severity": "error", "code": "processing", "diagnostics": "Payer offline"}]},
+    {"resourceType": "Bundle", "entry": "oops"},
+])
+def test_submit_claims_rejects_malformed_responses(connector, mocked_api, body):
+    if IS_REAL_MODE:
+        pytest.skip("Bulk submission test is only for mock mode.")
+    mocked_api.post(MOCK_BASE_URL, json=body)
+    results = connector.submit_claims([{"claimNumber": "BULK-A", "items": []}])
+    assert not results[0]["success"] and results[0]["error"]
+def test_operation_outcome_response_raises_api_error(connector):
+    with pytest.raises(NphiesAPIError, match="Payer offline"):
+        connector._parse_bundle_response([{}], {"resourceType": "OperationOutcome", "issue": [{"diagnostics": "Payer offline"}]})
+def sample_nphies_profile_bundle() -> Dict[str, Any]:
+    """Returns a Claim Bundle that satisfies the full nphies Claim profile."""
+    bundle = sample_pneumonia_fhir_bundle()
+    bundle["entry"][0]["resource"].update({
+        "type": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/claim-type", "code": "institutional"}]},
+        "created": "2024-05-01T10:00:00+03:00",
+        "provider": {"reference": "Organization/PROVIDER-001"},
+        "priority": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/processpriority", "code": "normal"}]},
+        "insurance": [{"sequence": 1, "focal": True, "coverage": {"reference": "Coverage/COV-001"}}],
+        "total": {"value": 1000.0, "currency": "SAR"},
+    })
+    return bundle
+def test_nphies_profile_collects_all_errors(connector):
+    """The nphies profile is stricter than the toy schema and reports every violation at once."""
+    connector._validate_fhir(sample_nphies_profile_bundle(), connector.NPHIES_CLAIM_BUNDLE_SCHEMA)
+    with pytest.raises(NphiesValidationError) as excinfo:
+        connector._validate_fhir(sample_pneumonia_fhir_bundle(), connector.NPHIES_CLAIM_BUNDLE_SCHEMA)
+    missing = {e["message"] for e in excinfo.value.errors}
+    assert {"'created' is a required property", "'provider' is a required property", "'insurance' is a required property"} <= missing
+    assert all(e["path"] == "entry/0/resource" for e in excinfo.value.errors)
+def test_validators_are_compiled_once():
+    from src.backend.fhir_validation import FhirValidatorRegistry, NPHIES_CLAIM_BUNDLE_SCHEMA
+    registry = FhirValidatorRegistry()
+    first = registry.validator_for(NPHIES_CLAIM_BUNDLE_SCHEMA)
+    assert registry.validator_for(NPHIES_CLAIM_BUNDLE_SCHEMA) is first
+    assert registry.is_valid(sample_nphies_profile_bundle(), NPHIES_CLAIM_BUNDLE_SCHEMA)
+    assert len(registry) == 1
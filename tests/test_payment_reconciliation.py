@@ -0,0 +1,116 @@
+import json
+from datetime import date
+import pytest
+import sqlalchemy
+from src.backend.payment_reconciliation import (
+    AMBIGUOUS, INVALID, MATCHED, OVERPAID, UNDERPAID, UNMATCHED, ClaimIndex, ClaimRecord, PaymentReconciler,
+    iter_remittance_rows, load_claim_index, main, payment_notice_bundles, record_payments, to_cents,
+)
+# SQLite stand-in for the parts of sql/schema.sql used by reconciliation.
+SQLITE_SCHEMA = [
+    """CREATE TABLE claims (id TEXT PRIMARY KEY, encounter_id TEXT, claim_payload TEXT, claim_number TEXT UNIQUE,
+       status TEXT NOT NULL DEFAULT 'DRAFT', submitted_at TIMESTAMP, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE payments (id TEXT PRIMARY KEY, claim_id TEXT REFERENCES claims(id), amount NUMERIC, currency TEXT,
+       payment_payload TEXT, reconciled BOOLEAN DEFAULT FALSE, received_at TIMESTAMP, created_at TIMESTAMP)""",
+]
+CLAIMS = [
+    ClaimRecord("c-1", "CLAIM-1", 100_00, date(2024, 1, 10)),
+    ClaimRecord("c-2", "CLAIM-2", 250_50, date(2024, 1, 10)),
+    ClaimRecord("c-3", "CLAIM-3", 75_00, date(2024, 1, 12)),
+    ClaimRecord("c-4", "CLAIM-4", 75_00, date(2024, 1, 15)),
+    ClaimRecord("c-5", "CLAIM-5", 40_00, date(2023, 1, 1)),
+]
+def reconcile(rows, claims=CLAIMS, tolerance=1):
+    reconciler = PaymentReconciler(ClaimIndex(claims, tolerance), date_window_days=90)
+    return reconciler, list(reconciler.reconcile(enumerate(rows, 1)))
+@pytest.fixture
+def db(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'claims.db'}")
+    with engine.begin() as conn:
+        for ddl in SQLITE_SCHEMA:
+            conn.execute(sqlalchemy.text(ddl))
+        conn.execute(sqlalchemy.text(
+            "INSERT INTO claims (id, claim_number, claim_payload, submitted_at) VALUES (:id, :number, :payload, :submitted)"), [
+            {"id": c.claim_id, "number": c.claim_number, "payload": json.dumps({"total": c.expected_cents / 100}),
+             "submitted": f"{c.submitted_on} 09:00:00"} for c in CLAIMS
+        ] + [{"id": "c-6", "number": "CLAIM-6", "payload": json.dumps({"items": []}), "submitted": None}])
+    return engine
+def test_amounts_parse_exactly_into_cents():
+    assert to_cents("250.505") == 250_51 and to_cents("1,000.1") == 1000_10 and to_cents(0.29) == 29
+    with pytest.raises(ValueError):
+        to_cents("n/a")
+def test_split_under_and_over_payments_accumulate_per_claim():
+    reconciler, results = reconcile([
+        {"claim_number": "CLAIM-1", "amount": "60.00", "paid_date": "2024-02-01"},
+        {"claimNumber": "CLAIM-1", "amount": "40.00", "paymentDate": "2024-02-03"},
+        {"claim_number": "CLAIM-2", "amount": "200.00"},
+        {"claim_number": "CLAIM-1", "amount": "5.00"},
+        {"claim_number": "CLAIM-9", "amount": "12.34"},
+        {"claim_number": "CLAIM-2"},
+    ])
+    assert [r.outcome for r in results] == [UNDERPAID, MATCHED, UNDERPAID, OVERPAID, UNMATCHED, INVALID]
+    assert results[1].paid_to_date_cents == 100_00 and results[2].difference_cents == -50_50
+    assert results[3].to_dict()["difference"] == 5.0 and results[5].error == "Missing amount."
+    summary = reconciler.summary()
+    assert summary["records"] == 6 and summary[MATCHED] == 1 and summary["claims_short_paid"] == 1
+    assert summary["claims_paid"] == 2 and summary["claims_unpaid"] == 3
+def test_amount_and_date_fallback_requires_a_unique_unpaid_claim():
+    _, results = reconcile([
+        {"amount": "75.00", "paid_date": "2024-01-13"},   # CLAIM-4 was not yet submitted
+        {"amount": "75.00", "paid_date": "2024-01-20"},   # CLAIM-4 is the only unpaid candidate left
+        {"amount": "75.00", "paid_date": "2024-01-21"},   # Both are paid now
+        {"amount": "40.00", "paid_date": "2024-02-01"},   # CLAIM-5 is outside the date window
+        {"claim_number": "UNKNOWN", "amount": "250.51"},  # Within a cent of CLAIM-2
+    ])
+    assert [(r.outcome, r.claim and r.claim.claim_number) for r in results] == [
+        (MATCHED, "CLAIM-3"), (MATCHED, "CLAIM-4"), (UNMATCHED, None), (UNMATCHED, None), (MATCHED, "CLAIM-2")]
+    assert {r.matched_by for r in results if r.claim} == {"amount_date"}
+    _, results = reconcile([{"amount": "75.00", "paid_date": "2024-01-20"}])
+    assert results[0].outcome == AMBIGUOUS
+def test_payment_notices_are_bundled_for_matched_lines():
+    _, results = reconcile([
+        {"claim_number": "CLAIM-1", "amount": "100", "paid_date": "2024-02-01", "payment_ref": "EFT-1"},
+        {"claim_number": "CLAIM-9", "amount": "1"},
+        {"claim_number": "CLAIM-2", "amount": "100"},
+        {"claim_number": "CLAIM-3", "amount": "75", "currency": "USD"},
+    ])
+    bundles = list(payment_notice_bundles(results, max_entries=2))
+    assert [len(b["entry"]) for b in bundles] == [2, 1] and bundles[0]["type"] == "batch"
+    first = bundles[0]["entry"][0]
+    assert first["request"] == {"method": "POST", "url": "PaymentNotice"}
+    notice = first["resource"]
+    assert notice["request"] == {"reference": "Claim/CLAIM-1"} and notice["amount"] == {"value": 100.0, "currency": "SAR"}
+    assert notice["paymentDate"] == "2024-02-01" and notice["identifier"] == [{"value": "EFT-1"}]
+    assert notice["paymentStatus"]["coding"][0]["code"] == "paid"
+    short = bundles[0]["entry"][1]["resource"]  # CLAIM-2 is still owed 150.50
+    assert "paymentStatus" not in short and [e.get("valueCode") or e["valueMoney"]["value"] for e in short["extension"]] == ["underpaid", -150.5]
+    assert bundles[1]["entry"][0]["resource"]["amount"]["currency"] == "USD"
+def test_claim_index_loads_in_pages_and_payments_are_recorded(db):
+    index = load_claim_index(db, page_size=2)
+    assert len(index) == 5 and index.by_number["CLAIM-2"] == CLAIMS[1]  # CLAIM-6 has no total
+    reconciler = PaymentReconciler(index)
+    rows = [{"claim_number": "CLAIM-1", "amount": "100", "paid_date": "2024-02-01"}, {"claim_number": "CLAIM-2", "amount": "1"},
+            {"claim_number": "NOPE", "amount": "3"}]
+    assert len(list(record_payments(db, reconciler.reconcile(enumerate(rows, 1)), batch_size=1))) == 3
+    with db.connect() as conn:
+        payments = conn.execute(sqlalchemy.text("SELECT claim_id, amount, reconciled FROM payments ORDER BY claim_id")).all()
+    assert [tuple(p) for p in payments] == [("c-1", 100, 1), ("c-2", 1, 0)]
+def test_cli_streams_remittance_file_to_results_and_notices(db, tmp_path, capsys):
+    remittance = tmp_path / "remittance.csv"
+    remittance.write_text("claim_number,amount,paid_date,payment_id\nCLAIM-1,100.00,2024-02-01,EFT-1\n,75.00,2024-01-13,EFT-2\n")
+    assert list(iter_remittance_rows(str(remittance)))[1] == (2, {"claim_number": "", "amount": "75.00",
+                                                                  "paid_date": "2024-01-13", "payment_id": "EFT-2"})
+    results, notices = tmp_path / "results.ndjson", tmp_path / "notices.ndjson"
+    assert main(["--database-url", str(db.url), "--input", str(remittance), "--results", str(results),
+                 "--notices", str(notices)]) == 0
+    assert [json.loads(line)["claim_id"] for line in results.read_text().splitlines()] == ["c-1", "c-3"]
+    assert len(json.loads(notices.read_text())["entry"]) == 2
+    assert json.loads(capsys.readouterr().out)[MATCHED] == 2
+def test_malformed_ndjson_lines_are_invalid_results_not_fatal(tmp_path):
+    remittance = tmp_path / "remittance.ndjson"
+    remittance.write_text('{"claim_number": "CLAIM-1", "amount": "100"}\n{"claim_number": "CLAIM-2", "amo\n\n[]\n"x"\n'
+                          '{"claim_number": "CLAIM-3", "amount": "75"}\n')
+    reconciler = PaymentReconciler(ClaimIndex(CLAIMS))
+    results = list(reconciler.reconcile(iter_remittance_rows(str(remittance))))
+    assert [(r.record.line, r.outcome) for r in results] == [(1, MATCHED), (2, INVALID), (3, INVALID), (4, INVALID), (5, MATCHED)]
+    assert results[1].error.startswith("Malformed JSON") and results[2].error == "Expected a JSON object, got list."
@@ -0,0 +1,96 @@
+import time
+import pytest
+from src.backend.nphies_connector import NphiesAPIError, NphiesConnector
+from src.backend.rate_limiter import AIMDLimiter, NphiesRateLimiter, TokenBucket, is_retryable, jittered_backoff, parse_retry_after
+MOCK_BASE_URL = "https://mock-nphies.sa/api"
+@pytest.fixture
+def mocked_api(requests_mock):
+    requests_mock.post(f"{MOCK_BASE_URL}/oauth/token", json={"access_token": "mock_token_12345", "expires_in": 3600})
+    yield requests_mock
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:10 GMT", now=1445412480.0) == pytest.approx(10.0)
+    assert parse_retry_after("soon") is None and parse_retry_after(None) is None
+    assert all(0 <= jittered_backoff(3, base=1, cap=5) <= 5 for _ in range(50))
+def test_token_bucket_enforces_rate_and_pause():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+    bucket.pause(0.2)
+    assert not bucket.try_acquire()
+    with pytest.raises(TimeoutError):
+        bucket.acquire(timeout=0.05)
+def test_aimd_limit_backs_off_once_per_cooldown_and_recovers():
+    limiter = AIMDLimiter(initial=16, cooldown=60)
+    for _ in range(4):
+        limiter.acquire()
+    for _ in range(4):
+        limiter.release(congested=True)
+    assert limiter.limit == 8
+    for _ in range(40):
+        limiter.acquire()
+        limiter.release(congested=False)
+    assert limiter.limit > 8
+def test_classify_endpoints():
+    classify = NphiesRateLimiter.classify
+    assert classify("POST", "/Claim") == "claim" and classify("POST", "") == "claim"
+    assert classify("GET", "/Claim/ABC-1") == "status"
+    assert classify("POST", "/PaymentNotice") == "payment"
+def test_connector_honors_retry_after_and_reports_metrics(mocked_api):
+    mocked_api.get(f"{MOCK_BASE_URL}/Claim/C-1", [
+        {"status_code": 429, "headers": {"Retry-After": "0.1"}, "json": {}},
+        {"status_code": 503, "json": {}},
+        {"status_code": 200, "json": {"status": "active"}},
+    ])
+    limiter = NphiesRateLimiter()
+    connector = NphiesConnector(MOCK_BASE_URL, "client", "secret", rate_limiter=limiter, backoff_base=0.01)
+    start = time.monotonic()
+    assert connector.check_status("C-1")["status"] == "FC_3"
+    assert time.monotonic() - start >= 0.1
+    status = limiter.metrics()["status"]
+    assert (status["requests"], status["throttled_429"], status["server_errors"]) == (3, 1, 1)
+    assert (status["retries"], status["retry_after_honored"]) == (2, 1)
+    assert status["concurrency_limit"] < 16
+    assert limiter.metrics()["claim"]["requests"] == 0
+def test_connector_without_a_limiter_still_waits_out_retry_after(mocked_api):
+    route = mocked_api.get(f"{MOCK_BASE_URL}/Claim/C-4", [
+        {"status_code": 429, "headers": {"Retry-After": "0.1"}, "json": {}},
+        {"status_code": 200, "json": {"status": "active"}},
+    ])
+    connector = NphiesConnector(MOCK_BASE_URL, "client", "secret")
+    start = time.monotonic()
+    assert connector.rate_limiter is None and connector.check_status("C-4")["status"] == "FC_3"
+    assert time.monotonic() - start >= 0.1 and route.call_count == 2
+def test_connector_gives_up_after_max_retries(mocked_api):
+    route = mocked_api.get(f"{MOCK_BASE_URL}/Claim/C-3", status_code=500, json={})
+    connector = NphiesConnector(MOCK_BASE_URL, "client", "secret", max_retries=2, backoff_base=0.001)
+    with pytest.raises(NphiesAPIError):
+        connector.check_status("C-3")
+    assert route.call_count == 3
+    long_pause = mocked_api.get(f"{MOCK_BASE_URL}/Claim/C-2", status_code=429, headers={"Retry-After": "3600"}, json={})
+    with pytest.raises(NphiesAPIError):
+        connector.check_status("C-2")
+    assert long_pause.call_count == 1
+def test_posts_are_not_retried_after_server_errors(mocked_api):
+    payment = mocked_api.post(f"{MOCK_BASE_URL}/PaymentNotice", status_code=502, json={})
+    connector = NphiesConnector(MOCK_BASE_URL, "client", "secret", max_retries=2, backoff_base=0.001)
+    with pytest.raises(NphiesAPIError):
+        connector.reconcile_payment({"amount": 1})
+    assert payment.call_count == 1  # The notice may have been recorded before the 502
+    claim = mocked_api.post(f"{MOCK_BASE_URL}/Claim", [
+        {"status_code": 503, "headers": {"Retry-After": "0"}, "json": {}},
+        {"status_code": 429, "json": {}},
+        {"status_code": 200, "json": {"id": "1"}},
+    ])
+    assert connector.request_pre_auth({"claimNumber": "P-1"}) == {"id": "1"}
+    assert claim.call_count == 3
+    assert is_retryable("GET", 504) and not is_retryable("POST", 504) and not is_retryable("POST", 503)
+def test_endpoint_pause_respects_timeout():
+    limiter = NphiesRateLimiter()
+    limiter.endpoint("status").pause(5)
+    with pytest.raises(TimeoutError):
+        with limiter.slot("GET", "/Claim/C-1", timeout=0.01):
+            pass
+    assert limiter.endpoint("claim").bucket.rate == NphiesRateLimiter.DEFAULT_LIMITS["claim"]["rate"]
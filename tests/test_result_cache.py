@@ -0,0 +1,82 @@
+import time
+from src.backend.cdi_rules import CDIRuleEngine
+from src.backend.coding_engine import CodingEngine
+from src.backend.result_cache import ResultCache, SQLiteCacheStore, cache_key
+RULE = {"id": "pneumonia_specificity", "keyword": "pneumonia", "negation_keywords": ["viral"],
+        "nudge": {"id": "pneumonia_specificity", "severity": "warning", "prompt": "Specify the organism."}}
+class CountingEngine(CodingEngine):
+    calls = 0
+    def _placeholder_nlp(self, text):
+        type(self).calls += 1
+        return super()._placeholder_nlp(text)
+def test_key_ignores_case_and_surrounding_whitespace_only():
+    assert cache_key("coding", "v1", "Pneumonia\r\n") == cache_key("coding", "v1", "  pneumonia")
+    assert cache_key("coding", "v1", "pneumonia") != cache_key("coding", "v2", "pneumonia")
+    assert cache_key("coding", "v1", "acute  pneumonia") != cache_key("coding", "v1", "acute pneumonia")
+def test_lru_eviction_and_ttl():
+    cache = ResultCache(max_entries=2, ttl_seconds=0.05)
+    cache.set("a", [1])
+    cache.set("b", [2])
+    assert cache.get("a") == [1]
+    cache.set("c", [3])  # Evicts "b", the least recently used
+    assert cache.get("b") is None and cache.stats()["evictions"] == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None and cache.stats()["expired"] == 1
+def test_hits_return_independent_copies():
+    cache = ResultCache()
+    cache.set("k", [{"code": "J18.9"}])
+    cache.get("k")[0]["code"] = "changed"
+    assert cache.get("k") == [{"code": "J18.9"}]
+def test_sqlite_tier_survives_a_new_process_cache(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ResultCache(store=SQLiteCacheStore(path)).set("k", {"v": 1})
+    warm = ResultCache(store=SQLiteCacheStore(path))
+    assert warm.get("k") == {"v": 1} and warm.get("k") == {"v": 1}
+    stats = warm.stats()
+    assert stats["store_hits"] == 1 and stats["memory_hits"] == 1 and stats["misses"] == 0
+def test_coding_engine_reuses_nlp_but_not_submission():
+    CountingEngine.calls = 0
+    submitted = []
+    class Connector:
+        def submit_claim(self, claim):
+            submitted.append(claim["claimNumber"])
+    engine = CountingEngine(nphies_connector=Connector(), result_cache=ResultCache())
+    meta = {"id": "enc-1", "visit_complexity": "low-complexity outpatient"}
+    first = engine.run_coding_job("Myocardial infarction.", meta)
+    second = engine.run_coding_job("  MYOCARDIAL INFARCTION.  ", meta)
+    assert CountingEngine.calls == 1
+    assert first["suggested_codes"] == second["suggested_codes"]
+    assert second["source_text"] == "  MYOCARDIAL INFARCTION.  "
+    assert submitted == ["CLAIM-enc-1", "CLAIM-enc-1"]
+def test_coding_cache_invalidated_when_dictionary_changes():
+    class Engine(CountingEngine):
+        TERM_TO_CODE_MAP = dict(CodingEngine.TERM_TO_CODE_MAP)
+    Engine.calls = 0
+    engine = Engine(result_cache=ResultCache())
+    assert engine.run_coding_job("Hypertension.", {})["suggested_codes"] == []
+    Engine.TERM_TO_CODE_MAP["hypertension"] = {"code": "I10", "desc": "Essential hypertension", "confidence": 0.9}
+    assert [c["code"] for c in engine.run_coding_job("Hypertension.", {})["suggested_codes"]] == ["I10"]
+    assert Engine.calls == 2
+def test_coding_cache_invalidated_by_same_size_dictionary_edit():
+    class Engine(CountingEngine):
+        TERM_TO_CODE_MAP = dict(CodingEngine.TERM_TO_CODE_MAP)
+    Engine.calls = 0
+    engine = Engine(result_cache=ResultCache())
+    version = engine.nlp_version
+    assert [c["code"] for c in engine.run_coding_job("Pneumonia.", {})["suggested_codes"]] == ["J18.9"]
+    Engine.TERM_TO_CODE_MAP["pneumonia"] = {"code": "J15.9", "desc": "Bacterial pneumonia", "confidence": 0.85}
+    assert engine.nlp_version != version
+    assert [c["code"] for c in engine.run_coding_job("Pneumonia.", {})["suggested_codes"]] == ["J15.9"]
+    assert Engine.calls == 2 and CodingEngine().nlp_version == version  # The frozen default is untouched
+def test_cdi_cache_invalidated_on_rule_reload(tmp_path):
+    cache = ResultCache()
+    engine = CDIRuleEngine(base_rules=[RULE], result_cache=cache)
+    note = "Patient has pneumonia."
+    assert [n["id"] for n in engine.evaluate(note)] == ["pneumonia_specificity"]
+    engine.evaluate(note)
+    assert cache.stats()["hits"] == 1
+    pack = tmp_path / "pack.json"
+    pack.write_text('[{"id": "extra", "keyword": "pneumonia", "nudge": {"id": "extra", "severity": "info", "prompt": "p"}}]')
+    engine.reload([str(pack)])
+    assert {n["id"] for n in engine.evaluate(note)} == {"pneumonia_specificity", "extra"}
+    assert cache.stats()["misses"] == 2
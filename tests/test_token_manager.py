@@ -0,0 +1,94 @@
+import os
+import stat
+import threading
+import time
+from src.backend.nphies_connector import NphiesConnector
+from src.backend.token_manager import OAuthTokenManager, default_token_cache_path
+MOCK_BASE_URL = "https://mock-nphies.sa/api"
+class CountingFetcher:
+    def __init__(self, expires_in=3600, delay=0.0):
+        self.calls = 0
+        self.expires_in = expires_in
+        self.delay = delay
+        self.lock = threading.Lock()
+    def __call__(self):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls += 1
+            n = self.calls
+        return {"access_token": f"token-{n}", "expires_at": time.time() + self.expires_in}
+def test_concurrent_callers_trigger_single_refresh():
+    fetcher = CountingFetcher(delay=0.05)
+    manager = OAuthTokenManager(fetcher)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(manager.get_token())) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert fetcher.calls == 1 and set(tokens) == {"token-1"}
+def test_invalidate_only_drops_the_rejected_token():
+    fetcher = CountingFetcher()
+    manager = OAuthTokenManager(fetcher)
+    stale = manager.get_token()
+    manager.invalidate(stale)
+    assert manager.get_token() == "token-2"
+    # A late 401 for the already-replaced token must not force another refresh.
+    manager.invalidate(stale)
+    assert manager.get_token() == "token-2" and fetcher.calls == 2
+def test_file_cache_shares_token_across_managers(tmp_path):
+    cache_path = str(tmp_path / "token.json")
+    first_fetcher, second_fetcher = CountingFetcher(), CountingFetcher()
+    first = OAuthTokenManager(first_fetcher, cache_path=cache_path)
+    second = OAuthTokenManager(second_fetcher, cache_path=cache_path)
+    assert first.get_token() == second.get_token() == "token-1"
+    assert (first_fetcher.calls, second_fetcher.calls) == (1, 0)
+def test_background_refresh_renews_before_expiry():
+    fetcher = CountingFetcher(expires_in=1.0)
+    manager = OAuthTokenManager(fetcher, refresh_margin=0.1)
+    manager.get_token()
+    manager.start_background_refresh(lead_time=0.5)
+    try:
+        deadline = time.time() + 3
+        while fetcher.calls < 2 and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        manager.stop_background_refresh()
+    assert fetcher.calls >= 2
+    assert manager.expires_at > time.time()
+def test_background_refresh_does_not_spin_on_short_lived_tokens():
+    fetcher = CountingFetcher(expires_in=0.3)  # Shorter than the lead time
+    manager = OAuthTokenManager(fetcher, refresh_margin=0.1)
+    manager.start_background_refresh(lead_time=0.5, retry_interval=0.1)
+    time.sleep(0.5)
+    manager.stop_background_refresh()
+    assert 1 <= fetcher.calls <= 6
+def test_shared_token_files_are_private(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    path = default_token_cache_path(MOCK_BASE_URL, "client")
+    assert os.path.dirname(path) == str(tmp_path / "nphies") and stat.S_IMODE(os.stat(tmp_path / "nphies").st_mode) == 0o700
+    manager = OAuthTokenManager(CountingFetcher(), cache_path=path)
+    manager.invalidate(manager.get_token())
+    for suffix in ("", ".lock"):
+        assert stat.S_IMODE(os.stat(path + suffix).st_mode) == 0o600
+def test_connectors_share_one_token_manager(requests_mock):
+    token_route = requests_mock.post(f"{MOCK_BASE_URL}/oauth/token", json={"access_token": "shared", "expires_in": 3600})
+    requests_mock.get(f"{MOCK_BASE_URL}/Claim/C-1", json={"status": "active"})
+    first = NphiesConnector(MOCK_BASE_URL, "client", "secret")
+    second = NphiesConnector(MOCK_BASE_URL, "client", "secret", token_manager=first.token_manager)
+    first.check_status("C-1")
+    second.check_status("C-1")
+    assert token_route.call_count == 1
+def test_401_replay_refreshes_token_once(requests_mock):
+    tokens = iter(["expired", "fresh"])
+    token_route = requests_mock.post(f"{MOCK_BASE_URL}/oauth/token",
+                                     json=lambda request, context: {"access_token": next(tokens), "expires_in": 3600})
+    def claim(request, context):
+        if request.headers["Authorization"] == "Bearer expired":
+            context.status_code = 401
+            return {"error": "invalid token"}
+        return {"status": "active"}
+    requests_mock.get(f"{MOCK_BASE_URL}/Claim/C-1", json=claim)
+    connector = NphiesConnector(MOCK_BASE_URL, "client", "secret")
+    assert connector.check_status("C-1")["status"] == "FC_3"
+    assert token_route.call_count == 2